@@ -13,23 +13,32 @@ from click_plugins import with_plugins
 from click_loguru import ClickLoguru
 
 # module imports
+from .clusterorder import cluster_order_query as undeco_cluster_order_query
 from .common import INSTALL_PATH
 from .common import SEARCH_PATHS
 from .common import NAME
 from .common import logger
 from .core import homology_cluster as undeco_homology_cluster
 from .core import cluster_in_steps as undeco_cluster_in_steps
+from .executor import SCHEDULERS
 from .homology import cluster_build_trees as undeco_cluster_build_trees
+from .homology import gather_homology
 from .homology import info_to_fasta as undeco_into_to_fasta
 from .ingest import find_files as undeco_find_files
+from .ingest import gather_ingest
 from .ingest import ingest_sequences as undeco_ingest_sequences
 from .installer import DependencyInstaller
+from .manifest import print_status as undeco_print_status
 from .parquet import parquet_to_tsv as undeco_parquet_to_tsv
 from .proxy import calculate_proxy_genes as undeco_calculate_proxy_genes
+from .shards import parse_shard_option
+from .synteny import gather_synteny
 from .synteny import intersect_anchors as undeco_intersect_anchors
 from .synteny import synteny_anchors as undeco_synteny_anchors
 from .taxonomy import print_taxonomic_ranks
 from .taxonomy import rankname_to_number
+from .toolcache import DEFAULT_TOOL_CACHE
+from .toolcache import DEFAULT_TOOL_CACHE_MB
 
 # global constants
 LOG_FILE_RETENTION = 3
@@ -145,6 +154,11 @@ DEPENDENCY_DICT = {
 }
 DEFAULT_K = 2
 DEFAULT_STEPS = 16
+GATHER_FUNCTIONS = {
+    "ingest": gather_ingest,
+    "homology": gather_homology,
+    "synteny": gather_synteny,
+}
 
 # set locale so grouping works
 for localename in ["en_US", "en_US.utf8", "English_United_States"]:
@@ -181,6 +195,46 @@ click_loguru = ClickLoguru(
     help="Process in parallel.",
     callback=click_loguru.user_global_options_callback,
 )
+@click.option(
+    "--scheduler",
+    type=click.Choice(SCHEDULERS),
+    default=None,
+    help="Dask scheduler, by default processes or sync if --no-parallel.",
+    callback=click_loguru.user_global_options_callback,
+)
+@click.option(
+    "--workers",
+    type=int,
+    default=None,
+    help="Number of worker processes, or threads if --scheduler threads.",
+    callback=click_loguru.user_global_options_callback,
+)
+@click.option(
+    "--threads_per_worker",
+    type=int,
+    default=None,
+    help="Threads per worker of --scheduler distributed.",
+    callback=click_loguru.user_global_options_callback,
+)
+@click.option(
+    "--partition_size",
+    type=int,
+    default=None,
+    help="Items per dask partition.",
+    callback=click_loguru.user_global_options_callback,
+)
+@click.option(
+    "--memory_limit",
+    default=None,
+    help="Memory per worker of --scheduler distributed, e.g. 4GB.",
+    callback=click_loguru.user_global_options_callback,
+)
+@click.option(
+    "--max_memory",
+    default=None,
+    help="Memory budget of concurrent per-proteome tasks, e.g. 200GB.",
+    callback=click_loguru.user_global_options_callback,
+)
 @click.version_option(version=__version__, prog_name=NAME)
 def cli(warnings_as_errors, parallel, **kwargs):
     """Azulejo -- tiling genes in subtrees across phylogenetic space.
@@ -261,18 +315,61 @@ def install(dependencies, force, accept_licenses):
     show_default=True,
     help="Use pre-existing homology clusters.",
 )
+@click.option(
+    "--shard",
+    default=None,
+    callback=parse_shard_option,
+    help="Run only shard i of N (as i/N) and save for gather. [default: all]",
+)
+@click.option(
+    "--force/--no-force",
+    default=False,
+    is_flag=True,
+    show_default=True,
+    help="Recalculate even if the manifest shows outputs are current.",
+)
+@click.option(
+    "--tool_cache",
+    type=click.Path(file_okay=False),
+    default=str(DEFAULT_TOOL_CACHE),
+    show_default=True,
+    help="Directory of cached usearch and muscle outputs.",
+)
+@click.option(
+    "--tool_cache_mb",
+    default=DEFAULT_TOOL_CACHE_MB,
+    show_default=True,
+    help="Size limit of the tool cache in MB, 0 to disable.",
+)
 @click.argument("setname")
-def homology(identity, setname, cluster_file):
+def homology(
+    identity, setname, cluster_file, shard, force, tool_cache, tool_cache_mb
+):
     """
     Calculate homology clusters, MSAs, trees.
 
+    With --shard, clusters are calculated by the first shard to start,
+    then each shard aligns its slice of clusters.
+    Nothing is recalculated if inputs, parameters and tool versions
+    recorded in the set's manifest are unchanged, unless --force is given.
+    Alignments, trees and clusters of unchanged sequences are reused from
+    the tool cache, with hit rates logged at the end.
+
     \b
     Example:
         azulejo homology glycines
+        azulejo homology --shard 0/8 glycines
 
     """
     undeco_cluster_build_trees(
-        identity, setname, cluster_file=cluster_file, click_loguru=click_loguru
+        identity,
+        setname,
+        cluster_file=cluster_file,
+        click_loguru=click_loguru,
+        shard=shard,
+        force=force,
+        tool_cache_dir=tool_cache,
+        tool_cache_mb=tool_cache_mb,
     )
 
 
@@ -298,7 +395,11 @@ def parquet_to_fasta(parquetfile, fastafile, append):
 @click_loguru.log_elapsed_time(level="info")
 @click_loguru.log_peak_memory_use(level="info")
 @click.option(
-    "-k", default=DEFAULT_K, help="Synteny anchor length.", show_default=True
+    "-k",
+    "--k",
+    default=str(DEFAULT_K),
+    help="Synteny anchor length, or comma-separated lengths.",
+    show_default=True,
 )
 @click.option(
     "--peatmer/--kmer",
@@ -328,40 +429,180 @@ def parquet_to_fasta(parquetfile, fastafile, append):
     show_default=True,
     help="Disambig only anchors adj to unambig.",
 )
+@click.option(
+    "--resident/--no-resident",
+    default=False,
+    is_flag=True,
+    show_default=True,
+    help="Keep proteomes in worker memory between passes.",
+)
+@click.option(
+    "--hash_bits",
+    default="32",
+    type=click.Choice(["32", "64"]),
+    show_default=True,
+    help="Width of synteny hashes.",
+)
+@click.option(
+    "--incremental/--no-incremental",
+    default=False,
+    is_flag=True,
+    show_default=True,
+    help="Rehash only new or changed proteomes.",
+)
+@click.option(
+    "--prune/--no-prune",
+    default=False,
+    is_flag=True,
+    show_default=True,
+    help="Drop hashes unique to one proteome before merging.",
+)
+@click.option(
+    "--subset",
+    multiple=True,
+    help="Query on proteome columns selecting a subset; may be repeated.",
+)
+@click.option(
+    "--profile/--no-profile",
+    default=False,
+    is_flag=True,
+    show_default=True,
+    help="Profile passes and merges with cProfile.",
+)
+@click.option(
+    "--write_behind/--no-write_behind",
+    default=False,
+    is_flag=True,
+    show_default=True,
+    help="Compress and write proteome files in background threads.",
+)
+@click.option(
+    "--shard",
+    default=None,
+    callback=parse_shard_option,
+    help="Run only shard i of N (as i/N) and save for gather. [default: all]",
+)
+@click.option(
+    "--force/--no-force",
+    default=False,
+    is_flag=True,
+    show_default=True,
+    help="Recalculate even if the manifest shows outputs are current.",
+)
 @click.argument("setname")
-def synteny(k, peatmer, setname, write_ambiguous, thorny, disambig_adj_only):
+def synteny(
+    k,
+    peatmer,
+    setname,
+    write_ambiguous,
+    thorny,
+    disambig_adj_only,
+    resident,
+    hash_bits,
+    incremental,
+    prune,
+    subset,
+    profile,
+    write_behind,
+    shard,
+    force,
+):
     """Calculate synteny anchors.
 
+    Several anchor lengths may be given at once (e.g., -k 3,5,8), in which
+    case they are calculated together and outputs are named by hash.
+    For sets large enough that 32-bit hashes collide, use --hash_bits 64.
+    Each --subset gives anchors among the proteomes it selects, reusing
+    per-proteome hashes, with outputs named by subset.
+    With --shard, each shard hashes its slice of proteomes, and anchors
+    are merged from the saved hashes by gather.
+    Anchors are not recalculated if inputs and parameters recorded in the
+    set's manifest are unchanged, unless --force is given.
+
     \b
     Example:
         azulejo synteny glycines
+        azulejo synteny --subset 'phy.genus == "Glycine"' glycines
+        azulejo synteny --shard 0/8 glycines
 
     """
+    try:
+        k_list = [int(k_str) for k_str in k.split(",")]
+    except ValueError:
+        logger.error(f"k must be a comma-separated list of integers, not {k}.")
+        sys.exit(1)
     undeco_synteny_anchors(
-        k,
+        k_list,
         peatmer,
         setname,
         click_loguru=click_loguru,
         write_ambiguous=write_ambiguous,
         thorny=thorny,
         disambig_adj_only=disambig_adj_only,
+        resident=resident,
+        hash_bits=int(hash_bits),
+        incremental=incremental,
+        prune=prune,
+        subsets=list(subset),
+        profile=profile,
+        write_behind=write_behind,
+        shard=shard,
+        force=force,
     )
 
 
 @cli.command()
 @click_loguru.init_logger()
 @click_loguru.log_elapsed_time(level="info")
+@click.option(
+    "--pairs_file",
+    default=None,
+    type=click.Path(writable=True),
+    help="Write overlapping pairs with Jaccard and containment.",
+)
 @click.argument("setname")
-@click.argument("compfile")
-def intersect_anchors(setname, compfile):
-    """Intersect two sets of synteny anchors.
+@click.argument("compfile", nargs=-1, required=True)
+def intersect_anchors(setname, compfile, pairs_file):
+    """Intersect a set of synteny anchors with one or more others.
 
     \b
     Example:
         azulejo intersect_anchors glycine7/synteny_anchors.tsv dagchainer_tool_out/synteny_anchors.tsv
 
     """
-    undeco_intersect_anchors(setname, compfile)
+    undeco_intersect_anchors(setname, compfile, pairs_file=pairs_file)
+
+
+@cli.command()
+@click_loguru.init_logger(logfile=False)
+@click.option(
+    "--fragment",
+    default=None,
+    help="Show only fragments with this ID.",
+)
+@click.option(
+    "--cluster",
+    default=None,
+    type=int,
+    help="Show positions of this homology cluster instead.",
+)
+@click.argument("setname")
+@click.argument("proteome", required=False)
+def cluster_order(setname, proteome, fragment, cluster):
+    """Print homology clusters in genome order, by fragment.
+
+    PROTEOME is a dotpath as in the set's proteome file; all proteomes
+    are shown if it is omitted.
+
+    \b
+    Example:
+        azulejo cluster-order glycines glycines.glyma.Wm82.gnm2.ann1
+        azulejo cluster-order --cluster 42 glycines
+
+    """
+    undeco_cluster_order_query(
+        setname, proteome=proteome, fragment=fragment, cluster=cluster
+    )
 
 
 @cli.command()
@@ -725,8 +966,14 @@ def find_files(
 @cli.command()
 @click_loguru.init_logger()
 @click_loguru.log_elapsed_time()
+@click.option(
+    "--shard",
+    default=None,
+    callback=parse_shard_option,
+    help="Run only shard i of N (as i/N) and save for gather. [default: all]",
+)
 @click.argument("input_toml")
-def ingest(input_toml):
+def ingest(input_toml, shard):
     """
     Marshal protein and genome sequence information.
 
@@ -736,9 +983,49 @@ def ingest(input_toml):
     \b
     Example:
         azulejo ingest glyma+glyso.toml
+        azulejo ingest --shard 0/8 glyma+glyso.toml
+
+    """
+    undeco_ingest_sequences(input_toml, click_loguru=click_loguru, shard=shard)
+
+
+@cli.command()
+@click_loguru.init_logger()
+@click_loguru.log_elapsed_time(level="info")
+@click_loguru.log_peak_memory_use(level="info")
+@click.argument("stage", type=click.Choice(list(GATHER_FUNCTIONS)))
+@click.argument("setname")
+def gather(stage, setname):
+    """
+    Merge the outputs of the shards of a stage and finish it.
+
+    Shard outputs are kept under SETNAME/shards/STAGE until gathered.
+    Remove that directory to start a sharded stage over.
+
+    \b
+    Example:
+        azulejo gather synteny glycines
+
+    """
+    GATHER_FUNCTIONS[stage](setname, click_loguru=click_loguru)
+
+
+@cli.command()
+@click_loguru.init_logger(logfile=False)
+@click.argument("setname")
+def status(setname):
+    """
+    Show which stage outputs of a set are stale.
+
+    Files of each stage are checked against the digests recorded in the
+    set's manifest when the stage last ran.
+
+    \b
+    Example:
+        azulejo status glycines
 
     """
-    undeco_ingest_sequences(input_toml, click_loguru=click_loguru)
+    undeco_print_status(setname)
 
 
 @cli.command()
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""Connected components of adjacency groups via vectorized union-find."""
+# standard library imports
+from pathlib import Path
+
+# third-party imports
+import numpy as np
+import pandas as pd
+
+# module imports
+from .common import hash_array
+
+# global constants
+RELATIONS = ["identity", "set1_subset", "set2_subset", "incongruent"]
+
+
+def dense_ids(values):
+    """Map values to dense integer ID's in order of first appearance.
+
+    Returns the ID array and the array of unique values.
+    """
+    codes, uniques = pd.factorize(np.asarray(values))
+    return codes, np.asarray(uniques)
+
+
+def star_edges(groups, nodes):
+    """Return edges joining the first node of each group to the others.
+
+    Groups need not be contiguous.  A star has the same connectivity as
+    the clique over each group, with one edge per node rather than n^2.
+    """
+    groups = np.asarray(groups)
+    nodes = np.asarray(nodes)
+    order = np.argsort(groups, kind="stable")
+    sorted_groups = groups[order]
+    sorted_nodes = nodes[order]
+    starts = np.flatnonzero(
+        np.insert(sorted_groups[1:] != sorted_groups[:-1], 0, True)
+    )
+    hubs = np.repeat(
+        sorted_nodes[starts], np.diff(np.append(starts, len(order)))
+    )
+    spokes = hubs != sorted_nodes
+    return hubs[spokes], sorted_nodes[spokes]
+
+
+def component_labels(n_nodes, src, dst):
+    """Label each node with the smallest node ID in its component.
+
+    Roots are hooked onto the smaller root across every edge, then
+    trees are flattened by pointer jumping, until all edges are internal.
+    """
+    labels = np.arange(n_nodes)
+    src = np.asarray(src, dtype=labels.dtype)
+    dst = np.asarray(dst, dtype=labels.dtype)
+    while True:
+        src_roots = labels[src]
+        dst_roots = labels[dst]
+        crossing = src_roots != dst_roots
+        if not crossing.any():
+            return labels
+        src_roots = src_roots[crossing]
+        dst_roots = dst_roots[crossing]
+        low_roots = np.minimum(src_roots, dst_roots)
+        np.minimum.at(labels, src_roots, low_roots)
+        np.minimum.at(labels, dst_roots, low_roots)
+        while True:
+            jumped = labels[labels]
+            if (jumped == labels).all():
+                break
+            labels = jumped
+
+
+def adjacency_components(groups, nodes, min_size=2):
+    """Return components of the graph linking nodes that share a group.
+
+    Components smaller than min_size are dropped.  Components are
+    numbered largest first, with ties in order of first appearance
+    of their nodes, and members are sorted within each component.
+    """
+    node_ids, members = dense_ids(nodes)
+    src, dst = star_edges(groups, node_ids)
+    labels = component_labels(len(members), src, dst)
+    sizes = np.bincount(labels, minlength=len(members))[labels]
+    member_rank = np.empty(len(members), dtype=np.int64)
+    member_rank[np.argsort(members, kind="stable")] = np.arange(len(members))
+    order = np.lexsort((member_rank, labels, -sizes))
+    order = order[sizes[order] >= min_size]
+    comp_labels = labels[order]
+    cluster_ids = np.cumsum(np.diff(comp_labels, prepend=-1) != 0) - 1
+    return pd.DataFrame(
+        {
+            "cluster_id": cluster_ids,
+            "size": sizes[order],
+            "members": members[order],
+        }
+    )
+
+
+def write_adjacency(comp_fr, outpath, hashes=True):
+    """Write members, summary, and histogram files for components.
+
+    Summary and histogram go next to outpath with "_summary" and "_hist"
+    added to its stem.  Returns numbers of items and clusters and the
+    size of the largest cluster.
+    """
+    outpath = Path(outpath)
+    summarypath = outpath.parent / (
+        outpath.name[: -len(outpath.suffix)] + "_summary.tsv"
+    )
+    histpath = outpath.parent / (
+        outpath.name[: -len(outpath.suffix)] + "_hist.tsv"
+    )
+    n_items = len(comp_fr)
+    comp_fr.to_csv(outpath, sep="\t", index_label="idx")
+    starts = np.flatnonzero(
+        np.diff(comp_fr["cluster_id"].to_numpy(), prepend=-1)
+    )
+    count_list = comp_fr["size"].to_numpy()[starts]
+    n_clusts = len(count_list)
+    cluster_counts = pd.DataFrame({"size": count_list})
+    largest_cluster = cluster_counts["size"].max()
+    cluster_hist = (
+        pd.DataFrame(cluster_counts.value_counts()).sort_index().reset_index()
+    )
+    cluster_hist = cluster_hist.set_index("size")
+    cluster_hist = cluster_hist.rename(columns={0: "n"})
+    cluster_hist["item_pct"] = (
+        cluster_hist["n"] * cluster_hist.index * 100.0 / n_items
+    )
+    cluster_hist["cluster_pct"] = cluster_hist["n"] * 100.0 / n_clusts
+    cluster_hist.to_csv(histpath, sep="\t", float_format="%5.2f")
+    clusters = pd.DataFrame(
+        {"anchor.id": np.arange(n_clusts), "count": count_list}
+    )
+    if hashes:
+        members = comp_fr["members"].to_numpy()
+        clusters["hash"] = [
+            hash_array(members[start : start + size].astype(str))
+            for start, size in zip(starts, count_list)
+        ]
+    clusters.to_csv(summarypath, sep="\t")
+    return n_items, n_clusts, largest_cluster
+
+
+def _member_index(member_codes, clusters, n_codes):
+    """Return clusters ordered by member code, with per-code offsets."""
+    order = np.argsort(member_codes, kind="stable")
+    offsets = np.searchsorted(member_codes[order], np.arange(n_codes + 1))
+    return clusters[order], offsets
+
+
+def component_overlaps(clusters1, members1, clusters2, members2):
+    """Return sizes and overlap metrics of every pair of sharing clusters.
+
+    Candidate pairs come from an inverted index of members of set 2,
+    so clusters that share no members are never compared.  Each pair is
+    classified as "identity", "set1_subset", "set2_subset", or
+    "incongruent".
+    """
+    clusters1 = np.asarray(clusters1)
+    clusters2 = np.asarray(clusters2)
+    codes, unused_members = dense_ids(
+        np.concatenate([np.asarray(members1), np.asarray(members2)])
+    )
+    codes1 = codes[: len(clusters1)]
+    codes2 = codes[len(clusters1) :]
+    index_clusters, offsets = _member_index(
+        codes2, clusters2, codes.max(initial=-1) + 1
+    )
+    hits = offsets[codes1 + 1] - offsets[codes1]
+    first_hit = np.cumsum(hits) - hits
+    hit_pos = (
+        np.repeat(offsets[codes1] - first_hit, hits) + np.arange(hits.sum())
+    )
+    candidates = pd.DataFrame(
+        {
+            "set1.cluster_id": np.repeat(clusters1, hits),
+            "set2.cluster_id": index_clusters[hit_pos],
+        }
+    )
+    pair_fr = (
+        candidates.groupby(by=["set1.cluster_id", "set2.cluster_id"])
+        .size()
+        .rename("shared")
+        .reset_index()
+    )
+    sizes1 = pd.Series(clusters1).value_counts()
+    sizes2 = pd.Series(clusters2).value_counts()
+    size1 = sizes1[pair_fr["set1.cluster_id"]].to_numpy()
+    size2 = sizes2[pair_fr["set2.cluster_id"]].to_numpy()
+    shared = pair_fr["shared"].to_numpy()
+    pair_fr["set1.size"] = size1
+    pair_fr["set2.size"] = size2
+    pair_fr["jaccard"] = shared / (size1 + size2 - shared)
+    pair_fr["set1.containment"] = shared / size1
+    pair_fr["set2.containment"] = shared / size2
+    pair_fr["relation"] = np.select(
+        [
+            (shared == size1) & (shared == size2),
+            shared == size1,
+            shared == size2,
+        ],
+        ["identity", "set1_subset", "set2_subset"],
+        default="incongruent",
+    )
+    return pair_fr
+
+
+def relation_anchor_counts(pair_fr):
+    """Return counts of pairs and of anchors of each set by relation.
+
+    An anchor in several pairs of a relation is counted once, so anchor
+    counts never exceed the number of anchors in the set.
+    """
+    by_relation = pair_fr.groupby(by="relation")
+    return pd.DataFrame(
+        {
+            "pairs": by_relation.size(),
+            "set1": by_relation["set1.cluster_id"].nunique(),
+            "set2": by_relation["set2.cluster_id"].nunique(),
+        }
+    ).reindex(RELATIONS, fill_value=0)
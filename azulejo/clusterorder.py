@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""Homology cluster order of every fragment in a set, as one ragged array."""
+# standard library imports
+import json
+import shutil
+import sys
+from pathlib import Path
+
+# third-party imports
+import attr
+import numpy as np
+import pandas as pd
+
+# module imports
+from .common import HOMOLOGY_FILE
+from .common import PROTEOMOLOGY_FILE
+from .common import dotpath_to_path
+from .common import logger
+from .common import read_tsv_or_parquet
+
+# global constants
+CLUSTER_ORDER_DIR = "cluster_order"
+CLUSTERS_FILE = "clusters.npy"
+FRAG_OFFSETS_FILE = "frag_offsets.npy"
+PROTEOME_OFFSETS_FILE = "proteome_offsets.npy"
+NAMES_FILE = "names.json"
+NA_CLUSTER = np.iinfo(np.uint32).max
+ORDER_COLS = ["frag.id", "hom.cluster"]
+
+
+def cluster_vec(cluster_ser):
+    """Return homology clusters as uint32, with NA as NA_CLUSTER."""
+    return cluster_ser.fillna(NA_CLUSTER).to_numpy(dtype=np.uint32)
+
+
+def _frag_starts(frag_ser):
+    """Return start rows of runs of fragment ID's, or None if not runs."""
+    codes = pd.factorize(frag_ser)[0]
+    starts = np.flatnonzero(np.diff(codes, prepend=-1) != 0)
+    if len(starts) != codes.max(initial=-1) + 1:
+        return None
+    return starts
+
+
+@attr.s
+class ClusterOrder:
+    """Homology cluster ID's of all proteins in a set, in genome order.
+
+    Clusters are a single uint32 array, with NA_CLUSTER for unclustered
+    proteins.  Fragment offsets give the row boundaries of fragments and
+    proteome offsets the fragment boundaries of proteomes, so fragments
+    may be read as slices of the memory-mapped array without grouping.
+    """
+
+    order_dir = attr.ib()
+    clusters = attr.ib(default=None)
+    frag_offsets = attr.ib(default=None)
+    proteome_offsets = attr.ib(default=None)
+    paths = attr.ib(factory=list)
+    frag_ids = attr.ib(factory=list)
+
+    @classmethod
+    def build(cls, order_dir, paths):
+        """Write the cluster order of proteomes at dotpaths, in order."""
+        cluster_arrays = []
+        frag_offsets = [0]
+        proteome_offsets = [0]
+        frag_ids = []
+        n_rows = 0
+        for dotpath in paths:
+            hom = read_tsv_or_parquet(
+                dotpath_to_path(dotpath) / HOMOLOGY_FILE, columns=ORDER_COLS
+            )
+            starts = _frag_starts(hom["frag.id"])
+            if starts is None:
+                logger.warning(
+                    f"Fragments of {dotpath} are not contiguous,"
+                    + " cluster order not written"
+                )
+                return None
+            cluster_arrays.append(cluster_vec(hom["hom.cluster"]))
+            frag_offsets += list(n_rows + starts[1:]) + [n_rows + len(hom)]
+            frag_ids += hom["frag.id"].iloc[starts].astype(str).tolist()
+            proteome_offsets.append(len(frag_ids))
+            n_rows += len(hom)
+        if order_dir.exists():
+            shutil.rmtree(order_dir)
+        order_dir.mkdir(parents=True)
+        np.save(order_dir / CLUSTERS_FILE, np.concatenate(cluster_arrays))
+        np.save(
+            order_dir / FRAG_OFFSETS_FILE, np.array(frag_offsets, np.int64)
+        )
+        np.save(
+            order_dir / PROTEOME_OFFSETS_FILE,
+            np.array(proteome_offsets, np.int64),
+        )
+        # names go last, so an interrupted build is not valid
+        with (order_dir / NAMES_FILE).open("w") as names_fh:
+            json.dump({"paths": list(paths), "frag.id": frag_ids}, names_fh)
+        return cls(order_dir).load()
+
+    def exists(self):
+        """Return True if the cluster order has been written."""
+        return (self.order_dir / NAMES_FILE).exists()
+
+    def load(self):
+        """Memory-map the arrays and read names."""
+        self.clusters = np.load(self.order_dir / CLUSTERS_FILE, mmap_mode="r")
+        self.frag_offsets = np.load(self.order_dir / FRAG_OFFSETS_FILE)
+        self.proteome_offsets = np.load(self.order_dir / PROTEOME_OFFSETS_FILE)
+        with (self.order_dir / NAMES_FILE).open() as names_fh:
+            names = json.load(names_fh)
+        self.paths = names["paths"]
+        self.frag_ids = names["frag.id"]
+        return self
+
+    def proteome_number(self, dotpath):
+        """Return the number of a proteome by dotpath, or None."""
+        try:
+            return self.paths.index(dotpath)
+        except ValueError:
+            return None
+
+    def proteome_frags(self, proteome_no):
+        """Return the first and past-last fragment numbers of a proteome."""
+        return (
+            self.proteome_offsets[proteome_no],
+            self.proteome_offsets[proteome_no + 1],
+        )
+
+    def proteome_clusters(self, proteome_no):
+        """Return the slice of clusters for a proteome."""
+        first, last = self.proteome_frags(proteome_no)
+        return self.clusters[
+            self.frag_offsets[first] : self.frag_offsets[last]
+        ]
+
+    def fragments(self, proteome_no):
+        """Yield fragment ID's and cluster slices of a proteome."""
+        first, last = self.proteome_frags(proteome_no)
+        for frag_no in range(first, last):
+            yield self.frag_ids[frag_no], self.clusters[
+                self.frag_offsets[frag_no] : self.frag_offsets[frag_no + 1]
+            ]
+
+    def segments(self, proteome_no):
+        """Return starts and ends of runs of clustered proteins.
+
+        Runs are broken by unclustered proteins and by fragment ends.
+        Rows are numbered from the start of the proteome.
+        """
+        first, last = self.proteome_frags(proteome_no)
+        frag_offsets = self.frag_offsets[first : last + 1]
+        vec = self.clusters[frag_offsets[0] : frag_offsets[-1]]
+        frag_starts = np.zeros(len(vec) + 1, dtype=bool)
+        frag_starts[frag_offsets - frag_offsets[0]] = True
+        valid = np.append(vec != NA_CLUSTER, False)
+        run_starts = valid & (np.roll(~valid, 1) | frag_starts)
+        run_ends = ~valid[1:] | frag_starts[1:]
+        return (
+            np.flatnonzero(run_starts),
+            np.flatnonzero(valid[:-1] & run_ends) + 1,
+        )
+
+    def matches(self, proteome_no, cluster_ser):
+        """Return True if a proteome's clusters equal cluster_ser."""
+        return np.array_equal(
+            self.proteome_clusters(proteome_no), cluster_vec(cluster_ser)
+        )
+
+    def locate(self, cluster_id):
+        """Return a frame of the positions of a homology cluster."""
+        rows = np.flatnonzero(self.clusters == cluster_id)
+        frag_nos = np.searchsorted(self.frag_offsets, rows, side="right") - 1
+        proteome_nos = (
+            np.searchsorted(self.proteome_offsets, frag_nos, side="right") - 1
+        )
+        return pd.DataFrame(
+            {
+                "path": [self.paths[i] for i in proteome_nos],
+                "frag.id": [self.frag_ids[i] for i in frag_nos],
+                "frag.pos": rows - self.frag_offsets[frag_nos],
+            }
+        )
+
+
+def build_cluster_order(set_path, paths):
+    """Write the cluster order of a set and log its size."""
+    order = ClusterOrder.build(set_path / CLUSTER_ORDER_DIR, paths)
+    if order is not None:
+        logger.debug(
+            f"Cluster order of {len(order.clusters)} proteins in"
+            + f" {len(order.frag_ids)} fragments written to {order.order_dir}"
+        )
+    return order
+
+
+def cluster_order_query(setname, proteome=None, fragment=None, cluster=None):
+    """Print homology cluster order by fragment, or positions of a cluster."""
+    set_path = Path(setname)
+    order = ClusterOrder(set_path / CLUSTER_ORDER_DIR)
+    if order.exists():
+        order.load()
+    else:
+        proteomes = read_tsv_or_parquet(set_path / PROTEOMOLOGY_FILE)
+        order = build_cluster_order(set_path, list(proteomes["path"]))
+        if order is None:
+            sys.exit(1)
+    if cluster is not None:
+        print(order.locate(cluster).to_csv(sep="\t", index=False), end="")
+        return
+    if proteome is None:
+        proteome_nos = range(len(order.paths))
+    else:
+        proteome_no = order.proteome_number(proteome)
+        if proteome_no is None:
+            logger.error(f"Proteome {proteome} is not in {setname}.")
+            sys.exit(1)
+        proteome_nos = [proteome_no]
+    print("path\tfrag.id\thom.cluster")
+    for proteome_no in proteome_nos:
+        for frag_id, vec in order.fragments(proteome_no):
+            if fragment is not None and frag_id != fragment:
+                continue
+            cluster_str = " ".join(
+                "NA" if val == NA_CLUSTER else str(val) for val in vec
+            )
+            print(f"{order.paths[proteome_no]}\t{frag_id}\t{cluster_str}")
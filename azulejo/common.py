@@ -2,15 +2,21 @@
 """Constants and functions in common across modules."""
 # standard library imports
 import contextlib
+import functools
 import mmap
+import operator
 import os
 import sys
 import tempfile
+import threading
 from pathlib import Path
 
 # third-party imports
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 import xxhash
 from loguru import logger as loguru_logger
 from memory_tempfile import MemoryTempfile
@@ -39,6 +45,24 @@ DEFAULT_PARQUET_COMPRESSION = "ZSTD"
 # So ZSTD seems a clear choice for now.
 
 PARQUET_EXTENSIONS = ["parquet", "pq", "parq"]
+# per-protein files are written in row groups with statistics so that
+# filters on sorted columns such as frag.idx can skip row groups
+PROTEIN_ROW_GROUP_SIZE = 8192
+SEQUENCE_COLS = ["prot.seq"]
+# in-memory size of frames relative to uncompressed parquet data
+FRAME_MEMORY_FACTOR = 3.0
+FRAME_ROW_BYTES = 64
+# Arrow schemas of written frames, by columns and dtypes
+ARROW_SCHEMAS = {}
+FILTER_OPS = {
+    "=": operator.eq,
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
 TSV_EXTENSIONS = ["tsv"]
 SAVED_INPUT_FILE = "input.toml"
 
@@ -58,6 +82,7 @@ PROTEOMOLOGY_FILE = "proteomes.hom.parq"
 PROTEOSYN_FILE = "proteomes.hom.syn.parq"
 PROTEINS_FILE = "proteins.parq"
 SYNTENY_FILE = "proteins.hom.syn.parq"
+ANCHOR_PROPS_FILE = "synteny_anchor_props.parq"
 ANCHORS_FILE = "synteny_anchors.tsv"
 SYNTENY_FILETYPE = "tsv"
 COLLECTION_FILE = "collection.json"
@@ -92,6 +117,8 @@ DIRECTIONAL_CATEGORY = pd.CategoricalDtype(categories=["-", "+"])
 YES_NO = pd.CategoricalDtype(categories=["y", "n"])
 SYNTENY_CATEGORY = pd.CategoricalDtype(categories=CODE_DICT.keys())
 DEFAULT_DTYPE = pd.UInt32Dtype()
+DEFAULT_HASH_BITS = 32
+HASH_BITS = (32, 64)
 NONDEFAULT_DTYPES = {
     "anchor.subframe.ok": pd.BooleanDtype(),
     "code": SYNTENY_CATEGORY,
@@ -122,6 +149,7 @@ NONDEFAULT_DTYPES = {
     # patterns are matched in order after checking for exact matches
     "patterns": [
         {"start": "phy.", "type": pd.CategoricalDtype()},
+        {"start": "syn.hash64.", "type": pd.UInt64Dtype()},
         {"start": "pct_", "end": "_pct", "type": "float64"},
         {"start": "memb", "type": pd.StringDtype()},
     ],
@@ -218,29 +246,46 @@ else:
     BUILD_DEV = "/tmp"
 
 
+@functools.lru_cache(maxsize=None)
+def canonical_dtype(col):
+    """Return the dtype a column should have, or None for tmp. columns."""
+    if col.startswith("tmp."):
+        return None
+    if col in NONDEFAULT_DTYPES:
+        return NONDEFAULT_DTYPES[col]
+    for pattern_dict in NONDEFAULT_DTYPES["patterns"]:
+        if "start" in pattern_dict:
+            if col.startswith(pattern_dict["start"]):
+                return pattern_dict["type"]
+        if "end" in pattern_dict:
+            if col.endswith(pattern_dict["end"]):
+                return pattern_dict["type"]
+    return DEFAULT_DTYPE
+
+
+@functools.lru_cache(maxsize=None)
+def _is_canonical_name(col, dtype_name):
+    """Return True if a non-categorical dtype name is canonical for col."""
+    try:
+        return canonical_dtype(col) == dtype_name
+    except TypeError:
+        return False
+
+
 def enforce_canonical_dtypes(frame):
     """Enforce that dtypes of columns meet expectations."""
-    for col in frame.columns:
-        if col.startswith("tmp."):
+    for col, column_type in frame.dtypes.items():
+        should_be_type = canonical_dtype(col)
+        if should_be_type is None:
             continue
-        column_type = frame[col].dtype
-        should_be_type = DEFAULT_DTYPE
-        if col in NONDEFAULT_DTYPES:
-            should_be_type = NONDEFAULT_DTYPES[col]
+        if isinstance(column_type, pd.CategoricalDtype):
+            # categories are compared, so results can't be cached by name
+            try:
+                is_correct_type = column_type == should_be_type
+            except TypeError:
+                is_correct_type = False
         else:
-            for pattern_dict in NONDEFAULT_DTYPES["patterns"]:
-                if "start" in pattern_dict:
-                    if col.startswith(pattern_dict["start"]):
-                        should_be_type = pattern_dict["type"]
-                        break
-                if "end" in pattern_dict:
-                    if col.endswith(pattern_dict["end"]):
-                        should_be_type = pattern_dict["type"]
-                        break
-        try:
-            is_correct_type = column_type == should_be_type
-        except TypeError:
-            is_correct_type = False
+            is_correct_type = _is_canonical_name(col, str(column_type))
         if not is_correct_type:
             try:
                 frame[col] = frame[col].astype(should_be_type)
@@ -421,6 +466,119 @@ def remove_tmp_columns(frame):
     return frame
 
 
+def canonicalize_frame(
+    frame, remove_tmp=True, sort_cols=True, enforce_types=True
+):
+    """Return a frame in the form it would be written."""
+    if remove_tmp:
+        frame = remove_tmp_columns(frame)
+    if enforce_types:
+        frame = enforce_canonical_dtypes(frame)
+    if sort_cols:
+        frame = frame[sorted(frame.columns)]
+    return frame
+
+
+def _dtype_key(dtype, values=None):
+    """Return a hashable key for a dtype, ignoring categories.
+
+    Object dtypes are keyed by the inferred type of values.
+    """
+    if isinstance(dtype, pd.CategoricalDtype):
+        return (
+            "category",
+            _dtype_key(dtype.categories.dtype, dtype.categories),
+            dtype.ordered,
+        )
+    if dtype == object:
+        return ("object", pd.api.types.infer_dtype(values, skipna=True))
+    return str(dtype)
+
+
+def _is_inferred(type_key):
+    """Return True if the Arrow type of values depends on their contents."""
+    if isinstance(type_key, str):
+        return False
+    if type_key[0] == "object":
+        return type_key[1] != "string"
+    return _is_inferred(type_key[1])
+
+
+def _schema_key(frame):
+    """Return a hashable key for the index and column types of a frame."""
+    levels = [
+        frame.index.get_level_values(i) for i in range(frame.index.nlevels)
+    ]
+    index_key = tuple(
+        (level.name, _dtype_key(level.dtype, level)) for level in levels
+    )
+    return index_key + tuple(
+        (col, _dtype_key(dtype, frame[col] if dtype == object else None))
+        for col, dtype in frame.dtypes.items()
+    )
+
+
+def arrow_schema(frame):
+    """Return the Arrow schema of a frame, cached by columns and dtypes.
+
+    Categoricals of strings are dictionary-encoded with int32 indices,
+    so frames with different categories share a schema.  Returns None
+    if types can't be cached, e.g., for object columns not all strings,
+    so that pyarrow infers them, or for range indexes, which pyarrow
+    stores as metadata only when it infers the schema.
+    """
+    if isinstance(frame.index, pd.RangeIndex):
+        return None
+    key = _schema_key(frame)
+    if key in ARROW_SCHEMAS:
+        return ARROW_SCHEMAS[key]
+    if any(_is_inferred(type_key) for unused_name, type_key in key):
+        return None
+    schema = pa.Schema.from_pandas(frame, preserve_index=None)
+    for i, field in enumerate(schema):
+        if not pa.types.is_dictionary(field.type):
+            continue
+        if not pa.types.is_string(field.type.value_type):
+            return None
+        schema = schema.set(
+            i,
+            field.with_type(
+                pa.dictionary(pa.int32(), pa.string(), field.type.ordered)
+            ),
+        )
+    ARROW_SCHEMAS[key] = schema.remove_metadata()
+    return ARROW_SCHEMAS[key]
+
+
+@contextlib.contextmanager
+def atomic_path(filepath):
+    """Yield a temporary path that replaces filepath on success.
+
+    Readers see either the complete file or none, even if the write
+    is interrupted.
+    """
+    # unique among writers, so concurrent writes to a path don't collide
+    tmp_path = filepath.parent / (
+        f".{filepath.name}.{os.getpid()}.{threading.get_ident()}.tmp"
+    )
+    try:
+        yield tmp_path
+        os.replace(tmp_path, filepath)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+def write_parquet(frame, filepath, compression, row_group_size=None):
+    """Write a frame to parquet through its cached Arrow schema."""
+    table = pa.Table.from_pandas(
+        frame, schema=arrow_schema(frame), preserve_index=None
+    )
+    pq.write_table(
+        table, filepath, compression=compression, row_group_size=row_group_size
+    )
+
+
 def write_tsv_or_parquet(
     frame,
     filepath,
@@ -430,40 +588,167 @@ def write_tsv_or_parquet(
     remove_tmp=True,
     sort_cols=True,
     enforce_types=True,
+    row_group_size=None,
 ):
-    """Write either a TSV or a parquet file by file extension."""
+    """Write either a TSV or a parquet file by file extension.
+
+    The file is written under a temporary name, then renamed.
+    """
     filepath = Path(filepath)
     ext = filepath.suffix.lstrip(".")
     if desc is not None:
         file_desc = f"{desc} file"
         logger.debug(f'Writing {file_desc} "{filepath}')
-    if remove_tmp:
-        frame = remove_tmp_columns(frame)
-    if enforce_types:
-        frame = enforce_canonical_dtypes(frame)
-    if sort_cols:
-        frame = frame[sorted(frame.columns)]
-    if ext in PARQUET_EXTENSIONS:
-        frame.to_parquet(filepath, compression=compression)
-    elif ext in TSV_EXTENSIONS:
-        frame.to_csv(filepath, sep="\t", float_format=float_format)
-    else:
+    frame = canonicalize_frame(
+        frame,
+        remove_tmp=remove_tmp,
+        sort_cols=sort_cols,
+        enforce_types=enforce_types,
+    )
+    if ext not in PARQUET_EXTENSIONS + TSV_EXTENSIONS:
         logger.error(f"Unrecognized file extension {ext} in {filepath}")
         sys.exit(1)
+    with atomic_path(filepath) as tmp_path:
+        if ext in PARQUET_EXTENSIONS:
+            write_parquet(
+                frame, tmp_path, compression, row_group_size=row_group_size
+            )
+        else:
+            frame.to_csv(tmp_path, sep="\t", float_format=float_format)
+
+
+def _filter_clause(target, op, val):
+    """Return a filter clause on a dataset field or a series."""
+    if op == "in":
+        return target.isin(list(val))
+    if op == "not in":
+        return ~target.isin(list(val))
+    if op not in FILTER_OPS:
+        logger.error(f"Unrecognized filter operator {op}")
+        sys.exit(1)
+    return FILTER_OPS[op](target, val)
+
+
+def _dnf(filters):
+    """Return filters as a list of lists of (column, op, value) tuples."""
+    if isinstance(filters[0], tuple):
+        return [filters]
+    return filters
+
+
+def _filter_expression(filters):
+    """Return a dataset expression from filters in disjunctive normal form."""
+    return functools.reduce(
+        operator.or_,
+        [
+            functools.reduce(
+                operator.and_,
+                [
+                    _filter_clause(ds.field(col), op, val)
+                    for col, op, val in conjunction
+                ],
+            )
+            for conjunction in _dnf(filters)
+        ],
+    )
 
 
-def read_tsv_or_parquet(filepath):
-    """Read either a TSV or a parquet file by file extension."""
+def _filter_mask(frame, filters):
+    """Return a boolean mask of frame rows passing filters."""
+    mask = np.zeros(len(frame), dtype=bool)
+    for conjunction in _dnf(filters):
+        term = np.ones(len(frame), dtype=bool)
+        for col, op, val in conjunction:
+            clause = _filter_clause(frame[col], op, val)
+            term &= clause.fillna(False).to_numpy(dtype=bool)
+        mask |= term
+    return mask
+
+
+def _parquet_index_columns(schema):
+    """Return names of columns holding the pandas index of a parquet file."""
+    if schema.pandas_metadata is None:
+        return []
+    return [
+        col
+        for col in schema.pandas_metadata["index_columns"]
+        if isinstance(col, str)
+    ]
+
+
+def parquet_columns(filepath, exclude=None):
+    """Return the names of non-index columns of a parquet file."""
+    schema = pq.read_schema(filepath)
+    skip = set(_parquet_index_columns(schema))
+    if exclude is not None:
+        skip |= set(exclude)
+    return [col for col in schema.names if col not in skip]
+
+
+def parquet_memory_mb(filepath):
+    """Estimate the memory in MB of a parquet file read as a frame.
+
+    The estimate is from row counts and uncompressed column sizes in the
+    metadata.  Missing files are estimated as empty.
+    """
+    if not filepath.exists():
+        return 0.0
+    metadata = pq.read_metadata(filepath)
+    n_bytes = sum(
+        metadata.row_group(i).column(j).total_uncompressed_size
+        for i in range(metadata.num_row_groups)
+        for j in range(metadata.num_columns)
+    )
+    return (
+        n_bytes * FRAME_MEMORY_FACTOR + metadata.num_rows * FRAME_ROW_BYTES
+    ) / MEGABYTES
+
+
+def read_parquet_dataset(filepath, columns=None, filters=None):
+    """Read a parquet file as a dataset, restoring the pandas index.
+
+    Only columns are read, and row groups whose statistics exclude
+    filters are skipped.
+    """
+    dataset = ds.dataset(str(filepath), format="parquet")
+    if columns is not None:
+        columns = list(columns) + [
+            col
+            for col in _parquet_index_columns(dataset.schema)
+            if col not in columns
+        ]
+    table = dataset.to_table(
+        columns=columns,
+        filter=None if filters is None else _filter_expression(filters),
+    )
+    # projection drops pandas metadata that restores index and dtypes
+    return table.replace_schema_metadata(dataset.schema.metadata).to_pandas()
+
+
+def read_tsv_or_parquet(filepath, columns=None, filters=None):
+    """Read either a TSV or a parquet file by file extension.
+
+    If columns is given, only those columns and the index are returned.
+    Filters are (column, op, value) tuples in the disjunctive normal
+    form of pyarrow, applied by row-group statistics for parquet files.
+    """
     filepath = Path(filepath)
     if not filepath.exists():
         logger.error(f'File "{filepath}" does not exist.')
         sys.exit(1)
     ext = filepath.suffix.lstrip(".")
     if ext in PARQUET_EXTENSIONS:
-        return pd.read_parquet(filepath)
+        if columns is None and filters is None:
+            return pd.read_parquet(filepath)
+        return read_parquet_dataset(filepath, columns, filters)
     if ext in TSV_EXTENSIONS:
         frame = pd.read_csv(filepath, sep="\t", index_col=0).convert_dtypes()
-        return enforce_canonical_dtypes(frame)
+        frame = enforce_canonical_dtypes(frame)
+        if filters is not None:
+            frame = frame[_filter_mask(frame, filters)]
+        if columns is not None:
+            frame = frame[list(columns)]
+        return frame
     logger.error(f"Unrecognized file extensions {ext} in {filepath}")
     sys.exit(1)
 
@@ -496,8 +781,10 @@ def y_or_n_to_bool(bool_ser):
     return bool_ser.map(tf_dict).astype(bool)
 
 
-def hash_array(kmer):
-    """Return a hash of a numpy array."""
+def hash_array(kmer, bits=DEFAULT_HASH_BITS):
+    """Return a 32- or 64-bit hash of a numpy array."""
+    if bits == 64:
+        return xxhash.xxh3_64_intdigest(kmer.tobytes())
     return xxhash.xxh32_intdigest(kmer.tobytes())
 
 
@@ -275,8 +275,15 @@ def homology_cluster(
     cluster_stats=True,
     outname=None,
     click_loguru=None,
+    workdir=None,
+    tool_cache=None,
 ):
-    """Cluster at a global sequence identity threshold."""
+    """Cluster at a global sequence identity threshold.
+
+    Outputs are written to workdir, by default the directory of seqfile.
+    If tool_cache is given, clusters and log are reused from it when the
+    sequences and identity match.
+    """
     try:
         usearch = sh.Command("usearch", search_paths=SEARCH_PATHS)
     except sh.CommandNotFound:
@@ -288,7 +295,8 @@ def homology_cluster(
         logger.error(f'Input file "{seqfile}" does not exist!')
         sys.exit(1)
     stem = inpath.stem
-    dirpath = inpath.parent
+    if workdir is not None:
+        dirpath = Path(workdir)
     if outname is None:
         outname = cluster_set_name(stem, identity)
     outdir = f"{outname}/"
@@ -346,19 +354,37 @@ def homology_cluster(
         # Do the calculation.
         #
         with in_working_directory(dirpath):
-            output = usearch(
-                [
-                    "-cluster_fast",
-                    seqfile,
-                    "-id",
-                    identity,
-                    "-clusters",
-                    outdir,
-                    "-log",
-                    logfile,
-                ]
-            )
-            logger.debug(output)
+            if tool_cache is not None:
+                tool_cache.run(
+                    "usearch",
+                    [
+                        "-cluster_fast",
+                        "{fasta}",
+                        "-id",
+                        str(identity),
+                        "-clusters",
+                        "{clusters}/",
+                        "-log",
+                        "{log}",
+                    ],
+                    inputs={"fasta": inpath},
+                    outputs={"clusters": outname, "log": logfile},
+                    link=False,  # cluster files are trimmed in place
+                )
+            else:
+                output = usearch(
+                    [
+                        "-cluster_fast",
+                        str(inpath),
+                        "-id",
+                        identity,
+                        "-clusters",
+                        outdir,
+                        "-log",
+                        logfile,
+                    ]
+                )
+                logger.debug(output)
     run_stat_dict = OrderedDict([("divergence", 1.0 - identity)])
     parse_usearch_log(logfilepath, run_stat_dict)
     run_stats = pd.DataFrame(
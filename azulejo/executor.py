@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+"""Map functions over sequences on a configurable dask scheduler."""
+# standard library imports
+import atexit
+import concurrent.futures
+import contextlib
+import functools
+import os
+import resource
+import sys
+
+# third-party imports
+import attr
+import dask.bag as db
+from dask.utils import parse_bytes
+
+# module imports
+from .common import MEGABYTES
+from .common import logger
+
+# global constants
+SCHEDULERS = ["sync", "threads", "processes", "distributed"]
+DEFAULT_SCHEDULER = "processes"
+EXECUTOR_OPTIONS = (
+    "parallel",
+    "scheduler",
+    "workers",
+    "threads_per_worker",
+    "partition_size",
+    "memory_limit",
+    "max_memory",
+)
+# ru_maxrss is in bytes on macOS, KB elsewhere
+if sys.platform == "darwin":
+    MAXRSS_MB = MEGABYTES
+else:
+    MAXRSS_MB = 1024.0
+_EXECUTORS = {}
+
+
+def _rss_mb():
+    """Return the RSS of this process in MB, or its peak without psutil."""
+    try:
+        # installed with distributed
+        import psutil  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return _peak_rss_mb()
+    return psutil.Process().memory_info().rss / MEGABYTES
+
+
+def _peak_rss_mb():
+    """Return the high-water mark of RSS of this process in MB."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / MAXRSS_MB
+
+
+def _run_measured(item, measured_func=None, **kwargs):
+    """Call a function on item, returning the result and task RSS in MB.
+
+    Task RSS is the growth of RSS over the task, to the process's new
+    high-water mark if the task raised it.  Tasks running at once in a
+    process under the threads scheduler see each other's growth.
+    """
+    start_mb = _rss_mb()
+    start_peak_mb = _peak_rss_mb()
+    result = measured_func(item, **kwargs)
+    peak_mb = _peak_rss_mb()
+    if peak_mb > start_peak_mb:
+        end_mb = peak_mb
+    else:
+        end_mb = _rss_mb()
+    return result, max(end_mb - start_mb, 0.0)
+
+
+def _fold_chunk(chunk, fold_func=None, init=None, fold_kwargs=None):
+    """Fold a function over the items of a chunk, starting from init()."""
+    acc = init()
+    for item in chunk:
+        acc = fold_func(acc, item, **fold_kwargs)
+    return acc
+
+
+@attr.s
+class Executor:
+    """Map a function over a sequence as a dask bag.
+
+    The sync scheduler calls the function in a loop, without dask.
+    n_workers is the number of threads for the threads scheduler and of
+    processes for the others.  threads_per_worker and memory_limit
+    apply to the workers of a local distributed cluster, which is
+    started on first use unless a client is given.
+    If max_memory (in MB) is set, maps given per-task memory estimates
+    start tasks only while the estimates of running tasks fit.
+    """
+
+    scheduler = attr.ib(default=DEFAULT_SCHEDULER)
+    n_workers = attr.ib(default=None)
+    threads_per_worker = attr.ib(default=None)
+    partition_size = attr.ib(default=None)
+    memory_limit = attr.ib(default=None)
+    max_memory = attr.ib(default=None)
+    client = attr.ib(default=None)
+    _cluster = attr.ib(default=None)
+
+    @classmethod
+    def from_options(cls, user_options):
+        """Return an executor configured by user global options."""
+        scheduler = user_options.get("scheduler", None)
+        if scheduler is None:
+            if user_options.get("parallel", True):
+                scheduler = DEFAULT_SCHEDULER
+            else:
+                scheduler = "sync"
+        max_memory = user_options.get("max_memory", None)
+        if max_memory is not None:
+            try:
+                max_memory = parse_bytes(max_memory) / MEGABYTES
+            except ValueError:
+                logger.error(f"Cannot parse memory budget {max_memory}.")
+                sys.exit(1)
+        return cls(
+            scheduler=scheduler,
+            n_workers=user_options.get("workers", None),
+            threads_per_worker=user_options.get("threads_per_worker", None),
+            partition_size=user_options.get("partition_size", None),
+            memory_limit=user_options.get("memory_limit", None),
+            max_memory=max_memory,
+        )
+
+    @property
+    def parallel(self):
+        """Return True if functions may run concurrently."""
+        return self.scheduler != "sync"
+
+    def shares_processes(self):
+        """Return True if functions may run concurrently in one process."""
+        if self.scheduler == "threads":
+            return True
+        return self.scheduler == "distributed" and self.threads_per_worker != 1
+
+    def worker_count(self):
+        """Return the number of workers that run functions at once."""
+        if not self.parallel:
+            return 1
+        if self.n_workers is not None:
+            n_workers = self.n_workers
+        else:
+            n_workers = os.cpu_count()
+        if self.scheduler == "distributed" and self.threads_per_worker:
+            n_workers *= self.threads_per_worker
+        return n_workers
+
+    def get_client(self):
+        """Return the distributed client, starting a local cluster if none."""
+        if self.client is None:
+            # optional, and slow to import
+            try:
+                import distributed  # pylint: disable=import-outside-toplevel
+            except ImportError:
+                logger.error("The distributed scheduler needs distributed.")
+                sys.exit(1)
+            cluster_kwargs = {}
+            if self.n_workers is not None:
+                cluster_kwargs["n_workers"] = self.n_workers
+            if self.threads_per_worker is not None:
+                cluster_kwargs["threads_per_worker"] = (
+                    self.threads_per_worker
+                )
+            if self.memory_limit is not None:
+                cluster_kwargs["memory_limit"] = self.memory_limit
+            self._cluster = distributed.LocalCluster(**cluster_kwargs)
+            self.client = distributed.Client(self._cluster)
+            logger.info(f"Dask dashboard is at {self.client.dashboard_link}")
+        return self.client
+
+    def compute_kwargs(self):
+        """Return keyword arguments to compute a bag."""
+        if self.scheduler == "distributed":
+            return {"scheduler": self.get_client()}
+        compute_kwargs = {"scheduler": self.scheduler}
+        if self.n_workers is not None:
+            compute_kwargs["num_workers"] = self.n_workers
+        return compute_kwargs
+
+    def map(self, func, seq, task_mb=None, stage=None, **kwargs):
+        """Call func on every item of seq, returning a list of results.
+
+        task_mb is a list of memory estimates of tasks, used to admit
+        tasks if max_memory is set.  The peak task RSS is logged under
+        stage, by default the name of func.
+        """
+        if stage is None:
+            stage = func.__name__
+        if not self.parallel:
+            measured = [
+                _run_measured(item, measured_func=func, **kwargs)
+                for item in seq
+            ]
+        elif self.max_memory is not None and task_mb is not None:
+            measured = self._admitted_map(
+                func, list(seq), task_mb, stage, kwargs
+            )
+        else:
+            bag = db.from_sequence(seq, partition_size=self.partition_size)
+            measured = bag.map(
+                _run_measured, measured_func=func, **kwargs
+            ).compute(**self.compute_kwargs())
+        if measured:
+            peak_rss_mb = max(rss_mb for unused_result, rss_mb in measured)
+            logger.info(f"{stage}: peak task RSS {peak_rss_mb:.0f} MB")
+        return [result for result, unused_rss_mb in measured]
+
+    def fold(
+        self, func, seq, init, combine, task_mb=None, stage=None, **kwargs
+    ):
+        """Fold func(acc, item) over seq, returning the combined folds.
+
+        seq is split into a chunk per worker, or per partition_size
+        items, and each chunk is folded from init() in a worker.  The
+        folds of chunks are combined in order by combine(acc, acc).
+        task_mb is as for map(), a chunk needing its largest task.
+        """
+        items = list(seq)
+        if self.partition_size is not None:
+            n_chunks = -(-len(items) // self.partition_size)
+        else:
+            n_chunks = self.worker_count()
+        n_chunks = max(min(n_chunks, len(items)), 1)
+        chunks = [items[i::n_chunks] for i in range(n_chunks)]
+        if task_mb is not None:
+            task_mb = [
+                max(task_mb[i::n_chunks], default=0.0)
+                for i in range(n_chunks)
+            ]
+        folds = self.map(
+            _fold_chunk,
+            chunks,
+            task_mb=task_mb,
+            stage=stage or func.__name__,
+            fold_func=func,
+            init=init,
+            fold_kwargs=kwargs,
+        )
+        return functools.reduce(combine, folds)
+
+    @contextlib.contextmanager
+    def _pool(self):
+        """Yield a pool to which tasks can be submitted."""
+        if self.scheduler == "distributed":
+            yield self.get_client()
+            return
+        if self.scheduler == "threads":
+            pool_class = concurrent.futures.ThreadPoolExecutor
+        else:
+            pool_class = concurrent.futures.ProcessPoolExecutor
+        with pool_class(max_workers=self.worker_count()) as pool:
+            yield pool
+
+    def _submit(self, pool, item, func, kwargs):
+        """Submit a measured task to a pool, returning its future."""
+        if self.scheduler == "distributed":
+            kwargs = {"pure": False, **kwargs}
+        return pool.submit(_run_measured, item, measured_func=func, **kwargs)
+
+    def _wait_first(self, futures):
+        """Wait for at least one future to finish, returning the done ones."""
+        if self.scheduler == "distributed":
+            # pylint: disable=import-outside-toplevel
+            from distributed import wait
+        else:
+            wait = concurrent.futures.wait
+        return wait(futures, return_when="FIRST_COMPLETED").done
+
+    def _admitted_map(self, func, items, task_mb, stage, kwargs):
+        """Map func, starting tasks in order while their estimates fit.
+
+        A task bigger than the budget is started when nothing is running.
+        Returns results paired with task RSS, as _run_measured() does.
+        """
+        measured = [None] * len(items)
+        running = {}
+        admitted_mb = 0.0
+        peak_admitted_mb = 0.0
+        next_item = 0
+        n_workers = self.worker_count()
+        with self._pool() as pool:
+            while next_item < len(items) or running:
+                while (
+                    next_item < len(items)
+                    and len(running) < n_workers
+                    and (
+                        not running
+                        or admitted_mb + task_mb[next_item] <= self.max_memory
+                    )
+                ):
+                    future = self._submit(pool, items[next_item], func, kwargs)
+                    running[future] = next_item
+                    admitted_mb += task_mb[next_item]
+                    next_item += 1
+                peak_admitted_mb = max(peak_admitted_mb, admitted_mb)
+                for future in self._wait_first(list(running)):
+                    item_no = running.pop(future)
+                    admitted_mb -= task_mb[item_no]
+                    measured[item_no] = future.result()
+        logger.info(
+            f"{stage}: at most {peak_admitted_mb:.0f} MB estimated"
+            + f" of {self.max_memory:.0f} MB budget"
+        )
+        return measured
+
+    def close(self):
+        """Shut down the local cluster, if one was started."""
+        if self._cluster is not None:
+            self.client.close()
+            self._cluster.close()
+            self.client = None
+            self._cluster = None
+
+
+def get_executor(user_options):
+    """Return the executor for user global options, shared in a process."""
+    key = tuple(user_options.get(name, None) for name in EXECUTOR_OPTIONS)
+    if key not in _EXECUTORS:
+        _EXECUTORS[key] = Executor.from_options(user_options)
+        atexit.register(_EXECUTORS[key].close)
+    return _EXECUTORS[key]
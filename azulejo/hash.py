@@ -8,6 +8,7 @@ import numpy as np
 import pandas as pd
 
 # module imports
+from .common import DEFAULT_HASH_BITS
 from .common import DIRECTIONAL_CATEGORY
 from .common import hash_array
 from .common import logger
@@ -104,6 +105,17 @@ class SyntenyBlockHasher(object):
     thorny = attr.ib(default=True)
     disambig_adj_only = attr.ib(default=True)
     prefix = attr.ib(default="syn")
+    hash_bits = attr.ib(default=DEFAULT_HASH_BITS)
+
+    def base_name(self):
+        """Return the name of the hash function without prefixes."""
+        if self.thorny:
+            thorny_str = "thorny"
+        else:
+            thorny_str = ""
+        if self.peatmer:
+            return f"{thorny_str}peatmer{self.k}"
+        return f"{thorny_str}kmer{self.k}"
 
     def hash_name(self, no_prefix=False):
         """Return the string name of the hash function."""
@@ -111,13 +123,27 @@ class SyntenyBlockHasher(object):
             prefix_str = ""
         else:
             prefix_str = self.prefix + "."
-        if self.thorny:
-            thorny_str = "thorny"
+        if self.hash_bits == DEFAULT_HASH_BITS:
+            bits_str = ""
         else:
-            thorny_str = ""
-        if self.peatmer:
-            return f"{prefix_str}hash.{thorny_str}peatmer{self.k}"
-        return f"{prefix_str}hash.{thorny_str}kmer{self.k}"
+            bits_str = str(self.hash_bits)
+        return f"{prefix_str}hash{bits_str}.{self.base_name()}"
+
+    def hash_dtype(self):
+        """Return the pandas dtype of hash columns."""
+        if self.hash_bits == 64:
+            return pd.UInt64Dtype()
+        return pd.UInt32Dtype()
+
+    def key_dtype(self):
+        """Return the numpy dtype of hash values in merges and tables."""
+        if self.hash_bits == 64:
+            return np.uint64
+        return np.uint32
+
+    def hash(self, arr):
+        """Return the hash of an array at this hasher's width."""
+        return hash_array(arr, bits=self.hash_bits)
 
     def shingle(self, cluster_series, direction, hash_val):
         """Return a vector of anchor ID's. """
@@ -131,6 +157,42 @@ class SyntenyBlockHasher(object):
             steps = self.k - 1 - steps
         return steps
 
+    def shingle_all(
+        self, cluster_vec, starts, footprints, directions, hash_vals
+    ):
+        """Expand anchors over their footprints in a single pass.
+
+        Returns arrays of row positions, offsets within each anchor,
+        sub-ID's, and anchor numbers, one element per shingled protein.
+        Sub-ID's match those from calling shingle() on each anchor.
+        """
+        ends = np.minimum(starts + footprints, len(cluster_vec))
+        lengths = ends - starts
+        first = np.cumsum(lengths) - lengths
+        anchor_no = np.repeat(np.arange(len(starts)), lengths)
+        offsets = np.arange(lengths.sum()) - np.repeat(first, lengths)
+        rows = np.repeat(starts, lengths) + offsets
+        clusters = cluster_vec[rows]
+        changes = np.insert((clusters[1:] != clusters[:-1]).astype(int), 0, 0)
+        changes[first] = 0
+        steps = np.cumsum(changes)
+        steps -= np.repeat(steps[first], lengths)
+        if len(steps):
+            bad_anchors = np.flatnonzero(
+                np.maximum.reduceat(steps, first) != self.k - 1
+            )
+            for bad in bad_anchors:
+                logger.warning(
+                    f"Inconsistency in shingling hash {hash_vals[bad]}"
+                )
+                logger.warning(
+                    f"input homology string={clusters[anchor_no == bad]}"
+                )
+            steps[steps > self.k - 1] = self.k - 1
+        minus = np.repeat(directions == "-", lengths)
+        steps[minus] = self.k - 1 - steps[minus]
+        return rows, offsets, steps, anchor_no
+
     def calculate(self, cluster_series):
         """Return an array of synteny block hashes data."""
         # Maybe the best code I've ever written--JB
@@ -157,8 +219,16 @@ class SyntenyBlockHasher(object):
         )
         fwd_rev_hashes = np.array(
             [
-                np.apply_along_axis(hash_array, 1, kmer_mat),
-                np.apply_along_axis(hash_array, 1, np.flip(kmer_mat, axis=1)),
+                np.fromiter(
+                    (self.hash(kmer) for kmer in kmer_mat),
+                    dtype=self.key_dtype(),
+                    count=n_mers,
+                ),
+                np.fromiter(
+                    (self.hash(kmer) for kmer in np.flip(kmer_mat, axis=1)),
+                    dtype=self.key_dtype(),
+                    count=n_mers,
+                ),
             ]
         )
         plus_minus = np.array([["+"] * n_mers, ["-"] * n_mers])
@@ -172,7 +242,7 @@ class SyntenyBlockHasher(object):
                 pd.Categorical(directions, dtype=DIRECTIONAL_CATEGORY),
                 footprints,
                 pd.array(
-                    np.amin(fwd_rev_hashes, axis=0), dtype=pd.UInt32Dtype()
+                    np.amin(fwd_rev_hashes, axis=0), dtype=self.hash_dtype()
                 ),
             ],
             columns=[
@@ -205,10 +275,10 @@ class SyntenyBlockHasher(object):
         )
         hash2_fr["tmp.i"] = range(len(hash2_fr))
         upstream_hash = pd.array(
-            [pd.NA] * len(hash2_fr), dtype=pd.UInt32Dtype()
+            [pd.NA] * len(hash2_fr), dtype=self.hash_dtype()
         )
         downstream_hash = pd.array(
-            [pd.NA] * len(hash2_fr), dtype=pd.UInt32Dtype()
+            [pd.NA] * len(hash2_fr), dtype=self.hash_dtype()
         )
         hash2_fr["tmp.disambig.up"] = pd.NA
         hash2_fr["tmp.disambig.down"] = pd.NA
@@ -227,7 +297,7 @@ class SyntenyBlockHasher(object):
                         )
                     if self.disambig_adj_only and occur_upstream > 1:
                         continue
-                    upstream_hash[row_no] = hash_array(
+                    upstream_hash[row_no] = self.hash(
                         np.array(
                             [upstream_unambig, ambig_base, occur_upstream]
                         )
@@ -239,7 +309,7 @@ class SyntenyBlockHasher(object):
                         )
                     if self.disambig_adj_only and occur_downstream > 1:
                         continue
-                    downstream_hash[row_no] = hash_array(
+                    downstream_hash[row_no] = self.hash(
                         np.array(
                             [ambig_base, downstream_unambig, occur_downstream]
                         )
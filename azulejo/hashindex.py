@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""Persisted synteny hash indexes for incremental runs."""
+# standard library imports
+import json
+import shutil
+
+# third-party imports
+import attr
+import numpy as np
+import pandas as pd
+
+# module imports
+from .common import hash_array
+from .common import read_tsv_or_parquet
+from .common import write_tsv_or_parquet
+
+# global constants
+HASH_INDEX_DIR = "synteny_index"
+KEY_FILE = "key.json"
+HASHES_FILE = "hashes.npy"
+COUNTS_FILE = "counts.npy"
+SELF_COUNTS_FILE = "self_counts.npy"
+FRAME_FILE = "hashes.parq"
+MEMBERS_FILE = "members.json"
+COUNT_DTYPE = np.uint32
+
+
+def homology_digest(hom):
+    """Return a digest of the homology clustering of a proteome."""
+    return hash_array(
+        pd.util.hash_pandas_object(
+            hom[["frag.id", "hom.cluster"]], index=True
+        ).to_numpy(),
+        bits=64,
+    )
+
+
+def index_key(hasher, hom):
+    """Return the key under which a proteome's hashes are valid."""
+    return {
+        "hasher": attr.asdict(hasher),
+        "homology": homology_digest(hom),
+    }
+
+
+def _key_digest(key):
+    """Return a digest of a key."""
+    return hash_array(
+        np.frombuffer(json.dumps(key, sort_keys=True).encode(), np.uint8),
+        bits=64,
+    )
+
+
+@attr.s
+class ProteomeHashIndex:
+    """Sorted unique hashes of one proteome, with per-protein hash columns.
+
+    The index is valid only for the key it was saved under, so changes
+    to homology clusters or hasher parameters cause re-hashing.
+    """
+
+    index_dir = attr.ib()
+
+    def digest(self):
+        """Return the digest of the saved key, or None if not saved."""
+        key_path = self.index_dir / KEY_FILE
+        if not key_path.exists():
+            return None
+        with key_path.open() as key_fh:
+            return _key_digest(json.load(key_fh))
+
+    def matches(self, key):
+        """Return True if the index was saved under key."""
+        return self.digest() == _key_digest(key)
+
+    def save(self, key, hash_fr, unique_hashes, key_dtype=np.uint32):
+        """Save hash columns and unique hashes with their self-counts."""
+        if self.index_dir.exists():
+            shutil.rmtree(self.index_dir)
+        self.index_dir.mkdir(parents=True)
+        write_tsv_or_parquet(
+            hash_fr,
+            self.index_dir / FRAME_FILE,
+            sort_cols=False,
+            enforce_types=False,
+        )
+        np.save(
+            self.index_dir / HASHES_FILE,
+            unique_hashes.index.to_numpy(dtype=key_dtype),
+        )
+        np.save(
+            self.index_dir / SELF_COUNTS_FILE,
+            unique_hashes.iloc[:, 0].to_numpy(dtype=COUNT_DTYPE),
+        )
+        # key goes last, so an interrupted save is not valid
+        with (self.index_dir / KEY_FILE).open("w") as key_fh:
+            json.dump(key, key_fh, sort_keys=True)
+
+    def hash_frame(self):
+        """Return the per-protein hash columns."""
+        return read_tsv_or_parquet(self.index_dir / FRAME_FILE)
+
+    def unique_hashes(self):
+        """Return memory-mapped arrays of hashes and self-counts."""
+        return (
+            np.load(self.index_dir / HASHES_FILE, mmap_mode="r"),
+            np.load(self.index_dir / SELF_COUNTS_FILE, mmap_mode="r"),
+        )
+
+
+def _combine_counts(hash_arrays, count_arrays, self_count_arrays):
+    """Sum counts and take maximum self-counts of matching hashes."""
+    hashes = np.concatenate(hash_arrays)
+    order = np.argsort(hashes, kind="stable")
+    hashes = hashes[order]
+    counts = np.concatenate(count_arrays)[order]
+    self_counts = np.concatenate(self_count_arrays)[order]
+    if len(hashes) == 0:
+        return hashes, counts, self_counts
+    starts = np.flatnonzero(np.insert(hashes[1:] != hashes[:-1], 0, True))
+    return (
+        hashes[starts],
+        np.add.reduceat(counts, starts),
+        np.maximum.reduceat(self_counts, starts),
+    )
+
+
+@attr.s
+class HashCounts:
+    """Counts of proteomes containing each hash, across a set.
+
+    Alongside each count is the largest number of times the hash occurs
+    within any one proteome.  Members are the digests of the proteome
+    indexes counted, so new proteomes can be added without re-reading
+    the others.
+    """
+
+    counts_dir = attr.ib()
+    hashes = attr.ib(default=None)
+    counts = attr.ib(default=None)
+    self_counts = attr.ib(default=None)
+    members = attr.ib(factory=dict)
+
+    def load(self):
+        """Read saved counts, returning False if there are none."""
+        members_path = self.counts_dir / MEMBERS_FILE
+        if not members_path.exists():
+            return False
+        with members_path.open() as members_fh:
+            self.members = json.load(members_fh)
+        self.hashes = np.load(self.counts_dir / HASHES_FILE)
+        self.counts = np.load(self.counts_dir / COUNTS_FILE)
+        self.self_counts = np.load(self.counts_dir / SELF_COUNTS_FILE)
+        return True
+
+    def add(self, indexes):
+        """Add counts from a dict of proteome indexes by path."""
+        hash_arrays = []
+        count_arrays = []
+        self_count_arrays = []
+        if self.hashes is not None:
+            hash_arrays.append(self.hashes)
+            count_arrays.append(self.counts)
+            self_count_arrays.append(self.self_counts)
+        for path, index in indexes.items():
+            hashes, self_counts = index.unique_hashes()
+            hash_arrays.append(np.asarray(hashes))
+            count_arrays.append(np.ones(len(hashes), dtype=COUNT_DTYPE))
+            self_count_arrays.append(np.asarray(self_counts))
+            self.members[path] = index.digest()
+        if len(hash_arrays) == 0:
+            return
+        self.hashes, self.counts, self.self_counts = _combine_counts(
+            hash_arrays, count_arrays, self_count_arrays
+        )
+
+    def update(self, indexes):
+        """Bring counts up to date with indexes, returning paths re-read.
+
+        If every member is still present and unchanged, only the new
+        proteomes are added.  Otherwise counts are rebuilt from all.
+        """
+        digests = {path: index.digest() for path, index in indexes.items()}
+        if self.load() and all(
+            digests.get(path) == digest
+            for path, digest in self.members.items()
+        ):
+            new_indexes = {
+                path: index
+                for path, index in indexes.items()
+                if path not in self.members
+            }
+        else:
+            self.hashes = None
+            self.members = {}
+            new_indexes = indexes
+        self.add(new_indexes)
+        self.save()
+        return list(new_indexes)
+
+    def save(self):
+        """Write counts and members."""
+        self.counts_dir.mkdir(parents=True, exist_ok=True)
+        np.save(self.counts_dir / HASHES_FILE, self.hashes)
+        np.save(self.counts_dir / COUNTS_FILE, self.counts)
+        np.save(self.counts_dir / SELF_COUNTS_FILE, self.self_counts)
+        with (self.counts_dir / MEMBERS_FILE).open("w") as members_fh:
+            json.dump(self.members, members_fh, sort_keys=True)
+
+    def shared(self):
+        """Return hashes found in more than one proteome, with counts."""
+        shared = self.counts > 1
+        return (
+            self.hashes[shared],
+            self.counts[shared],
+            self.self_counts[shared],
+        )
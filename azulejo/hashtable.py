@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""Hash tables shared between processes as memory-mapped sorted arrays."""
+# standard library imports
+from pathlib import Path
+
+# third-party imports
+import attr
+import numpy as np
+import pandas as pd
+
+# global constants
+KEYS_FILE = "keys.npy"
+VALUE_DTYPE = np.uint32
+
+
+@attr.s
+class SharedHashTable:
+    """A frame indexed by hash, published once as sorted arrays on disk.
+
+    Only the table path is pickled when a table is passed to a task;
+    each task memory-maps the arrays, so all tasks on a node share one
+    copy through the page cache.
+    """
+
+    table_dir = attr.ib()
+    columns = attr.ib(factory=list)
+    n_keys = attr.ib(default=0)
+
+    @classmethod
+    def publish(cls, frame, table_dir, key_dtype=np.uint32):
+        """Write a frame with an integer index and return its table."""
+        table_dir = Path(table_dir)
+        table_dir.mkdir(parents=True, exist_ok=True)
+        keys = frame.index.to_numpy(dtype=key_dtype)
+        order = np.argsort(keys, kind="stable")
+        np.save(table_dir / KEYS_FILE, keys[order])
+        for i, col in enumerate(frame.columns):
+            np.save(
+                table_dir / f"{i}.npy",
+                frame[col].to_numpy(dtype=VALUE_DTYPE)[order],
+            )
+        return cls(
+            table_dir=table_dir, columns=list(frame.columns), n_keys=len(keys)
+        )
+
+    def __len__(self):
+        """Return the number of hashes in the table."""
+        return self.n_keys
+
+    def join(self, frame, col_name):
+        """Left-join the table onto frame where col_name matches a hash.
+
+        Unmatched rows get NA.  Columns already present in frame get
+        "_x" and "_y" suffixes, as with pd.merge.
+        """
+        keys = np.load(self.table_dir / KEYS_FILE, mmap_mode="r")
+        hashes = frame[col_name]
+        vals = hashes.to_numpy(dtype=keys.dtype, na_value=0)
+        found = np.zeros(len(vals), dtype=bool)
+        pos = np.zeros(len(vals), dtype=np.int64)
+        if self.n_keys > 0:
+            pos = np.searchsorted(keys, vals)
+            pos[pos == self.n_keys] = 0
+            found = hashes.notna().to_numpy() & (keys[pos] == vals)
+        new_cols = {}
+        for i, col in enumerate(self.columns):
+            if self.n_keys > 0:
+                values = np.load(self.table_dir / f"{i}.npy", mmap_mode="r")
+                taken = np.asarray(values[pos])
+            else:
+                taken = np.zeros(len(vals), dtype=VALUE_DTYPE)
+            if col in frame.columns:
+                frame = frame.rename(columns={col: col + "_x"})
+                col += "_y"
+            new_cols[col] = pd.arrays.IntegerArray(taken, ~found)
+        return frame.assign(**new_cols)
+
+    def delete(self):
+        """Remove the table directory."""
+        for file in self.table_dir.glob("*"):
+            file.unlink()
+        self.table_dir.rmdir()
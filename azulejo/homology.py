@@ -6,49 +6,83 @@ import json
 import os
 import shutil
 import sys
+import time
 from pathlib import Path
 
 # third-party imports
-import dask.bag as db
+import numpy as np
 import pandas as pd
 from dask.diagnostics import ProgressBar
 
-# first-party imports
-import sh
-
 # module imports
+from .clusterorder import build_cluster_order
 from .common import CLUSTER_FILETYPE
 from .common import CLUSTERS_FILE
 from .common import EXTERNAL_CLUSTERS_FILE
 from .common import FRAGMENTS_FILE
 from .common import HOMOLOGY_FILE
+from .common import MEGABYTES
+from .common import PROTEIN_ROW_GROUP_SIZE
 from .common import PROTEINS_FILE
 from .common import PROTEOMES_FILE
 from .common import PROTEOMOLOGY_FILE
-from .common import SEARCH_PATHS
 from .common import SPINNER_UPDATE_PERIOD
 from .common import TrimmableMemoryMap
 from .common import calculate_adjacency_group
 from .common import dotpath_to_path
 from .common import group_key_filename
 from .common import logger
+from .common import parquet_memory_mb
 from .common import read_tsv_or_parquet
 from .common import sort_proteome_frame
 from .common import write_tsv_or_parquet
 from .core import homology_cluster
+from .executor import get_executor
 from .mailboxes import DataMailboxes
+from .mailboxes import SpaceAwareTempDevices
+from .manifest import SET_ITEM
+from .manifest import Manifest
+from .manifest import tool_version
+from .seqstore import SEQ_OFFSETS_FILE
+from .seqstore import SEQUENCES_FILE
+from .seqstore import SequenceStore
+from .shards import Shard
+from .shards import ShardResults
+from .toolcache import DEFAULT_TOOL_CACHE
+from .toolcache import DEFAULT_TOOL_CACHE_MB
+from .toolcache import ToolCache
 
 # global constants
 HOMOLOGY_COLS = ["hom.cluster", "hom.cl_size"]
+CONCAT_FASTA_FILE = "proteins.fa"
+HOMOLOGY_MAILBOXES = "clusters2proteomes"
+HOMOLOGY_STAGE = "homology"
+# scratch space estimates
+FASTA_HEADER_BYTES = 512
+MAILBOX_LINE_BYTES = 32
 
 
 def cluster_build_trees(
-    identity, set_name, cluster_file=None, click_loguru=None
+    identity,
+    set_name,
+    cluster_file=None,
+    click_loguru=None,
+    shard=None,
+    force=False,
+    tool_cache_dir=DEFAULT_TOOL_CACHE,
+    tool_cache_mb=DEFAULT_TOOL_CACHE_MB,
 ):
-    """Calculate homology clusters, MSAs, trees."""
+    """Calculate homology clusters, MSAs, trees.
+
+    If shard is given, clusters are calculated by the first shard to
+    start, then only the shard's slice of clusters is aligned, and
+    proteomes are updated by gather_homology().
+    Unless force is True, nothing is done if the manifest shows that
+    outputs are current.  Outputs of usearch and muscle are reused from
+    a tool cache in tool_cache_dir of up to tool_cache_mb, 0 to disable.
+    """
     options = click_loguru.get_global_options()
-    user_options = click_loguru.get_user_global_options()
-    parallel = user_options["parallel"]
+    executor = get_executor(click_loguru.get_user_global_options())
     set_path = Path(set_name)
     # read and possibly update proteomes
     proteomes_path = set_path / PROTEOMES_FILE
@@ -57,26 +91,221 @@ def cluster_build_trees(
     if not proteomes_in.equals(proteomes):
         logger.info("proteomes sort order changed, writing new proteomes file")
         write_tsv_or_parquet(proteomes, proteomes_path)
+    manifest = Manifest.load(set_path)
+    specs = _homology_specs(
+        manifest, set_path, proteomes, identity, cluster_file
+    )
+    if (
+        shard is None
+        and not force
+        and manifest.is_current(HOMOLOGY_STAGE, specs)
+    ):
+        return
+    cache_start = time.time()
+    if tool_cache_mb:
+        tool_cache = ToolCache(cache_dir=tool_cache_dir, max_mb=tool_cache_mb)
+    else:
+        tool_cache = ToolCache(cache_dir=None)
     n_proteomes = len(proteomes)
+    with SpaceAwareTempDevices(fallback_dev=set_path) as scratch:
+        n_seqs, n_residues = _sequence_totals(proteomes)
+        if shard is None:
+            n_clusters = _calculate_clusters(
+                identity,
+                set_path,
+                proteomes,
+                cluster_file,
+                scratch,
+                (n_seqs, n_residues),
+                tool_cache,
+                click_loguru,
+            )
+        else:
+            shard_results = ShardResults(set_path, HOMOLOGY_STAGE)
+            n_clusters = shard_results.run_once(
+                "clusters",
+                _calculate_clusters,
+                identity,
+                set_path,
+                proteomes,
+                cluster_file,
+                scratch,
+                (n_seqs, n_residues),
+                tool_cache,
+                click_loguru,
+            )
+        file_idx = {}
+        stem_dict = {}
+        for i, row in proteomes.iterrows():
+            stem = row["path"]
+            file_idx[stem] = i
+            stem_dict[i] = stem
+        #
+        # Write homology info back into proteomes
+        #
+        click_loguru.elapsed_time("Alignment/tree-building")
+        cluster_paths = [
+            set_path / "homology" / f"{i}.fa" for i in range(n_clusters)
+        ]
+        if shard is None:
+            mailbox_dir = _allocate_mailboxes(scratch, n_seqs)
+            mailbox_parent = mailbox_dir.path
+        else:
+            # shard mailboxes must outlast the job, so are kept in the set
+            cluster_paths = shard.select(cluster_paths)
+            mailbox_parent = shard_results.shard_path(shard)
+        hom_mb = DataMailboxes(
+            n_boxes=n_proteomes,
+            mb_dir_path=(mailbox_parent / HOMOLOGY_MAILBOXES),
+            file_extension="tsv",
+        )
+        hom_mb.write_tsv_headers(HOMOLOGY_COLS)
+        if not options.quiet:
+            logger.info(
+                f"Calculating MSAs and trees for {len(cluster_paths)} homology"
+                " clusters:"
+            )
+            ProgressBar(dt=SPINNER_UPDATE_PERIOD).register()
+        cluster_stats = executor.map(
+            parse_cluster,
+            cluster_paths,
+            file_dict=file_idx,
+            file_writer=hom_mb.locked_open_for_write,
+            n_proteomes=n_proteomes,
+            tool_cache=tool_cache,
+        )
+        tool_cache.log_report(HOMOLOGY_STAGE, cache_start)
+        if shard is not None:
+            shard_results.save(
+                shard,
+                cluster_stats,
+                {"identity": identity, "cluster_file": cluster_file},
+            )
+            return
+        _join_homology(
+            set_path, proteomes, stem_dict, cluster_stats, hom_mb, click_loguru
+        )
+    scratch.log_report()
+    manifest.record(HOMOLOGY_STAGE, specs)
+    click_loguru.elapsed_time(None)
+
+
+def gather_homology(set_name, click_loguru=None):
+    """Join the alignments of homology shards to proteomes."""
+    set_path = Path(set_name)
+    shard_results = ShardResults(set_path, HOMOLOGY_STAGE)
+    cluster_stats, shard_options, n_shards = shard_results.load()
+    proteomes = read_tsv_or_parquet(set_path / PROTEOMES_FILE)
+    n_proteomes = len(proteomes)
+    stem_dict = {i: row["path"] for i, row in proteomes.iterrows()}
+    with SpaceAwareTempDevices(fallback_dev=set_path) as scratch:
+        n_seqs, unused_residues = _sequence_totals(proteomes)
+        mailbox_dir = _allocate_mailboxes(scratch, n_seqs)
+        hom_mb = DataMailboxes(
+            n_boxes=n_proteomes,
+            mb_dir_path=(mailbox_dir.path / HOMOLOGY_MAILBOXES),
+            file_extension="tsv",
+        )
+        hom_mb.write_tsv_headers(HOMOLOGY_COLS)
+        for i in range(n_shards):
+            hom_mb.append_boxes(
+                DataMailboxes(
+                    n_boxes=n_proteomes,
+                    mb_dir_path=(
+                        shard_results.shard_path(Shard(i, n_shards))
+                        / HOMOLOGY_MAILBOXES
+                    ),
+                    file_extension="tsv",
+                )
+            )
+        _join_homology(
+            set_path, proteomes, stem_dict, cluster_stats, hom_mb, click_loguru
+        )
+    scratch.log_report()
+    manifest = Manifest.load(set_path)
+    manifest.record(
+        HOMOLOGY_STAGE,
+        _homology_specs(manifest, set_path, proteomes, **shard_options),
+    )
+    shard_results.delete()
+    click_loguru.elapsed_time(None)
+
+
+def _homology_specs(manifest, set_path, proteomes, identity, cluster_file):
+    """Return manifest specifications of the outputs of homology."""
+    tools = {"muscle": tool_version("muscle")}
+    if cluster_file is None:
+        tools["usearch"] = tool_version("usearch")
+        set_inputs = []
+    else:
+        set_inputs = [Path(cluster_file)]
+    specs = {
+        SET_ITEM: manifest.spec(
+            set_inputs
+            + [set_path / PROTEOMES_FILE, set_path / FRAGMENTS_FILE],
+            [set_path / PROTEOMOLOGY_FILE, set_path / CLUSTERS_FILE],
+            params={"identity": identity, "cluster_file": cluster_file},
+            tools=tools,
+        )
+    }
+    for dotpath in proteomes["path"]:
+        proteome_path = dotpath_to_path(dotpath)
+        specs[dotpath] = manifest.spec(
+            [
+                proteome_path / name
+                for name in (PROTEINS_FILE, SEQUENCES_FILE, SEQ_OFFSETS_FILE)
+                if (proteome_path / name).exists()
+            ],
+            [proteome_path / HOMOLOGY_FILE],
+        )
+    return specs
+
+
+def _allocate_mailboxes(scratch, n_seqs):
+    """Return a scratch allocation for cluster-to-proteome mailboxes."""
+    return scratch.allocate(
+        "mailboxes", int(np.ceil(n_seqs * MAILBOX_LINE_BYTES / MEGABYTES))
+    )
+
+
+def _calculate_clusters(
+    identity,
+    set_path,
+    proteomes,
+    cluster_file,
+    scratch,
+    totals,
+    tool_cache,
+    click_loguru,
+):
+    """Write a FASTA file per homology cluster, returning the count.
+
+    Clusters are calculated by usearch unless read from cluster_file.
+    """
+    options = click_loguru.get_global_options()
+    n_seqs, n_residues = totals
     # read and update fragment ID's
     frags = read_tsv_or_parquet(set_path / FRAGMENTS_FILE)
     frags["frag.idx"] = pd.array(frags.index, dtype=pd.UInt32Dtype())
     frag_frames = {}
     for dotpath, subframe in frags.groupby(by=["path"]):
         frag_frames[dotpath] = subframe.copy().set_index("frag.orig_id")
+    if cluster_file is None:
+        usearch_dir = scratch.allocate(
+            "usearch",
+            int(
+                np.ceil(
+                    (n_residues + n_seqs * FASTA_HEADER_BYTES) / MEGABYTES
+                )
+            ),
+        )
+        concat_fasta_path = usearch_dir.path / CONCAT_FASTA_FILE
+    else:
+        concat_fasta_path = None
     arg_list = []
-    concat_fasta_path = set_path / "proteins.fa"
     for i, row in proteomes.iterrows():
         arg_list.append((row, concat_fasta_path, frag_frames[row["path"]]))
-    file_idx = {}
-    stem_dict = {}
-    for i, row in proteomes.iterrows():
-        stem = row["path"]
-        file_idx[stem] = i
-        stem_dict[i] = stem
     if cluster_file is None:
-        if concat_fasta_path.exists():
-            concat_fasta_path.unlink()
         if not options.quiet:
             logger.info(
                 f"Renaming fragments and concatenating sequences for {len(arg_list)}"
@@ -88,13 +317,15 @@ def cluster_build_trees(
         cwd = Path.cwd()
         os.chdir(set_path)
         n_clusters, run_stats, cluster_hist = homology_cluster(
-            "proteins.fa",
+            str(concat_fasta_path),
             identity,
             write_ids=True,
             delete=False,
             cluster_stats=False,
             outname="homology",
             click_loguru=click_loguru,
+            workdir=Path.cwd(),
+            tool_cache=tool_cache,
         )
         log_path = Path("homology.log")
         log_dir_path = Path("logs")
@@ -105,7 +336,7 @@ def cluster_build_trees(
         logger.info(f"Number of clusters: {n_clusters}")
         del cluster_hist
         del run_stats
-        concat_fasta_path.unlink()
+        usearch_dir.release()
     else:  # use pre-existing clusters
         homology_path = set_path / "homology"
         if homology_path.exists():
@@ -169,77 +400,30 @@ def cluster_build_trees(
                 missing_files = True
         if missing_files:
             sys.exit(1)
-    #
-    # Write homology info back into proteomes
-    #
-    click_loguru.elapsed_time("Alignment/tree-building")
-    hom_mb = DataMailboxes(
-        n_boxes=n_proteomes,
-        mb_dir_path=(set_path / "mailboxes" / "clusters2proteomes"),
-        file_extension="tsv",
+    return int(n_clusters)
+
+
+def _join_homology(
+    set_path, proteomes, stem_dict, cluster_stats, hom_mb, click_loguru
+):
+    """Write cluster tables and join homology info to proteomes."""
+    options = click_loguru.get_global_options()
+    executor = get_executor(click_loguru.get_user_global_options())
+    n_proteomes = len(proteomes)
+    records = np.concatenate(
+        [np.zeros(0, dtype=cluster_record_dtype(n_proteomes))]
+        + list(cluster_stats)
     )
-    hom_mb.write_tsv_headers(HOMOLOGY_COLS)
-    cluster_paths = [
-        set_path / "homology" / f"{i}.fa" for i in range(n_clusters)
-    ]
-    bag = db.from_sequence(cluster_paths)
-    cluster_stats = []
-    if not options.quiet:
-        logger.info(
-            f"Calculating MSAs and trees for {len(cluster_paths)} homology"
-            " clusters:"
-        )
-        ProgressBar(dt=SPINNER_UPDATE_PERIOD).register()
-    if parallel:
-        cluster_stats = bag.map(
-            parse_cluster,
-            file_dict=file_idx,
-            file_writer=hom_mb.locked_open_for_write,
-        )
-    else:
-        for clust_fasta in cluster_paths:
-            cluster_stats.append(
-                parse_cluster(
-                    clust_fasta,
-                    file_dict=file_idx,
-                    file_writer=hom_mb.locked_open_for_write,
-                )
-            )
-    n_clust_genes = 0
-    clusters_dict = {}
-    for cluster_id, cluster_dict in cluster_stats:
-        n_clust_genes += cluster_dict["size"]
-        clusters_dict[cluster_id] = cluster_dict
     del cluster_stats
-    clusters = pd.DataFrame.from_dict(clusters_dict).transpose()
-    del clusters_dict
-    clusters.sort_index(inplace=True)
-    grouping_dict = {}
-    for i in range(n_proteomes):  # keep numbering of single-file clusters
-        grouping_dict[f"[{i}]"] = i
-    grouping_dict[str(list(range(n_proteomes)))] = 0
-    for n_members, subframe in clusters.groupby(["n_memb"]):
-        if n_members == 1:
-            continue
-        if n_members == n_proteomes:
-            continue
-        member_counts = pd.DataFrame(subframe["n_members"].value_counts())
-        member_counts["key"] = range(len(member_counts))
-        for newcol in range(n_members):
-            member_counts[f"memb{newcol}"] = ""
-        for member_string, row in member_counts.iterrows():
-            grouping_dict[member_string] = row["key"]
-            member_list = json.loads(member_string)
-            for col in range(n_members):
-                member_counts.loc[member_string, f"memb{col}"] = stem_dict[
-                    member_list[col]
-                ]
-        member_counts = member_counts.set_index("key")
+    clusters, group_tables = cluster_table(
+        records, [stem_dict[i] for i in range(n_proteomes)]
+    )
+    del records
+    for n_members, member_counts in group_tables.items():
         write_tsv_or_parquet(
             member_counts, set_path / group_key_filename(n_members)
         )
-    clusters["n_members"] = clusters["n_members"].map(grouping_dict)
-    clusters = clusters.rename(columns={"n_members": "group_key"})
+    n_clust_genes = clusters["size"].sum()
     n_adj = clusters["n_adj"].sum()
     adj_pct = n_adj * 100.0 / n_clust_genes
     n_adj_clust = sum(clusters["adj_groups"] != 0)
@@ -263,23 +447,20 @@ def cluster_build_trees(
                 dotpath_to_path(row["path"]),
             )
         )
-    bag = db.from_sequence(arg_list)
-    hom_stats = []
     if not options.quiet:
         logger.info(f"Joining homology info to {n_proteomes} proteomes:")
         ProgressBar(dt=SPINNER_UPDATE_PERIOD).register()
-    if parallel:
-        hom_stats = bag.map(
-            join_homology_to_proteome, mailbox_reader=hom_mb.open_then_delete
-        ).compute()
-    else:
-        for args in arg_list:
-            hom_stats.append(
-                join_homology_to_proteome(
-                    args, mailbox_reader=hom_mb.open_then_delete
-                )
-            )
+    hom_stats = executor.map(
+        join_homology_to_proteome,
+        arg_list,
+        task_mb=[
+            parquet_memory_mb(protein_parent / HOMOLOGY_FILE)
+            for unused_idx, protein_parent in arg_list
+        ],
+        mailbox_reader=hom_mb.open_then_delete,
+    )
     hom_mb.delete()
+    build_cluster_order(set_path, list(proteomes["path"]))
     hom_frame = pd.DataFrame.from_dict(hom_stats)
     hom_frame.set_index(["prot.idx"], inplace=True)
     hom_frame.sort_index(inplace=True)
@@ -292,7 +473,18 @@ def cluster_build_trees(
     write_tsv_or_parquet(
         proteomes, set_path / PROTEOMOLOGY_FILE, float_format="%5.2f"
     )
-    click_loguru.elapsed_time(None)
+
+
+def _sequence_totals(proteomes):
+    """Return the total number and length of sequences in proteomes."""
+    n_seqs = 0
+    n_residues = 0
+    for dotpath in proteomes["path"]:
+        seq_store = SequenceStore(dotpath_to_path(dotpath)).load()
+        n_seqs += len(seq_store)
+        n_residues += int(seq_store.lengths().sum())
+        seq_store.close()
+    return n_seqs, n_residues
 
 
 def write_protein_fasta(args, clusters=None, fasta_dir=None):
@@ -320,45 +512,172 @@ def write_protein_fasta(args, clusters=None, fasta_dir=None):
         lambda oid: frags.loc[oid]["frag.id"]
     )
     # Write out updated protein info
-    write_tsv_or_parquet(prot_info, inpath / HOMOLOGY_FILE)
+    write_tsv_or_parquet(
+        prot_info,
+        inpath / HOMOLOGY_FILE,
+        row_group_size=PROTEIN_ROW_GROUP_SIZE,
+    )
     # include phylogeny info in per-sequence info
     for prop in phylogeny_dict:
         prot_info[prop] = phylogeny_dict[prop]
     # write concatenated sequence info
+    seq_store = SequenceStore(inpath).load()
     if clusters is None:
         fasta_path = concat_fasta_path
-        info_to_fasta(None, fasta_path, append=True, infoobj=prot_info)
+        info_to_fasta(
+            None,
+            fasta_path,
+            append=True,
+            infoobj=prot_info,
+            seq_store=seq_store,
+        )
     else:
         for cluster_id, subframe in clusters.groupby(by=["cluster_id"]):
             cluster_info = prot_info[prot_info.index.isin(subframe["members"])]
             fasta_path = fasta_dir / f"{cluster_id}.fa"
-            info_to_fasta(None, fasta_path, append=True, infoobj=cluster_info)
+            info_to_fasta(
+                None,
+                fasta_path,
+                append=True,
+                infoobj=cluster_info,
+                seq_store=seq_store,
+            )
+    seq_store.close()
+
+
+def cluster_record_dtype(n_proteomes):
+    """Return the dtype of per-cluster records for a set.
+
+    Members are a bitset over proteome indices.
+    """
+    return np.dtype(
+        [
+            ("cluster_id", np.uint32),
+            ("size", np.uint32),
+            ("n_memb", np.uint32),
+            ("n_adj", np.uint32),
+            ("adj_groups", np.uint32),
+            ("members", np.uint8, ((n_proteomes + 7) // 8,)),
+        ]
+    )
+
+
+def _cluster_record(
+    cluster_id, size, prot_idxs, n_proteomes, n_adj=0, adj_groups=0
+):
+    """Return a one-element array holding a cluster record."""
+    member_vec = np.zeros(n_proteomes, dtype=bool)
+    member_vec[prot_idxs] = True
+    record = np.zeros(1, dtype=cluster_record_dtype(n_proteomes))
+    record["cluster_id"] = cluster_id
+    record["size"] = size
+    record["n_memb"] = member_vec.sum()
+    record["n_adj"] = n_adj
+    record["adj_groups"] = adj_groups
+    record["members"][0] = np.packbits(member_vec)
+    return record
+
+
+def cluster_table(records, stems):
+    """Return the cluster table and group-key tables from cluster records.
+
+    Clusters in one proteome have the proteome index as group key and
+    clusters in all proteomes have key 0.  Otherwise, keys number the
+    distinct member sets of clusters with the same number of members,
+    most frequent first, and are described by a group-key table per
+    number of members.
+    """
+    records = np.sort(records, order="cluster_id")
+    n_proteomes = len(stems)
+    n_memb = records["n_memb"].astype(np.int64)
+    group_keys = np.zeros(len(records), dtype=np.int64)
+    singles = np.flatnonzero(n_memb == 1)
+    if len(singles):
+        member_mat = np.unpackbits(
+            records["members"][singles], axis=1, count=n_proteomes
+        )
+        group_keys[singles] = member_mat.argmax(axis=1)
+    stem_arr = np.array(stems, dtype=object)
+    group_tables = {}
+    for n_members in np.unique(n_memb):
+        if n_members in (1, n_proteomes):
+            continue
+        rows = np.flatnonzero(n_memb == n_members)
+        member_bytes = np.ascontiguousarray(records["members"][rows])
+        unique_bytes, first, inverse, counts = np.unique(
+            member_bytes.view(
+                np.dtype((np.void, member_bytes.shape[1]))
+            ).ravel(),
+            return_index=True,
+            return_inverse=True,
+            return_counts=True,
+        )
+        # most frequent first, ties in order of first cluster
+        order = np.lexsort((first, -counts))
+        keys = np.empty(len(order), dtype=np.int64)
+        keys[order] = np.arange(len(order))
+        group_keys[rows] = keys[inverse]
+        member_idxs = np.nonzero(
+            np.unpackbits(
+                unique_bytes.view(np.uint8).reshape(len(unique_bytes), -1),
+                axis=1,
+                count=n_proteomes,
+            )[order]
+        )[1].reshape(len(order), n_members)
+        member_counts = pd.DataFrame(
+            {"n_members": pd.array(counts[order], dtype=pd.UInt32Dtype())},
+            index=pd.Index(range(len(order)), name="key"),
+        )
+        for col in range(n_members):
+            member_counts[f"memb{col}"] = pd.array(
+                stem_arr[member_idxs[:, col]], dtype=pd.StringDtype()
+            )
+        group_tables[int(n_members)] = member_counts
+    clusters = pd.DataFrame(
+        {
+            "size": pd.array(records["size"], dtype=pd.UInt32Dtype()),
+            "n_memb": pd.array(records["n_memb"], dtype=pd.UInt32Dtype()),
+            "group_key": pd.array(group_keys, dtype=pd.UInt32Dtype()),
+            "n_adj": pd.array(records["n_adj"], dtype=pd.UInt32Dtype()),
+            "adj_groups": pd.array(
+                records["adj_groups"], dtype=pd.UInt32Dtype()
+            ),
+        },
+        index=records["cluster_id"].astype(np.int64),
+    )
+    return clusters, group_tables
 
 
 def parse_cluster(
-    fasta_path, file_dict=None, file_writer=None, neighbor_joining=False
+    fasta_path,
+    file_dict=None,
+    file_writer=None,
+    neighbor_joining=False,
+    n_proteomes=None,
+    tool_cache=None,
 ):
-    """Parse cluster FASTA headers to create cluster table.."""
+    """Parse cluster FASTA headers, returning a cluster record.
+
+    Alignments and trees are reused from tool_cache if its inputs match.
+    """
     cluster_id = fasta_path.name[:-3]
     outdir = fasta_path.parent
     clusters = parse_cluster_fasta(fasta_path)
     if len(clusters) < 2:
         # fasta_path.unlink()
         logger.error(f"Singleton Cluster {cluster_id} is size {len(clusters)}")
-        cluster_dict = {
-            "size": len(clusters),
-            "n_memb": None,
-            "n_members": None,
-            "n_adj": None,
-            "adj_groups": None,
-        }
-        return int(cluster_id)
+        prot_idxs = []
+        if len(clusters):
+            prot_idxs = clusters["path"].map(file_dict).to_numpy(dtype=int)
+        return _cluster_record(
+            int(cluster_id), len(clusters), prot_idxs, n_proteomes
+        )
     # calculate MSA and return guide tree
     muscle_args = [
         "-in",
-        f"{outdir}/{cluster_id}.fa",
+        "{fasta}",
         "-out",
-        f"{outdir}/{cluster_id}.faa",
+        "{alignment}",
         "-diags",
         "-sv",
         "-maxiters",
@@ -367,19 +686,23 @@ def parse_cluster(
         "-distance1",
         "kmer20_4",
     ]
+    if tool_cache is None:
+        tool_cache = ToolCache(cache_dir=None)
+    muscle_outputs = {"alignment": outdir / f"{cluster_id}.faa"}
     if len(clusters) >= 4:
         muscle_args += [
             "-tree2",
-            f"{outdir}/{cluster_id}.nwk",
+            "{tree}",
         ]
+        muscle_outputs["tree"] = outdir / f"{cluster_id}.nwk"
         if neighbor_joining:
             muscle_args += ["-cluster2", "neighborjoining"]  # adds 20%
-    try:
-        muscle = sh.Command("muscle", search_paths=SEARCH_PATHS)
-    except sh.CommandNotFound:
-        logger.error("muscle must be installed first.")
-        sys.exit(1)
-    muscle(muscle_args)
+    tool_cache.run(
+        "muscle",
+        muscle_args,
+        inputs={"fasta": outdir / f"{cluster_id}.fa"},
+        outputs=muscle_outputs,
+    )
     # fasta_path.unlink()
     clusters["prot.idx"] = clusters["path"].map(file_dict)
     clusters.sort_values(by=["prot.idx", "frag.id", "frag.pos"], inplace=True)
@@ -387,16 +710,7 @@ def parse_cluster(
         clusters["frag.pos"], clusters["frag.idx"]
     )
     idx_values = clusters["prot.idx"].value_counts()
-    idx_list = list(idx_values.index)
-    idx_list.sort()
     write_tsv_or_parquet(clusters, outdir / f"{cluster_id}.{CLUSTER_FILETYPE}")
-    cluster_dict = {
-        "size": len(clusters),
-        "n_memb": len(idx_values),
-        "n_members": str(idx_list),
-        "n_adj": n_adj,
-        "adj_groups": adj_gr_count,
-    }
     for group_id, subframe in clusters.groupby(by=["prot.idx"]):
         proteome_frame = subframe.copy()
         proteome_frame["hom.cluster"] = cluster_id
@@ -408,7 +722,14 @@ def parse_cluster(
         )
         with file_writer(group_id) as file_handle:
             proteome_frame.to_csv(file_handle, header=False, sep="\t")
-    return int(cluster_id), cluster_dict
+    return _cluster_record(
+        int(cluster_id),
+        len(clusters),
+        idx_values.index.to_numpy(dtype=int),
+        n_proteomes,
+        n_adj=n_adj,
+        adj_groups=adj_gr_count,
+    )
 
 
 def parse_cluster_fasta(filepath, trim_dict=True):
@@ -452,7 +773,11 @@ def join_homology_to_proteome(args, mailbox_reader=None):
         ).convert_dtypes()
         clusters_in_proteome = len(homology_frame)
     proteome_frame = pd.concat([proteins, homology_frame], axis=1)
-    write_tsv_or_parquet(proteome_frame, protein_parent / HOMOLOGY_FILE)
+    write_tsv_or_parquet(
+        proteome_frame,
+        protein_parent / HOMOLOGY_FILE,
+        row_group_size=PROTEIN_ROW_GROUP_SIZE,
+    )
     return {
         "prot.idx": idx,
         "hom.clusters": clusters_in_proteome,
@@ -460,20 +785,31 @@ def join_homology_to_proteome(args, mailbox_reader=None):
     }
 
 
-def info_to_fasta(infofile, fastafile, append, infoobj=None):
-    """Convert infofile to FASTA file."""
+def info_to_fasta(infofile, fastafile, append, infoobj=None, seq_store=None):
+    """Convert infofile to FASTA file.
+
+    Sequences come from the sequence store beside infofile, unless
+    the table holds them in a prot.seq column, as in older sets.
+    """
     if infoobj is None:
         infoobj = read_tsv_or_parquet(infofile)
     if append:
-        filemode = "a+"
+        filemode = "ab"
     else:
-        filemode = "w"
+        filemode = "wb"
     with Path(fastafile).open(filemode) as file_handle:
         fcntl.flock(file_handle, fcntl.LOCK_EX)
         logger.debug(f"Writing to {fastafile} with mode {filemode}.")
-        seqs = infoobj["prot.seq"].copy()
-        del infoobj["prot.seq"]
-        for gene_id, row in infoobj.iterrows():
-            file_handle.write(f">{gene_id} {row.to_json()}\n")
-            file_handle.write(f"{seqs[gene_id]}\n")
+        if "prot.seq" in infoobj.columns:
+            seqs = infoobj["prot.seq"].copy()
+            del infoobj["prot.seq"]
+            for gene_id, row in infoobj.iterrows():
+                file_handle.write(f">{gene_id} {row.to_json()}\n".encode())
+                file_handle.write(f"{seqs[gene_id]}\n".encode())
+        elif seq_store is None:
+            seq_store = SequenceStore(Path(infofile).parent).load()
+            seq_store.write_fasta(file_handle, infoobj)
+            seq_store.close()
+        else:
+            seq_store.write_fasta(file_handle, infoobj)
         fcntl.flock(file_handle, fcntl.LOCK_UN)
@@ -6,14 +6,12 @@ import json
 import os
 import shutil
 import sys
-import tempfile
 from fnmatch import fnmatch
 from pathlib import Path
 from urllib.request import Request, urlopen, urlretrieve
 
 # third-party imports
 import attr
-import dask.bag as db
 import gffpandas.gffpandas as gffpd
 import numpy as np
 import pandas as pd
@@ -32,6 +30,7 @@ from .common import CHROMOSOME_ABBREV
 from .common import CHROMOSOME_SYNONYMS
 from .common import DIRECTIONAL_CATEGORY
 from .common import FRAGMENTS_FILE
+from .common import MEGABYTES
 from .common import PLASTID_STARTS
 from .common import PROTEINS_FILE
 from .common import PROTEOMES_FILE
@@ -45,10 +44,16 @@ from .common import sort_proteome_frame
 from .common import y_or_n_to_bool
 from .common import write_tsv_or_parquet
 from .core import cleanup_fasta
+from .executor import get_executor
+from .mailboxes import SpaceAwareTempDevices
+from .seqstore import SEQ_IDX_COL
+from .seqstore import SequenceStore
+from .shards import ShardResults
 from .taxonomy import rankname_to_number
 
 # global constants
-__all__ = ["read_from_url", "ingest_sequences"]
+__all__ = ["read_from_url", "ingest_sequences", "gather_ingest"]
+INGEST_STAGE = "ingest"
 FILE_TRANSPORT = "file://"
 REQUIRED_LEAF_NAMES = (
     "fasta",
@@ -139,11 +144,14 @@ def _validate_uri(uri):
     return uri
 
 
-def ingest_sequences(input_toml, click_loguru=None):
-    """Marshal protein and genome sequence information."""
+def ingest_sequences(input_toml, click_loguru=None, shard=None):
+    """Marshal protein and genome sequence information.
+
+    If shard is given, only its slice of genomes is read, and the
+    proteome tables are written by gather_ingest().
+    """
     options = click_loguru.get_global_options()
-    user_options = click_loguru.get_user_global_options()
-    parallel = user_options["parallel"]
+    executor = get_executor(click_loguru.get_user_global_options())
     input_obj = TaxonomicInputTable(Path(input_toml), write_table=False)
     input_table = input_obj.input_table
     logger.info(f"Output directory: {input_obj.setname}/")
@@ -157,21 +165,51 @@ def ingest_sequences(input_toml, click_loguru=None):
                 row["gff_url"],
             )
         )
-    bag = db.from_sequence(arg_list)
-    file_stats = []
+    if shard is not None:
+        arg_list = shard.select(arg_list)
     if not options.quiet:
         logger.info(f"Extracting FASTA/GFF info for {len(arg_list)} genomes:")
         ProgressBar().register()
-    if parallel:
-        file_stats = bag.map(
-            read_fasta_and_gff, verbose=options.verbose
-        ).compute()
+    # worker processes download into pickled copies of scratch
+    if executor.scheduler == "threads":
+        n_processes = 1
     else:
-        for args in arg_list:
-            file_stats.append(
-                read_fasta_and_gff(args, verbose=options.verbose)
-            )
+        n_processes = executor.worker_count()
+    with SpaceAwareTempDevices(n_processes=n_processes) as scratch:
+        file_stats = executor.map(
+            read_fasta_and_gff,
+            arg_list,
+            verbose=options.verbose,
+            scratch=scratch,
+        )
+        scratch.log_report()
     del arg_list
+    if shard is not None:
+        ShardResults(set_path, INGEST_STAGE).save(
+            shard,
+            file_stats,
+            {"input_toml": str(Path(input_toml).resolve())},
+        )
+        return
+    _write_proteome_tables(input_obj, file_stats, quiet=options.quiet)
+
+
+def gather_ingest(setname, click_loguru=None):
+    """Write proteome tables from the results of ingest shards."""
+    options = click_loguru.get_global_options()
+    shard_results = ShardResults(Path(setname), INGEST_STAGE)
+    file_stats, shard_options, unused_count = shard_results.load()
+    input_obj = TaxonomicInputTable(
+        Path(shard_options["input_toml"]), write_table=False
+    )
+    _write_proteome_tables(input_obj, file_stats, quiet=options.quiet)
+    shard_results.delete()
+
+
+def _write_proteome_tables(input_obj, file_stats, quiet=False):
+    """Write proteome and fragment tables from per-genome stats."""
+    input_table = input_obj.input_table
+    set_path = Path(input_obj.setname)
     seq_stats = pd.DataFrame.from_dict([s[0] for s in file_stats]).set_index(
         "path"
     )
@@ -183,7 +221,7 @@ def ingest_sequences(input_toml, click_loguru=None):
     )
     proteomes.drop(["fasta_url", "gff_url"], axis=1, inplace=True)
     proteomes = sort_proteome_frame(proteomes)
-    if not options.quiet:
+    if not quiet:
         with pd.option_context(
             "display.max_rows", None, "display.float_format", "{:,.2f}%".format
         ):
@@ -225,8 +263,12 @@ def ingest_sequences(input_toml, click_loguru=None):
         write_tsv_or_parquet(frags, new_frags_path)
 
 
-def read_fasta_and_gff(args, verbose=False):
-    """Read corresponding sequence and position files and construct consolidated tables."""
+def read_fasta_and_gff(args, verbose=False, scratch=None):
+    """Read corresponding sequence and position files and construct consolidated tables.
+
+    Downloads are put in scratch directories allocated from scratch,
+    which in a worker process is a copy of the caller's.
+    """
     dotpath, fasta_url, gff_url = args
     out_path = dotpath_to_path(dotpath)
     with read_from_url(fasta_url) as fasta_fh:
@@ -240,7 +282,7 @@ def read_fasta_and_gff(args, verbose=False):
             f"Number of proteins read {len(fasta_props)} is too small"
         )
         sys.exit(1)
-    with filepath_from_url(gff_url) as local_gff_file:
+    with filepath_from_url(gff_url, scratch) as local_gff_file:
         annotation = gffpd.read_gff3(local_gff_file)
     # We prefer mRNAs to CDS for reasons related to overlaps,
     # but non-euks don't usually have mRNA features in GFF.
@@ -359,6 +401,12 @@ def read_fasta_and_gff(args, verbose=False):
     # join GFF info to FASTA info
     joined_path = out_path / PROTEINS_FILE
     features = features.join(fasta_props)
+    # sequences are stored apart, numbered in protein order
+    SequenceStore.write(out_path, features["prot.seq"])
+    features[SEQ_IDX_COL] = pd.array(
+        range(len(features)), dtype=pd.UInt32Dtype()
+    )
+    del features["prot.seq"]
     write_tsv_or_parquet(features, joined_path, sort_cols=False)
     return proteome_stats, frag_stats, frags
 
@@ -613,8 +661,12 @@ def read_from_url(url):
 
 
 @contextlib.contextmanager
-def filepath_from_url(url):
-    """Get a local file from a URL, decompressing if needed."""
+def filepath_from_url(url, scratch):
+    """Get a local file from a URL, decompressing if needed.
+
+    Downloads go in a directory allocated from scratch, which is
+    removed on exit from the with block.
+    """
     filename = url.split("/")[-1]
     compressed = False
     uncompressed_filename = filename
@@ -628,19 +680,23 @@ def filepath_from_url(url):
     ):  # no transport, must be a file
         yield url
     else:
-        dirpath = tempfile.mkdtemp()
         filehandle = smart_open.open(url)
         dldata = filehandle.read()
-
-        def cleanup():
-            shutil.rmtree(dirpath)
-
-        with _cd(dirpath, cleanup):
-
-            with open(uncompressed_filename, "w") as f:
-                f.write(dldata)
-            tmpfile = str(Path(dirpath) / uncompressed_filename)
-            yield tmpfile
+        download_dir = scratch.allocate(
+            "download", int(np.ceil(len(dldata) / MEGABYTES))
+        )
+        try:
+            with _cd(download_dir.path):
+                with open(uncompressed_filename, "w") as f:
+                    f.write(dldata)
+                tmpfile = str(download_dir.path / uncompressed_filename)
+                yield tmpfile
+        finally:
+            download_dir.release()
+            logger.debug(
+                f"Download of {filename} used {download_dir.peak_mb} MB"
+                + f" of scratch on {download_dir.dev}"
+            )
 
 
 def _path_to_name(path_str, name_from_part, name_split_on, name_format):
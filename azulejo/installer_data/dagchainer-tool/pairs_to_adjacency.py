@@ -5,10 +5,13 @@ from pathlib import Path
 
 # third-party imports
 import click
-import networkx as nx
 import numpy as np
 import pandas as pd
 
+# module imports
+from azulejo.adjacency import adjacency_components
+from azulejo.adjacency import write_adjacency
+
 
 @click.command()
 @click.argument("infile", type=click.Path(readable=True))
@@ -16,48 +19,24 @@ import pandas as pd
 def pairs_to_adjacency(infile, outfile):
     "Using a 2-column tsv of edges, output a file of adjacencies"
     outpath = Path(outfile)
-    summarypath = outpath.parent / (
-        outpath.name[: -len(outpath.suffix)] + "_summary.tsv"
+    edges = pd.read_csv(
+        infile,
+        sep=r"\s+",
+        header=None,
+        usecols=[0, 1],
+        dtype=str,
+        comment="#",
+    ).to_numpy()
+    comp_fr = adjacency_components(
+        np.repeat(np.arange(len(edges)), 2), edges.ravel(), min_size=1
     )
-    histpath = outpath.parent / (
-        outpath.name[: -len(outpath.suffix)] + "_hist.tsv"
+    del edges
+    n_items, n_clusts, largest_cluster = write_adjacency(
+        comp_fr, outpath, hashes=False
     )
-    G = nx.read_edgelist(infile)
-    c = sorted(nx.connected_components(G), key=len, reverse=True)
-    fh = outpath.open("w")
-    fh.write("idx\tcluster_id\tsize\tmembers\n")
-    n_items = 0
-    count_list = []
-    id_list = []
-    for i, comp in enumerate(c):
-        component = np.sort(pd.Index(list(comp)).to_numpy())
-        id_list.append(i)
-        size = len(comp)
-        count_list.append(size)
-        for node in component:
-            fh.write(f"{n_items}\t{i}\t{size}\t{node}\n")
-            n_items += 1
-    fh.close()
     print(f"   Items:\t{n_items}")
-    n_clusts = len(count_list)
     print(f"   Clusters:\t{n_clusts}")
-    del G, c
-    cluster_counts = pd.DataFrame({"size": count_list})
-    largest_cluster = cluster_counts["size"].max()
     print(f"   Largest:\t{largest_cluster}")
-    cluster_hist = (
-        pd.DataFrame(cluster_counts.value_counts()).sort_index().reset_index()
-    )
-    cluster_hist = cluster_hist.set_index("size")
-    cluster_hist = cluster_hist.rename(columns={0: "n"})
-    cluster_hist["item_pct"] = (
-        cluster_hist["n"] * cluster_hist.index * 100.0 / n_items
-    )
-    cluster_hist.to_csv(histpath, sep="\t", float_format="%5.2f")
-    cluster_hist["cluster_pct"] = cluster_hist["n"] * 100.0 / n_clusts
-    cluster_hist.to_csv(histpath, sep="\t", float_format="%5.2f")
-    clusters = pd.DataFrame({"anchor.id": id_list, "count": count_list})
-    clusters.to_csv(summarypath, sep="\t")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""Timings and profiles of per-proteome passes."""
+# standard library imports
+import contextlib
+import cProfile
+import os
+import pstats
+import shutil
+import time
+import uuid
+
+# third-party imports
+import attr
+import pandas as pd
+
+# global constants
+PROFILE_PREFIX = "prof."
+PROFILE_FILE = "synteny_profile.parq"
+PROFILE_DIR = "synteny_profile"
+REPORT_FILE = "synteny_profile.txt"
+PSTATS_FILE = "synteny_profile.pstats"
+REPORT_LINES = 50
+
+
+@attr.s
+class Stopwatch:
+    """Accumulate timings and counts within a per-proteome task.
+
+    Time not spent in a timed section is counted as compute time.
+    """
+
+    start = attr.ib(factory=time.perf_counter)
+    times = attr.ib(factory=dict)
+    counts = attr.ib(factory=dict)
+
+    @contextlib.contextmanager
+    def timing(self, name):
+        """Add the time spent in the block to name."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[name] = (
+                self.times.get(name, 0.0) + time.perf_counter() - start
+            )
+
+    def count(self, name, value):
+        """Add value to the count of name."""
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def stats(self):
+        """Return timings and counts as profile stats."""
+        total = time.perf_counter() - self.start
+        stats = {
+            f"{PROFILE_PREFIX}{name}_s": val
+            for name, val in self.times.items()
+        }
+        stats[f"{PROFILE_PREFIX}compute_s"] = total - sum(self.times.values())
+        for name, val in self.counts.items():
+            stats[f"{PROFILE_PREFIX}{name}"] = val
+        return stats
+
+
+def add_stats(total, stats):
+    """Update total with stats, summing profile stats present in both."""
+    for key, val in stats.items():
+        if key.startswith(PROFILE_PREFIX) and key in total:
+            total[key] += val
+        else:
+            total[key] = val
+    return total
+
+
+def split_profile(stats_list, pass_code):
+    """Remove profile stats from a list of stats, returning them as a frame."""
+    rows = []
+    for stats in stats_list:
+        row = {
+            "level": "proteome",
+            "pass": pass_code,
+            "idx": stats["idx"],
+            "path": stats["path"],
+        }
+        for key in [k for k in stats if k.startswith(PROFILE_PREFIX)]:
+            row[key[len(PROFILE_PREFIX) :]] = stats.pop(key)
+        rows.append(row)
+    return pd.DataFrame.from_dict(rows)
+
+
+@contextlib.contextmanager
+def profiling(profile_dir):
+    """Profile the block into a dump of its own, if profile_dir is set.
+
+    Only one profiler can be active in a process at once on newer
+    Pythons, so blocks must not be profiled concurrently or nested.
+    """
+    if profile_dir is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(
+            profile_dir / f"{os.getpid()}-{uuid.uuid4().hex}.pstats"
+        )
+
+
+def run_profiled(args, pass_func=None, profile_dir=None, **kwargs):
+    """Call a per-proteome pass function under a profiler of its own."""
+    with profiling(profile_dir):
+        return pass_func(args, **kwargs)
+
+
+def write_profile_report(profile_dir, report_path, pstats_path):
+    """Merge the per-block dumps into one report and remove them."""
+    dump_list = sorted(profile_dir.glob("*.pstats"))
+    if not dump_list:
+        return
+    with report_path.open("w") as report_fh:
+        stats = pstats.Stats(
+            *[str(dump) for dump in dump_list], stream=report_fh
+        )
+        report_fh.write(f"Merged profile of {len(dump_list)} blocks\n")
+        stats.sort_stats("cumulative").print_stats(REPORT_LINES)
+        stats.sort_stats("tottime").print_stats(REPORT_LINES)
+    stats.dump_stats(pstats_path)
+    shutil.rmtree(profile_dir)
@@ -1,78 +1,130 @@
 # -*- coding: utf-8 -*-
 """Send and receive on-disk messages through names pips with file locking."""
 # standard library imports
+import atexit
 import contextlib
 import fcntl
+import os
+import shutil
 import sys
+import tempfile
+import threading
+import time
 from pathlib import Path
 
 # third-party imports
 import attr
 import numpy as np
 import numpy.ma as ma
+import pandas as pd
 from memory_tempfile import MemoryTempfile
 
 # module imports
+from .common import NAME
 from .common import SCRATCH_DEV
+from .common import MinSpaceTracker
 from .common import append_slash
 from .common import disk_usage_mb
 from .common import free_mb
 from .common import is_writable
+from .common import logger
 
 # global constants
 MAX_LINE_LEN = 144
+DEFAULT_BUCKETS = 64
+MEM_FS_TYPES = ["tmpfs", "shm"]
+MEM_RESERVE_MB = 1024
 
 
 # shared functions
 
 
 class SpaceAwareTempDevices:
-    """Allocate and collect stats on the fastest device that will hold your data."""
+    """Allocate and collect stats on the fastest device that will hold your data.
+
+    Scratch directories go on a memory file system if the space needed fits
+    there, otherwise on the scratch device if it fits, otherwise on the
+    fallback device.  Directories are removed on release, on exit from
+    a with block, or at interpreter exit.
+
+    Reservations are shared by threads, but processes get pickled copies
+    that don't see each other's reservations.  If n_processes copies
+    may allocate at once, a device is selected only if n_processes times
+    the space needed is unreserved there.
+    """
 
     class TempDirAllocator:
         """Reserve space and collect usage stats on a space-aware temp device."""
 
-        def __init(self, space_needed_mb=None):
-            """Select the fastest device with enough memory."""
+        def __init__(self, devices, stage, space_needed_mb=None):
+            """Select the fastest device with enough space and make a dir."""
+            self.devices = devices
+            self.stage = stage
             self.space_needed = space_needed_mb
-            self.dev = fallback_dir
-            if self.space_needed is not None:
-                if space_needed_mb < FREE_MEM_MB:
-                    memdev_list = MemoryTempfile(
-                        filesystem_types=["tmpfs", "shm"]
-                    ).get_usable_mem_tempdir_paths()
-                    for memdev in memdev_list:
-                        self.initial_space_free = free_mb(memdev)
-                        if self.initial_space_free >= space_needed_mb:
-                            self.dev = memdev
-                            break
-                if self.dev == fallback_dir and SCRATCH_DEV is not None:
-                    self.initial_space_free = free_mb(SCRATCH_DEV)
-                    if self.initial_space_free >= space_needed_mb:
-                        self.dev = SCRATCH_DEV
-            if self.dev == fallback_dir:
-                self.initial_space_free = free_mb(self.dev)
+            with devices.lock:
+                self.dev = devices.select(space_needed_mb)
+                devices.allocations[self.dev] += self.reserved_mb()
+            self.path = Path(
+                tempfile.mkdtemp(prefix=f"{NAME}-{stage}-", dir=self.dev)
+            )
+            self.peak_mb = 0
+            self.released = False
+            logger.debug(
+                f"Scratch for {stage} ({space_needed_mb} MB) is {self.path}"
+            )
+
+        def reserved_mb(self):
+            """Return the space reserved on the device."""
+            if self.space_needed is None:
+                return 0
+            return self.space_needed
+
+        def check(self):
+            """Update usage of this directory and free space on its device."""
+            if self.released:
+                return
+            self.peak_mb = max(self.peak_mb, disk_usage_mb(self.path))
+            self.devices.trackers[self.dev].check()
+
+        def release(self):
+            """Remove the directory and its reservation."""
+            if self.released:
+                return
+            self.check()
+            shutil.rmtree(self.path, ignore_errors=True)
+            with self.devices.lock:
+                self.devices.allocations[self.dev] -= self.reserved_mb()
+            self.released = True
 
     def __init__(
-        self, scratch_dev=None, fallback_dev="/tmp/", addl_fs_types=None
+        self,
+        scratch_dev=SCRATCH_DEV,
+        fallback_dev="/tmp/",
+        addl_fs_types=None,
+        n_processes=1,
     ):
         """Create a list of writable tmp devices and space allocations on them."""
-        self.fallback_dev = fallback_dev
+        self.fallback_dev = append_slash(str(fallback_dev))
+        self.n_processes = n_processes
         self.scratch_dev = scratch_dev
-        fs_types = ["tmpfs", "shm"]
+        fs_types = MEM_FS_TYPES.copy()
         if addl_fs_types is not None:
             fs_types += addl_fs_types
-        self.memdev_list = [
-            append_slash(dev)
-            for dev in MemoryTempfile(
-                filesystem_types=fs_types
-            ).get_usable_mem_tempdir_paths()
-            if is_writable(dev)
-        ]
+        self.memdev_list = []
+        real_devs = set()
+        for dev in MemoryTempfile(
+            filesystem_types=fs_types
+        ).get_usable_mem_tempdir_paths():
+            # the same file system may be mounted at more than one path
+            real_dev = os.path.realpath(dev)
+            if real_dev not in real_devs and is_writable(dev):
+                self.memdev_list.append(append_slash(dev))
+                real_devs.add(real_dev)
         logger.debug(f"Memory devices are {self.memdev_list}")
         if self.scratch_dev is not None:
+            self.scratch_dev = append_slash(str(self.scratch_dev))
             if not is_writable(self.scratch_dev):
-                logger.warn(
+                logger.warning(
                     f"Scratch device {self.scratch_dev} is not writable."
                 )
                 self.scratch_dev = None
@@ -86,25 +138,145 @@ class SpaceAwareTempDevices:
         self.allocatable_devices = self.memdev_list.copy()
         if self.scratch_dev is not None:
             self.allocatable_devices.append(self.scratch_dev)
-        self.allocations = {k: 0 for k in self.allocatable_devices}
-        self.min_free = {k: free_mb(k) for k in self.allocatable_devices}
+        self.allocations = {
+            k: 0 for k in self.allocatable_devices + [self.fallback_dev]
+        }
+        self.trackers = {
+            k: MinSpaceTracker(k)
+            for k in self.allocatable_devices + [self.fallback_dev]
+        }
+        self.allocators = []
+        self.lock = threading.Lock()
+        # don't leave scratch behind, e.g. in memory, on errors
+        atexit.register(self.release)
+
+    def __getstate__(self):
+        """Pickle all but the lock, so devices can be sent to processes."""
+        state = self.__dict__.copy()
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        """Restore state with a lock of this process's own."""
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        """Return the devices."""
+        return self
+
+    def __exit__(self, *unused_exc):
+        """Remove all scratch directories."""
+        self.release()
+        atexit.unregister(self.release)
+
+    def select(self, space_needed_mb):
+        """Return the fastest device with space_needed_mb unreserved.
+
+        Call with the lock held.
+        """
+        if space_needed_mb is None:
+            return self.fallback_dev
+        for dev in self.allocatable_devices:
+            available = free_mb(dev) - self.allocations[dev]
+            if dev in self.memdev_list:
+                # leave memory for the processes themselves
+                available -= MEM_RESERVE_MB
+            if available >= space_needed_mb * self.n_processes:
+                return dev
+        return self.fallback_dev
+
+    def allocate(self, stage, space_needed_mb=None):
+        """Return an allocator with a scratch directory for a stage."""
+        allocator = self.TempDirAllocator(self, stage, space_needed_mb)
+        with self.lock:
+            self.allocators.append(allocator)
+        return allocator
+
+    def check(self):
+        """Update usage stats of all directories."""
+        for allocator in self.allocators:
+            allocator.check()
+
+    def release(self):
+        """Remove all scratch directories."""
+        for allocator in self.allocators:
+            allocator.release()
+
+    def report(self):
+        """Return frames of per-stage and per-device scratch usage."""
+        stages = pd.DataFrame(
+            [
+                {
+                    "stage": allocator.stage,
+                    "dev": allocator.dev,
+                    "reserved_mb": allocator.reserved_mb(),
+                    "peak_mb": allocator.peak_mb,
+                }
+                for allocator in self.allocators
+            ],
+            columns=["stage", "dev", "reserved_mb", "peak_mb"],
+        )
+        used_devs = stages["dev"].unique()
+        devices = pd.DataFrame(
+            [
+                {
+                    "dev": dev,
+                    "initial_free_mb": tracker.initial_space,
+                    "min_free_mb": tracker.report_min(),
+                    "peak_used_mb": tracker.report_used(),
+                }
+                for dev, tracker in self.trackers.items()
+                if dev in used_devs
+            ],
+            columns=["dev", "initial_free_mb", "min_free_mb", "peak_used_mb"],
+        )
+        return stages, devices
+
+    def log_report(self):
+        """Log where each stage's scratch went and peak use of devices."""
+        stages, devices = self.report()
+        for unused_i, row in stages.iterrows():
+            logger.info(
+                f"Scratch for {row['stage']} was on {row['dev']}:"
+                + f" {row['peak_mb']} MB used,"
+                + f" {row['reserved_mb']} MB reserved"
+            )
+        for unused_i, row in devices.iterrows():
+            logger.info(
+                f"Peak scratch use of {row['dev']} was"
+                + f" {row['peak_used_mb']} MB of"
+                + f" {row['initial_free_mb']} MB free"
+            )
 
 
 @attr.s
 class DataMailboxes:
-    """Pass data to and from on-disk FIFOs."""
+    """Pass data to and from on-disk FIFOs.
+
+    If n_shards (a power of 2) is more than 1, each box is split into
+    shards by the high bits of hash_bits-wide hashes in the frame index,
+    so shards can be merged independently.
+    Time spent waiting for locks is accumulated in lock_wait.
+    """
 
     n_boxes = attr.ib()
     mb_dir_path = attr.ib(default=Path("./mailboxes/"))
     file_extension = attr.ib(default=None)
+    n_shards = attr.ib(default=1)
+    hash_bits = attr.ib(default=32)
+    lock_wait = attr.ib(default=0.0)
 
     def write_headers(self, header):
         """Initialize the mailboxes, writing a free-form header."""
-        self.mb_dir_path.mkdir(parents=True, exist_ok=True)
-        for i in range(self.n_boxes):
-            mb_path = self.path_to_mailbox(i)
-            with mb_path.open("w") as fh:
-                fh.write(header)
+        for shard in range(self.n_shards):
+            self.path_to_mailbox(0, shard).parent.mkdir(
+                parents=True, exist_ok=True
+            )
+            for i in range(self.n_boxes):
+                mb_path = self.path_to_mailbox(i, shard)
+                with mb_path.open("w") as fh:
+                    fh.write(header)
 
     def write_tsv_headers(self, columns, index_name=None):
         """Initialize the mailboxes, writing a tab-separated header."""
@@ -113,18 +285,16 @@ class DataMailboxes:
         else:
             start = f"{index_name}\t"
         colstring = "\t".join(columns)
-        self.mb_dir_path.mkdir(parents=True, exist_ok=True)
-        for i in range(self.n_boxes):
-            mb_path = self.path_to_mailbox(i)
-            with mb_path.open("w") as fh:
-                fh.write(f"{start}{colstring}\n")
+        self.write_headers(f"{start}{colstring}\n")
 
     @contextlib.contextmanager
-    def locked_open_for_write(self, box_no):
+    def locked_open_for_write(self, box_no, shard=0):
         """Acquire a lock on a m."""
-        mb_path = self.path_to_mailbox(box_no)
+        mb_path = self.path_to_mailbox(box_no, shard)
         with mb_path.open("a+") as fd:
+            start = time.perf_counter()
             fcntl.flock(fd, fcntl.LOCK_EX)
+            self.lock_wait += time.perf_counter() - start
             yield fd
             fcntl.flock(fd, fcntl.LOCK_UN)
 
@@ -137,20 +307,112 @@ class DataMailboxes:
             if delete:
                 box_path.unlink()
 
-    def path_to_mailbox(self, box_no):
+    def write_frame(self, box_no, frame):
+        """Append a frame to a mailbox as header-less TSV.
+
+        Returns the number of bytes written.
+        """
+        return self._write_tsv(box_no, frame)
+
+    def write_text(self, box_no, text):
+        """Append text to a mailbox, returning the number of bytes."""
+        with self.locked_open_for_write(box_no) as file_handle:
+            file_handle.write(text)
+        return len(text)
+
+    def append_boxes(self, other):
+        """Append the boxes of other, less headers, then delete them."""
+        for box_no in range(self.n_boxes):
+            with other.open_then_delete(box_no) as in_fh:
+                in_fh.readline()
+                with self.locked_open_for_write(box_no) as out_fh:
+                    shutil.copyfileobj(in_fh, out_fh)
+        other.delete()
+
+    def shards_of(self, hashes):
+        """Return the shard number of each of an array of hashes."""
+        if self.n_shards == 1:
+            return np.zeros(len(hashes), dtype=np.int64)
+        shift = self.hash_bits - (self.n_shards.bit_length() - 1)
+        return (
+            np.asarray(hashes, dtype=np.uint64) >> np.uint64(shift)
+        ).astype(np.int64)
+
+    def _write_tsv(self, box_no, frame):
+        """Append frame rows to the shards of a mailbox, returning bytes."""
+        if self.n_shards == 1:
+            return self.write_text(
+                box_no, frame.to_csv(header=False, sep="\t")
+            )
+        n_bytes = 0
+        shards = self.shards_of(frame.index)
+        for shard in np.unique(shards):
+            text = frame[shards == shard].to_csv(header=False, sep="\t")
+            with self.locked_open_for_write(box_no, shard) as file_handle:
+                file_handle.write(text)
+            n_bytes += len(text)
+        return n_bytes
+
+    def path_to_mailbox(self, box_no, shard=0):
         """Return a path to a mailbox file."""
         if self.file_extension is None:
             ext = ""
         else:
             ext = f".{self.file_extension}"
-        return self.mb_dir_path / f"{box_no}{ext}"
+        if self.n_shards == 1:
+            return self.mb_dir_path / f"{box_no}{ext}"
+        return self.mb_dir_path / f"shard={shard}" / f"{box_no}{ext}"
 
     def delete(self):
         """Remove the mailbox directory."""
-        file_list = list(self.mb_dir_path.glob("*"))
-        for file in file_list:
-            file.unlink()
-        self.mb_dir_path.rmdir()
+        shutil.rmtree(self.mb_dir_path)
+
+
+@attr.s
+class BucketedDataset:
+    """Pass rows to per-bucket readers through a partitioned Parquet dataset.
+
+    Rows are assigned to a fixed number of buckets by an integer key.
+    Each writer writes its own part file in each bucket, so no locking
+    is needed and the number of files does not grow with the number of
+    keys.
+    """
+
+    dataset_path = attr.ib()
+    key = attr.ib()
+    n_buckets = attr.ib(default=DEFAULT_BUCKETS)
+
+    def bucket_path(self, bucket):
+        """Return the path to a bucket directory."""
+        return self.dataset_path / f"bucket={bucket}"
+
+    def init(self):
+        """Create empty bucket directories."""
+        if self.dataset_path.exists():
+            self.delete()
+        for bucket in range(self.n_buckets):
+            self.bucket_path(bucket).mkdir(parents=True)
+
+    def write(self, frame, writer_id):
+        """Write a part file to each bucket with rows from frame."""
+        buckets = frame[self.key].to_numpy(dtype=np.int64) % self.n_buckets
+        for bucket in np.unique(buckets):
+            frame[buckets == bucket].to_parquet(
+                self.bucket_path(bucket) / f"part-{writer_id}.parq"
+            )
+
+    def read_bucket(self, bucket):
+        """Return all rows in a bucket, or None if empty."""
+        part_list = sorted(self.bucket_path(bucket).glob("part-*.parq"))
+        if len(part_list) == 0:
+            return None
+        return pd.concat(
+            [pd.read_parquet(part) for part in part_list], axis=0
+        )
+
+    def delete(self):
+        """Remove the dataset directory."""
+        shutil.rmtree(self.dataset_path)
 
 
 @attr.s
@@ -159,6 +421,7 @@ class ExternalMerge(object):
 
     file_path_func = attr.ib(default=None)
     n_merge = attr.ib(default=None)
+    value_dtype = attr.ib(default=np.uint32)
     value_vec = None
     fh_list = []
 
@@ -174,7 +437,7 @@ class ExternalMerge(object):
         self.value_vec = ma.masked_array(
             np.zeros(self.n_merge),
             mask=np.zeros(self.n_merge),
-        ).astype(np.uint32)
+        ).astype(self.value_dtype)
         self.payloads = np.array(
             [""] * self.n_merge, dtype=f"<U{MAX_LINE_LEN}"
         )
@@ -199,8 +462,12 @@ class ExternalMerge(object):
         for i in range(self.n_merge):
             self.fh_list[i].close()
 
-    def merge(self, merge_obj):
-        """Call merge_obj.merge_func for each merge, return merge_obj.results()."""
+    def merge(self, merge_obj, results=True):
+        """Call merge_obj.merge_func for each merge, return merge_obj.results().
+
+        If results is False, return merge_obj itself, so that merges of
+        several shards can be combined before results are calculated.
+        """
         while (~self.value_vec.mask).sum() > 1:
             minimum = np.amin(self.value_vec)
             min_vec = self.value_vec == minimum
@@ -214,4 +481,6 @@ class ExternalMerge(object):
                 )
             self._next_vals(where_min)
         self._close_all()
+        if not results:
+            return merge_obj
         return merge_obj.results()
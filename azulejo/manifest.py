@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""Record what produced the outputs of each stage, to skip current work."""
+# standard library imports
+import functools
+import json
+import os
+import sys
+from pathlib import Path
+
+# third-party imports
+import attr
+import pandas as pd
+import sh
+import xxhash
+
+# module imports
+from .common import SEARCH_PATHS
+from .common import atomic_path
+from .common import logger
+
+# global constants
+MANIFEST_FILE = "manifest.json"
+DIGEST_BLOCK_SIZE = 1 << 20
+# stages are stale if an earlier stage is
+STAGE_ORDER = ["homology", "synteny"]
+SET_ITEM = "set"
+
+
+def file_digest(filepath):
+    """Return a digest of the contents of a file."""
+    hasher = xxhash.xxh3_128()
+    with Path(filepath).open("rb") as file_fh:
+        for block in iter(lambda: file_fh.read(DIGEST_BLOCK_SIZE), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def tool_version(tool):
+    """Return the version line of an external tool, or None if missing."""
+    try:
+        command = sh.Command(tool, search_paths=SEARCH_PATHS)
+    except sh.CommandNotFound:
+        return None
+    try:
+        output = command("-version", _err_to_out=True)
+    except sh.ErrorReturnCode as errors:
+        output = errors.stdout.decode("utf-8")
+    return str(output).strip().split("\n")[0]
+
+
+@attr.s
+class Manifest:
+    """Digests of the inputs and outputs of stages, with their parameters.
+
+    Records are kept per stage by item, SET_ITEM for set-level outputs
+    and proteome paths for per-proteome ones.  A record is current if
+    the digests of its files and its parameters and tool versions are
+    unchanged.  File digests are cached by size and modification time,
+    so unchanged files are read only once.
+    """
+
+    set_path = attr.ib()
+    stages = attr.ib(factory=dict)
+    digests = attr.ib(factory=dict)
+
+    @classmethod
+    def load(cls, set_path):
+        """Return the manifest of a set, empty if none was saved."""
+        manifest_path = set_path / MANIFEST_FILE
+        if not manifest_path.exists():
+            return cls(set_path)
+        with manifest_path.open() as manifest_fh:
+            saved = json.load(manifest_fh)
+        return cls(set_path, stages=saved["stages"], digests=saved["digests"])
+
+    def save(self):
+        """Write the manifest to the set directory."""
+        with atomic_path(self.set_path / MANIFEST_FILE) as tmp_path:
+            with tmp_path.open("w") as manifest_fh:
+                json.dump(
+                    {"stages": self.stages, "digests": self.digests},
+                    manifest_fh,
+                    indent=1,
+                    sort_keys=True,
+                )
+
+    def key(self, path):
+        """Return the manifest key of a path, relative to the set."""
+        return Path(os.path.relpath(path, self.set_path)).as_posix()
+
+    def digest(self, key):
+        """Return the digest of a file or directory, or None if missing."""
+        path = self.set_path / key
+        if path.is_dir():
+            return xxhash.xxh3_128_hexdigest(
+                json.dumps(
+                    [
+                        (self.key(child), self.digest(self.key(child)))
+                        for child in sorted(path.rglob("*"))
+                        if child.is_file()
+                    ]
+                ).encode("utf-8")
+            )
+        if not path.exists():
+            return None
+        stat = path.stat()
+        file_stat = [stat.st_size, stat.st_mtime_ns]
+        cached = self.digests.get(key, None)
+        if cached is not None and cached[:2] == file_stat:
+            return cached[2]
+        digest = file_digest(path)
+        self.digests[key] = file_stat + [digest]
+        return digest
+
+    def spec(self, inputs, outputs, params=None, tools=None):
+        """Return the specification of an item from its paths."""
+        return {
+            "inputs": sorted(self.key(path) for path in inputs),
+            "outputs": sorted(self.key(path) for path in outputs),
+            "params": params or {},
+            "tools": tools or {},
+        }
+
+    def stale(self, stage, specs=None):
+        """Return the reasons items of a stage are stale, by item.
+
+        specs are item specifications of a run.  If not given, the
+        files of recorded items are checked.
+        """
+        records = self.stages.get(stage, {})
+        if specs is None:
+            specs = {
+                item: {
+                    "inputs": list(record["inputs"]),
+                    "outputs": list(record["outputs"]),
+                    "params": record["params"],
+                    "tools": record["tools"],
+                }
+                for item, record in records.items()
+            }
+        reasons = {}
+        for item, spec in specs.items():
+            reason = self._stale_reason(records.get(item, None), spec)
+            if reason is not None:
+                reasons[item] = reason
+        for item in records:
+            if item not in specs:
+                reasons[item] = "removed"
+        return reasons
+
+    def _stale_reason(self, record, spec):
+        """Return why a record does not match a spec, or None."""
+        if record is None:
+            return "not run"
+        for kind in ("params", "tools"):
+            if record[kind] != spec[kind]:
+                return f"{kind} changed"
+        for kind in ("inputs", "outputs"):
+            if sorted(record[kind]) != sorted(spec[kind]):
+                return f"{kind} changed"
+            for key in spec[kind]:
+                digest = self.digest(key)
+                if digest is None:
+                    return f"{key} missing"
+                if digest != record[kind][key]:
+                    return f"{key} changed"
+        return None
+
+    def record(self, stage, specs):
+        """Record the digests of items of a stage, then save."""
+        self.stages[stage] = {
+            item: {
+                "inputs": {key: self.digest(key) for key in spec["inputs"]},
+                "outputs": {key: self.digest(key) for key in spec["outputs"]},
+                "params": spec["params"],
+                "tools": spec["tools"],
+            }
+            for item, spec in specs.items()
+        }
+        self.save()
+
+    def is_current(self, stage, specs):
+        """Return True if all items of a stage are current, logging why not."""
+        reasons = self.stale(stage, specs)
+        if not reasons:
+            logger.info(f"Outputs of {stage} are current, skipping")
+            return True
+        if stage in self.stages:
+            item, reason = next(iter(reasons.items()))
+            logger.info(
+                f"{len(reasons)} items of {stage} are stale"
+                + f" (e.g., {item}: {reason})"
+            )
+        return False
+
+
+def _stage_order(stage):
+    """Return the position of a stage, or of the stage it is a subset of."""
+    return STAGE_ORDER.index(stage.split(".")[0])
+
+
+def print_status(setname):
+    """Print the status of the stages of a set and their stale items.
+
+    The manifest is not saved, so status can run alongside a stage.
+    """
+    set_path = Path(setname)
+    if not set_path.exists():
+        logger.error(f'Set "{setname}" does not exist.')
+        sys.exit(1)
+    manifest = Manifest.load(set_path)
+    if not manifest.stages:
+        logger.info(f"No stages have been recorded in {setname}")
+        return
+    rows = []
+    stale_items = []
+    stale_stages = []
+    for stage in sorted(manifest.stages, key=_stage_order):
+        reasons = manifest.stale(stage)
+        if reasons:
+            status = "stale"
+        elif any(
+            _stage_order(stale) < _stage_order(stage)
+            for stale in stale_stages
+        ):
+            status = "stale upstream"
+        else:
+            status = "current"
+        if status != "current":
+            stale_stages.append(stage)
+        rows.append(
+            {
+                "stage": stage,
+                "items": len(manifest.stages[stage]),
+                "stale": len(reasons),
+                "status": status,
+            }
+        )
+        stale_items += [
+            {"stage": stage, "item": item, "reason": reason}
+            for item, reason in reasons.items()
+        ]
+    with pd.option_context("display.max_rows", None):
+        print(pd.DataFrame.from_dict(rows).set_index("stage"))
+        if stale_items:
+            print(pd.DataFrame.from_dict(stale_items).set_index("stage"))
@@ -13,9 +13,10 @@ import pandas as pd
 
 # helper_functions
 def _unpack_payloads(vec):
-    """Unpack TSV ints in payload."""
+    """Unpack TSV ints in payload, keeping 64-bit hashes exact."""
     values = np.array(
-        [[int(i) for i in s.split("\t")] for s in vec.compressed()]
+        [[int(i) for i in s.split("\t")] for s in vec.compressed()],
+        dtype=np.uint64,
     ).transpose()
     return values
 
@@ -32,6 +33,7 @@ class AmbiguousMerger(object):
         start_base=0,
         ambig_ordinal_key="count.ambig",
         alt_hash=False,
+        hash_bits=32,
     ):
         """Create arrays as instance attributes."""
         self.count_key = count_key
@@ -39,7 +41,10 @@ class AmbiguousMerger(object):
         self.start_base = start_base
         self.ambig_key = ambig_key
         self.ambig_ordinal_key = ambig_ordinal_key
-        self.values = array.array("L")
+        if hash_bits == 64:
+            self.values = array.array("Q")
+        else:
+            self.values = array.array("L")
         self.counts = array.array("h")
         self.ambig = array.array("h")
         self.alt_hash = alt_hash
@@ -64,6 +69,22 @@ class AmbiguousMerger(object):
             self.count_dict[value] = count
             self.ambig_dict[value] = max_ambig
 
+    def add_merges(self, values, counts, ambigs):
+        """Add many merged values at once, as from precomputed counts."""
+        self.values.extend(values.tolist())
+        self.counts.extend(counts.tolist())
+        self.ambig.extend(ambigs.tolist())
+
+    def extend(self, other):
+        """Append the merges of another merger over a later hash range."""
+        self.values.extend(other.values)
+        self.counts.extend(other.counts)
+        self.ambig.extend(other.ambig)
+        if self.alt_hash:
+            self.alt_hash_dict.update(other.alt_hash_dict)
+            self.count_dict.update(other.count_dict)
+            self.ambig_dict.update(other.ambig_dict)
+
     def results(self):
         """Calculate list of merges."""
         drop_list = []
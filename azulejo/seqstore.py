@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""Per-proteome protein sequences as a memory-mapped blob with offsets."""
+# standard library imports
+import mmap
+import sys
+
+# third-party imports
+import attr
+import numpy as np
+
+# module imports
+from .common import logger
+
+# global constants
+SEQUENCES_FILE = "sequences.bin"
+SEQ_OFFSETS_FILE = "sequences.offsets.npy"
+SEQ_IDX_COL = "prot.seq_idx"
+
+
+@attr.s
+class SequenceStore:
+    """Concatenated sequences of a proteome, indexed by dense sequence ID.
+
+    Sequence i is the bytes between offsets i and i+1 of the blob.
+    Sequences are returned as memoryview slices of the mapped blob,
+    so reading them does not copy.
+    """
+
+    proteome_path = attr.ib()
+    offsets = attr.ib(default=None)
+    _blob = attr.ib(default=None)
+    _view = attr.ib(default=None)
+
+    @classmethod
+    def write(cls, proteome_path, seqs):
+        """Write an iterable of sequence strings, returning the store."""
+        encoded = [seq.encode("ascii") for seq in seqs]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+        np.cumsum([len(seq) for seq in encoded], out=offsets[1:])
+        with (proteome_path / SEQUENCES_FILE).open("wb") as blob_fh:
+            blob_fh.write(b"".join(encoded))
+        # offsets go last, so an interrupted write is not valid
+        np.save(proteome_path / SEQ_OFFSETS_FILE, offsets)
+        return cls(proteome_path)
+
+    def exists(self):
+        """Return True if sequences have been written."""
+        return (self.proteome_path / SEQ_OFFSETS_FILE).exists()
+
+    def load(self):
+        """Map the blob and read offsets."""
+        if not self.exists():
+            logger.error(f"No sequence store in {self.proteome_path}")
+            sys.exit(1)
+        self.offsets = np.load(self.proteome_path / SEQ_OFFSETS_FILE)
+        if self.offsets[-1] == 0:  # empty files can't be mapped
+            self._view = memoryview(b"")
+            return self
+        with (self.proteome_path / SEQUENCES_FILE).open("rb") as blob_fh:
+            self._blob = mmap.mmap(
+                blob_fh.fileno(), 0, access=mmap.ACCESS_READ
+            )
+        self._view = memoryview(self._blob)
+        return self
+
+    def __len__(self):
+        """Return the number of sequences."""
+        return len(self.offsets) - 1
+
+    def __getitem__(self, seq_idx):
+        """Return a sequence as a memoryview."""
+        return self._view[
+            int(self.offsets[seq_idx]) : int(self.offsets[seq_idx + 1])
+        ]
+
+    def lengths(self):
+        """Return the lengths of all sequences."""
+        return np.diff(self.offsets)
+
+    def write_fasta(self, file_handle, info):
+        """Write FASTA records with JSON headers of info rows to a binary file.
+
+        Info is indexed by protein ID and has a SEQ_IDX_COL column.
+        """
+        seq_idxs = info[SEQ_IDX_COL].to_numpy(dtype=np.int64)
+        header_info = info.drop(columns=[SEQ_IDX_COL])
+        for seq_idx, (prot_id, row) in zip(seq_idxs, header_info.iterrows()):
+            file_handle.write(f">{prot_id} {row.to_json()}\n".encode())
+            file_handle.write(self[seq_idx])
+            file_handle.write(b"\n")
+
+    def close(self):
+        """Release the mapping."""
+        if self._blob is not None:
+            self._view.release()
+            self._blob.close()
+            self._blob = None
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""Split per-proteome and per-cluster work across job-array shards."""
+# standard library imports
+import fcntl
+import json
+import pickle
+import re
+import shutil
+import sys
+
+# third-party imports
+import attr
+import click
+
+# module imports
+from .common import atomic_path
+from .common import logger
+
+# global constants
+SHARD_DIR = "shards"
+SHARD_RE = re.compile(r"^(\d+)/(\d+)$")
+
+
+@attr.s(frozen=True)
+class Shard:
+    """One of count deterministic slices of a list of work items."""
+
+    index = attr.ib()
+    count = attr.ib()
+
+    @classmethod
+    def parse(cls, spec):
+        """Return a shard from an "i/N" string, with 0 <= i < N."""
+        match = SHARD_RE.match(spec)
+        if match is None:
+            raise ValueError(f'shard "{spec}" is not of the form i/N')
+        index, count = (int(val) for val in match.groups())
+        if index >= count:
+            raise ValueError(f"shard index {index} is not less than {count}")
+        return cls(index=index, count=count)
+
+    def select(self, items):
+        """Return the slice of items belonging to this shard."""
+        return list(items)[self.index :: self.count]
+
+    def __str__(self):
+        """Return the shard in i/N form."""
+        return f"{self.index}/{self.count}"
+
+
+def parse_shard_option(unused_ctx, unused_param, value):
+    """Click callback converting an i/N option value to a Shard."""
+    if value is None:
+        return None
+    try:
+        return Shard.parse(value)
+    except ValueError as error:
+        raise click.BadParameter(str(error))
+
+
+@attr.s
+class ShardResults:
+    """Results of the shards of a stage, saved for gathering.
+
+    Each shard saves the results of its slice with the options it was
+    run under.  Loading checks that all shards are present and agree,
+    then returns results in the order of the unsharded list.
+    """
+
+    set_path = attr.ib()
+    stage = attr.ib()
+
+    @property
+    def path(self):
+        """Return the directory holding the stage's shard outputs."""
+        return self.set_path / SHARD_DIR / self.stage
+
+    def shard_path(self, shard):
+        """Return a per-shard directory for outputs other than results."""
+        shard_path = self.path / str(shard.index)
+        shard_path.mkdir(parents=True, exist_ok=True)
+        return shard_path
+
+    def run_once(self, name, func, *args, **kwargs):
+        """Return the JSON result of func, called by only the first shard.
+
+        Other shards wait on a file lock, then read the saved result.
+        """
+        self.path.mkdir(parents=True, exist_ok=True)
+        result_path = self.path / f"{name}.json"
+        with (self.path / f"{name}.lock").open("a") as lock_fh:
+            fcntl.flock(lock_fh, fcntl.LOCK_EX)
+            if result_path.exists():
+                logger.info(f"Using {name} results from another shard")
+                with result_path.open() as result_fh:
+                    result = json.load(result_fh)
+            else:
+                result = func(*args, **kwargs)
+                with atomic_path(result_path) as tmp_path:
+                    with tmp_path.open("w") as result_fh:
+                        json.dump(result, result_fh)
+            fcntl.flock(lock_fh, fcntl.LOCK_UN)
+        return result
+
+    def save(self, shard, results, options):
+        """Save the results of a shard and the options it ran under."""
+        self.path.mkdir(parents=True, exist_ok=True)
+        with atomic_path(self.path / f"{shard.index}.pkl") as tmp_path:
+            with tmp_path.open("wb") as results_fh:
+                pickle.dump(
+                    {
+                        "count": shard.count,
+                        "options": options,
+                        "results": list(results),
+                    },
+                    results_fh,
+                )
+        logger.info(
+            f"Shard {shard} of {self.stage} saved {len(results)} results,"
+            + f' gather with "azulejo gather {self.stage}'
+            + f' {self.set_path}"'
+        )
+
+    def load(self):
+        """Return interleaved results of all shards, options and count."""
+        saved = {}
+        for results_path in self.path.glob("*.pkl"):
+            with results_path.open("rb") as results_fh:
+                saved[int(results_path.stem)] = pickle.load(results_fh)
+        if not saved:
+            logger.error(f"No shard results found in {self.path}.")
+            sys.exit(1)
+        count = saved[min(saved)]["count"]
+        missing = [i for i in range(count) if i not in saved]
+        if missing:
+            logger.error(f"Results of {self.stage} shards {missing} missing.")
+            sys.exit(1)
+        options = saved[0]["options"]
+        mismatched = [
+            i
+            for i, shard_saved in saved.items()
+            if shard_saved["count"] != count
+            or shard_saved["options"] != options
+        ]
+        if mismatched:
+            logger.error(
+                f"{self.stage} shards {sorted(mismatched)} were run with"
+                + " different options or shard counts."
+            )
+            sys.exit(1)
+        results = [None] * sum(
+            len(shard_saved["results"]) for shard_saved in saved.values()
+        )
+        for i in range(count):
+            results[i::count] = saved[i]["results"]
+        logger.info(f"Gathered {len(results)} results of {count} shards")
+        return results, options, count
+
+    def delete(self):
+        """Remove the stage's shard outputs."""
+        if self.path.exists():
+            shutil.rmtree(self.path)
+        if self.path.parent.exists() and not any(self.path.parent.iterdir()):
+            self.path.parent.rmdir()
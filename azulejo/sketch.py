@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""Bloom filters of hashes seen in more than one proteome."""
+# standard library imports
+from pathlib import Path
+
+# third-party imports
+import attr
+import numpy as np
+
+# global constants
+TWICE_FILE = "twice.npy"
+BITS_PER_HASH = 10
+N_PROBES = 7
+MIX_1 = np.uint64(0xBF58476D1CE4E5B9)
+MIX_2 = np.uint64(0x94D049BB133111EB)
+GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _mix(vals):
+    """Return the splitmix64 finalizer of an array of uint64."""
+    vals = vals ^ (vals >> np.uint64(30))
+    vals = vals * MIX_1
+    vals = vals ^ (vals >> np.uint64(27))
+    vals = vals * MIX_2
+    return vals ^ (vals >> np.uint64(31))
+
+
+def _probes(hashes, n_bits, n_probes):
+    """Return byte offsets and bit masks for every probe of hashes."""
+    vals = np.asarray(hashes).astype(np.uint64)
+    first = _mix(vals)
+    step = _mix(vals ^ GOLDEN) | np.uint64(1)
+    probes = first[:, np.newaxis] + step[:, np.newaxis] * np.arange(
+        n_probes, dtype=np.uint64
+    )
+    positions = probes & np.uint64(n_bits - 1)
+    return (
+        (positions >> np.uint64(3)).astype(np.int64),
+        np.left_shift(
+            np.uint8(1), (positions & np.uint64(7)).astype(np.uint8)
+        ),
+    )
+
+
+@attr.s
+class SeenTwiceFilter:
+    """Two Bloom filters, of hashes seen at least once and at least twice.
+
+    Hashes are added one proteome at a time.  A hash for which
+    maybe_shared() returns False was certainly seen in only one
+    proteome; a hash seen in two or more always returns True.
+    Filters of disjoint sets of proteomes, of the same size, can be
+    merged.
+    """
+
+    n_bits = attr.ib()
+    n_probes = attr.ib(default=N_PROBES)
+    once = attr.ib(default=None)
+    twice = attr.ib(default=None)
+
+    def __attrs_post_init__(self):
+        """Allocate the bit arrays."""
+        self.once = np.zeros(self.n_bits // 8, dtype=np.uint8)
+        self.twice = np.zeros(self.n_bits // 8, dtype=np.uint8)
+
+    @classmethod
+    def for_size(cls, n_hashes, bits_per_hash=BITS_PER_HASH):
+        """Return a filter sized for n_hashes in total."""
+        n_bits = 1 << max(
+            6, int(np.ceil(np.log2(max(n_hashes, 1) * bits_per_hash)))
+        )
+        return cls(n_bits=n_bits)
+
+    def add(self, hashes):
+        """Add the unique hashes of one proteome."""
+        offsets, masks = _probes(hashes, self.n_bits, self.n_probes)
+        bits = np.zeros_like(self.once)
+        np.bitwise_or.at(bits, offsets.ravel(), masks.ravel())
+        self.twice |= self.once & bits
+        self.once |= bits
+
+    def merge(self, other):
+        """Add the proteomes of another filter, returning this one."""
+        self.twice |= other.twice | (self.once & other.once)
+        self.once |= other.once
+        return self
+
+    def maybe_shared(self, hashes):
+        """Return a mask of hashes that may be in more than one proteome."""
+        offsets, masks = _probes(hashes, self.n_bits, self.n_probes)
+        return ((self.twice[offsets] & masks) != 0).all(axis=1)
+
+    def publish(self, filter_dir):
+        """Write the filter of shared hashes and return it as shared."""
+        filter_dir = Path(filter_dir)
+        filter_dir.mkdir(parents=True, exist_ok=True)
+        np.save(filter_dir / TWICE_FILE, self.twice)
+        return SharedSeenTwiceFilter(
+            filter_dir=filter_dir, n_bits=self.n_bits, n_probes=self.n_probes
+        )
+
+
+@attr.s
+class SharedSeenTwiceFilter:
+    """The filter of shared hashes of a SeenTwiceFilter, on disk.
+
+    Only the path is pickled when the filter is passed to a task; each
+    task memory-maps the bits.
+    """
+
+    filter_dir = attr.ib()
+    n_bits = attr.ib()
+    n_probes = attr.ib(default=N_PROBES)
+
+    def maybe_shared(self, hashes):
+        """Return a mask of hashes that may be in more than one proteome."""
+        twice = np.load(self.filter_dir / TWICE_FILE, mmap_mode="r")
+        offsets, masks = _probes(hashes, self.n_bits, self.n_probes)
+        return ((twice[offsets] & masks) != 0).all(axis=1)
+
+    def delete(self):
+        """Remove the filter directory."""
+        (self.filter_dir / TWICE_FILE).unlink()
+        self.filter_dir.rmdir()
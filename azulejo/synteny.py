@@ -1,52 +1,105 @@
 # -*- coding: utf-8 -*-
 """Synteny (genome order) operations."""
 # standard library imports
+import functools
+import io
+import re
+import shutil
 import sys
-from itertools import combinations
+import time
 
 # from os.path import commonprefix as prefix
 from pathlib import Path
 
 # third-party imports
-import dask.bag as db
-import networkx as nx
+import attr
 import numpy as np
 import pandas as pd
 from dask.diagnostics import ProgressBar
 
 # module imports
+from .adjacency import adjacency_components
+from .adjacency import component_overlaps
+from .adjacency import relation_anchor_counts
+from .adjacency import write_adjacency
+from .clusterorder import CLUSTER_ORDER_DIR
+from .clusterorder import NA_CLUSTER
+from .clusterorder import ClusterOrder
+from .clusterorder import cluster_vec
 from .common import AMBIGUOUS_CODE
 from .common import ANCHOR_HIST_FILE
+from .common import ANCHOR_PROPS_FILE
 from .common import ANCHORS_FILE
 from .common import CLUSTERS_FILE
 from .common import CLUSTERSYN_FILE
 from .common import CODE_DICT
+from .common import DEFAULT_HASH_BITS
 from .common import DISAMBIGUATED_CODE
+from .common import HASH_BITS
 from .common import HOMOLOGY_FILE
 from .common import INDIRECT_CODE
 from .common import LOCALLY_UNAMBIGUOUS_CODE
+from .common import MEGABYTES
 from .common import NON_AMBIGUOUS_CODE
+from .common import PROTEIN_ROW_GROUP_SIZE
 from .common import PROTEOMOLOGY_FILE
 from .common import PROTEOSYN_FILE
+from .common import SEQUENCE_COLS
 from .common import SPINNER_UPDATE_PERIOD
 from .common import SYNTENY_FILE
-from .common import SYNTENY_FILETYPE
 from .common import UNAMBIGUOUS_CODE
 from .common import calculate_adjacency_group
 from .common import dotpath_to_path
 from .common import hash_array
 from .common import log_and_add_to_stats
 from .common import logger
+from .common import parquet_columns
+from .common import parquet_memory_mb
 from .common import read_tsv_or_parquet
 from .common import write_tsv_or_parquet
 from .hash import SyntenyBlockHasher
+from .executor import get_executor
+from .hashindex import HASH_INDEX_DIR
+from .hashindex import HashCounts
+from .hashindex import ProteomeHashIndex
+from .hashindex import index_key
+from .hashtable import SharedHashTable
+from .instrument import PROFILE_DIR
+from .instrument import PROFILE_FILE
+from .instrument import PSTATS_FILE
+from .instrument import REPORT_FILE
+from .instrument import Stopwatch
+from .instrument import add_stats
+from .instrument import profiling
+from .instrument import run_profiled
+from .instrument import split_profile
+from .instrument import write_profile_report
+from .mailboxes import BucketedDataset
 from .mailboxes import DataMailboxes
 from .mailboxes import ExternalMerge
+from .mailboxes import SpaceAwareTempDevices
+from .manifest import SET_ITEM
+from .manifest import Manifest
 from .merger import AmbiguousMerger
+from .shards import ShardResults
+from .sketch import SeenTwiceFilter
+from .workers import ChangedOnlyStore
+from .workers import FrameStore
+from .workers import ResidentWorkerPool
+from .workers import WriteBehindStore
+from .workers import run_and_flush
 
 # global constants
-__ALL__ = ["synteny_anchors"]
-CLUSTER_COLS = ["syn.anchor.id", "syn.anchor.count", "syn.anchor.direction"]
+__ALL__ = ["synteny_anchors", "gather_synteny"]
+SYNTENY_STAGE = "synteny"
+CLUSTER_COLS = [
+    "hom.cluster",
+    "path",
+    "frag.idx",
+    "syn.anchor.id",
+    "syn.anchor.count",
+    "syn.anchor.direction",
+]
 JOIN_COLS = [
     "member_ids",
     "syn.anchor.sub_id",
@@ -56,9 +109,6 @@ JOIN_COLS = [
     "frag.idx",
 ]
 ANCHOR_COLS = [
-    "path",
-    "syn.code",
-    "syn.anchor.count",
     "hom.cluster",
     "frag.id",
     "frag.pos",
@@ -75,7 +125,28 @@ ANCHOR_COLS = [
     "prot.n_ambig",
     "prot.no_stop",
 ]
-MAILBOX_SUBDIR = "mailboxes"
+ANCHOR_SORT_COLS = [
+    "syn.anchor.id",
+    "syn.anchor.sub_id",
+    "frag.idx",
+    "frag.pos",
+]
+CLUSTER_STATS_COLS = [
+    "in_synteny",
+    "n_anchors",
+    "max_frags_per_anch",
+    "synteny_pct",
+]
+ANCHOR_DATASET = "synteny"
+CLUSTER_DATASET = "synteny_clusters"
+ANCHOR_ROW_GROUP_SIZE = 65536
+# scratch space estimated per lane, plus per clustered protein
+SCRATCH_LANE_MB = 8
+SCRATCH_BYTES_PER_PROTEIN = {"mailboxes": 256, "merge": 256}
+SCRATCH_FRAME_BYTES_PER_PROTEIN = 256
+TABLE_PREFIX = "table."
+MAX_SHARDS = 64
+DISK_STORE = FrameStore()
 
 # CLI function
 def synteny_anchors(
@@ -86,32 +157,340 @@ def synteny_anchors(
     write_ambiguous=True,
     thorny=True,
     disambig_adj_only=True,
+    resident=False,
+    hash_bits=DEFAULT_HASH_BITS,
+    incremental=False,
+    prune=False,
+    subsets=None,
+    profile=False,
+    write_behind=False,
+    shard=None,
+    force=False,
 ):
-    """Calculate synteny anchors."""
+    """Calculate synteny anchors.
+
+    k may be a list of anchor lengths, in which case all are calculated
+    in the same passes and outputs are written side-by-side, named by hash.
+    If incremental is True, proteomes are hashed only if their persisted
+    hash index is missing or stale, and only changed proteomes are written.
+    If prune is True, hashes found in only one proteome are dropped before
+    each merge, using a filter of hashes seen in more than one.
+    subsets is a list of queries on proteome columns.  If given, anchors
+    are calculated for each subset of proteomes, reusing the persisted
+    hash indexes, and outputs are named by subset.
+    Timings are written to a profile file.  If profile is True, every
+    process is also profiled with cProfile into one merged report.
+    If write_behind is True, proteome files are compressed and written
+    in background threads while the next proteome is computed.
+    If shard is given, only the shard's slice of proteomes is hashed
+    into persisted hash indexes, and anchors are calculated from them
+    by gather_synteny().
+    Unless force is True, anchors are not recalculated if the manifest
+    shows that outputs are current.
+    """
     #
     # Marshal input arguments
     #
-    if k < 2:
+    if isinstance(k, int):
+        k_list = [k]
+    else:
+        k_list = sorted(set(k))
+    if min(k_list) < 2:
         logger.error("k must be at least 2.")
         sys.exit(1)
-    options = click_loguru.get_global_options()
-    user_options = click_loguru.get_user_global_options()
+    if hash_bits not in HASH_BITS:
+        logger.error(f"hash_bits must be one of {HASH_BITS}.")
+        sys.exit(1)
     set_path = Path(setname)
     file_stats_path = set_path / PROTEOMOLOGY_FILE
     proteomes = read_tsv_or_parquet(file_stats_path)
-    n_proteomes = len(proteomes)
     clusters = read_tsv_or_parquet(set_path / CLUSTERS_FILE)
+    cluster_order = ClusterOrder(set_path / CLUSTER_ORDER_DIR)
+    if not cluster_order.exists():
+        logger.debug("No cluster order, fragments will be grouped")
+        cluster_order = None
+    run_kwargs = {
+        "k_list": k_list,
+        "hasher_kwargs": {
+            "peatmer": peatmer,
+            "thorny": thorny,
+            "disambig_adj_only": disambig_adj_only,
+            "hash_bits": hash_bits,
+        },
+        "cluster_order": cluster_order,
+        "click_loguru": click_loguru,
+        "write_ambiguous": write_ambiguous,
+        "resident": resident,
+        "prune": prune,
+        "profile": profile,
+        "write_behind": write_behind,
+        "force": force,
+    }
+    if shard is not None:
+        hash_stats = _hash_shard(proteomes, shard, **run_kwargs)
+        # gather_synteny() runs with the options of the shards
+        ShardResults(set_path, SYNTENY_STAGE).save(
+            shard,
+            hash_stats,
+            {
+                "k": k_list,
+                "peatmer": peatmer,
+                "write_ambiguous": write_ambiguous,
+                "thorny": thorny,
+                "disambig_adj_only": disambig_adj_only,
+                "resident": resident,
+                "hash_bits": hash_bits,
+                "prune": prune,
+                "subsets": subsets,
+                "profile": profile,
+                "write_behind": write_behind,
+            },
+        )
+        return
+    if not subsets:
+        with SpaceAwareTempDevices(fallback_dev=set_path) as scratch:
+            _calculate_anchors(
+                set_path,
+                proteomes,
+                clusters,
+                incremental=incremental,
+                scratch=scratch,
+                **run_kwargs,
+            )
+        scratch.log_report()
+        return
+    subset_names = [_subset_name(query) for query in subsets]
+    if len(set(subset_names)) < len(subset_names):
+        logger.error(f"Subset names {subset_names} are not unique.")
+        sys.exit(1)
+    selections = [
+        _select_proteomes(proteomes, query, name)
+        for query, name in zip(subsets, subset_names)
+    ]
+    with SpaceAwareTempDevices(fallback_dev=set_path) as scratch:
+        for subset_name, subset_proteomes in zip(subset_names, selections):
+            # subsets reuse the per-proteome hashes
+            _calculate_anchors(
+                set_path,
+                subset_proteomes,
+                _subset_clusters(clusters, subset_proteomes, cluster_order),
+                incremental=True,
+                subset=subset_name,
+                scratch=scratch,
+                **run_kwargs,
+            )
+    scratch.log_report()
+
+
+def gather_synteny(setname, click_loguru=None):
+    """Calculate synteny anchors from the hash indexes of shards."""
+    shard_results = ShardResults(Path(setname), SYNTENY_STAGE)
+    unused_stats, shard_options, unused_count = shard_results.load()
+    synteny_anchors(
+        setname=setname,
+        click_loguru=click_loguru,
+        incremental=True,
+        **shard_options,
+    )
+    shard_results.delete()
+
+
+def _hash_shard(
+    proteomes,
+    shard,
+    k_list=None,
+    hasher_kwargs=None,
+    cluster_order=None,
+    click_loguru=None,
+    **unused_kwargs,
+):
+    """Save hash indexes and synteny files of a shard of proteomes."""
+    options = click_loguru.get_global_options()
+    executor = get_executor(click_loguru.get_user_global_options())
+    task_lanes = []
+    for k_val in k_list:
+        lane = SyntenyLane(
+            hasher=SyntenyBlockHasher(k=k_val, **hasher_kwargs),
+            multi=len(k_list) > 1,
+        )
+        kwargs = lane.task_kwargs()
+        kwargs.update({"index_name": lane.index_name(), "mailboxes": None})
+        task_lanes.append((lane.stats_prefix(), kwargs))
+    # numbered by position, as in unsharded passes
+    arg_list = shard.select(
+        enumerate(proteomes.reset_index(drop=True)["path"])
+    )
+    logger.info(
+        f"Hashing {len(arg_list)} of {len(proteomes)} proteomes"
+        + f" as shard {shard}"
+    )
+    if not options.quiet:
+        ProgressBar(dt=SPINNER_UPDATE_PERIOD).register()
+    return executor.map(
+        calculate_synteny_hashes,
+        arg_list,
+        lanes=task_lanes,
+        incremental=True,
+        cluster_order=cluster_order,
+    )
+
+
+def _subset_name(query):
+    """Return a name for outputs from a subset query."""
+    return re.sub(r"\W+", "_", query).strip("_")
+
+
+def _select_proteomes(proteomes, query, name):
+    """Return the proteomes selected by a query.
+
+    Column names containing dots need not be quoted with backticks.
+    """
+    names = list(proteomes.columns) + list(proteomes.index.names)
+    for col in sorted([n for n in names if n], key=len, reverse=True):
+        query = re.sub(
+            r"(?<![\w.`])" + re.escape(col) + r"(?![\w.`])",
+            f"`{col}`",
+            query,
+        )
+    try:
+        selected = proteomes.query(query)
+    except Exception as error:  # query errors are of many types
+        logger.error(f'Subset query "{query}" is not valid: {error}')
+        sys.exit(1)
+    if len(selected) < 2:
+        logger.error(
+            f"Subset {name} selects {len(selected)} proteomes,"
+            + " at least 2 are needed."
+        )
+        sys.exit(1)
+    logger.info(f"Subset {name} selects {len(selected)} proteomes")
+    return selected
+
+
+def _subset_clusters(clusters, proteomes, cluster_order):
+    """Return homology clusters with sizes counted within proteomes."""
+    if cluster_order is not None and cluster_order.clusters is None:
+        cluster_order.load()
+    counts = []
+    for dotpath in proteomes["path"]:
+        proteome_no = None
+        if cluster_order is not None:
+            proteome_no = cluster_order.proteome_number(dotpath)
+        if proteome_no is None:
+            vec = cluster_vec(
+                read_tsv_or_parquet(
+                    dotpath_to_path(dotpath) / HOMOLOGY_FILE,
+                    columns=["hom.cluster"],
+                    # unclustered proteins are not read
+                    filters=[("hom.cluster", ">=", 0)],
+                )["hom.cluster"]
+            )
+        else:
+            vec = cluster_order.proteome_clusters(proteome_no)
+        counts.append(pd.Series(vec[vec != NA_CLUSTER]).value_counts())
+    sizes = pd.concat(counts, axis=1).sum(axis=1)
+    sizes = sizes.reindex(clusters.index, fill_value=0)
+    subset_clusters = clusters[sizes.to_numpy() > 0].copy()
+    subset_clusters["size"] = sizes[sizes > 0].astype(
+        clusters["size"].dtype
+    )
+    return subset_clusters
+
+
+def _calculate_anchors(
+    set_path,
+    proteomes,
+    clusters,
+    k_list=None,
+    hasher_kwargs=None,
+    cluster_order=None,
+    click_loguru=None,
+    write_ambiguous=True,
+    resident=False,
+    incremental=False,
+    prune=False,
+    subset=None,
+    profile=False,
+    write_behind=False,
+    scratch=None,
+    force=False,
+):
+    """Calculate synteny anchors for a set or subset of proteomes.
+
+    Mailboxes and merge tables go in directories allocated from scratch.
+    """
+    options = click_loguru.get_global_options()
+    executor = get_executor(click_loguru.get_user_global_options())
+    # proteomes are numbered by position for mailboxes and writers
+    proteome_index = proteomes.index
+    proteomes = proteomes.reset_index(drop=True)
+    proteomes.index.name = proteome_index.name
+    n_proteomes = len(proteomes)
     n_clusters = len(clusters)
-    hasher = SyntenyBlockHasher(
-        k=k,
-        peatmer=peatmer,
-        thorny=thorny,
-        disambig_adj_only=disambig_adj_only,
+    lanes = [
+        SyntenyLane(
+            hasher=SyntenyBlockHasher(k=k_val, **hasher_kwargs),
+            multi=len(k_list) > 1,
+            subset=subset,
+        )
+        for k_val in k_list
+    ]
+    manifest = Manifest.load(set_path)
+    stage = _subset_file_name(SYNTENY_STAGE, subset)
+    specs = _synteny_specs(
+        manifest,
+        set_path,
+        proteomes,
+        lanes,
+        subset,
+        {
+            "k": k_list,
+            **hasher_kwargs,
+            "write_ambiguous": write_ambiguous,
+            "prune": prune,
+        },
+    )
+    if not force and manifest.is_current(stage, specs):
+        return
+    hash_names = ", ".join(
+        [lane.hasher.hash_name(no_prefix=True) for lane in lanes]
     )
+    if subset is None:
+        subset_msg = ""
+    else:
+        subset_msg = f" in subset {subset}"
     logger.info(
-        f"Calculating {hasher.hash_name(no_prefix=True)} synteny anchors"
-        + f" for {n_proteomes} proteomes"
+        f"Calculating {hash_names} synteny anchors"
+        + f" for {n_proteomes} proteomes{subset_msg}"
     )
+    if profile:
+        profile_dir = set_path / _subset_file_name(PROFILE_DIR, subset)
+        if profile_dir.exists():
+            shutil.rmtree(profile_dir)
+        profile_dir.mkdir()
+    else:
+        profile_dir = None
+    n_proteins = int(clusters["size"].sum())
+    if subset is None:
+        stage_suffix = ""
+    else:
+        stage_suffix = f"-{subset}"
+    scratch_bytes = dict(SCRATCH_BYTES_PER_PROTEIN)
+    if incremental and not resident:
+        # proteome files are replaced at the end, only if changed
+        scratch_bytes["frames"] = SCRATCH_FRAME_BYTES_PER_PROTEIN
+    scratch_dirs = {
+        stage: scratch.allocate(
+            stage + stage_suffix,
+            int(
+                np.ceil(
+                    len(lanes)
+                    * (SCRATCH_LANE_MB + n_proteins * n_bytes / MEGABYTES)
+                )
+            ),
+        )
+        for stage, n_bytes in scratch_bytes.items()
+    }
     # durable argument list for passes
     arg_list = [
         (
@@ -123,13 +502,19 @@ def synteny_anchors(
     runner = PassRunner(
         {
             "n_proteomes": n_proteomes,
+            "n_proteins": n_proteins,
             "set_path": set_path,
-            "hasher": hasher,
+            "lanes": lanes,
             "quiet": options.quiet,
-            "parallel": user_options["parallel"],
-            "bag": db.from_sequence(arg_list),
+            "executor": executor,
             "merge_args": arg_list,
             "click_loguru": click_loguru,
+            "resident": resident,
+            "incremental": incremental,
+            "prune": prune,
+            "profile_dir": profile_dir,
+            "write_behind": write_behind,
+            "scratch_dirs": scratch_dirs,
         }
     )
     #
@@ -138,147 +523,300 @@ def synteny_anchors(
     #  2. disambiguate ambiguous anchors adjacent to unambiguous ones
     #  3. find non-ambiguous hashes uncovered by 2)
     #
-    for pass_code in [
+    proteomes = runner.make_pass(
         UNAMBIGUOUS_CODE,
+        proteomes,
+        extra_kwargs={
+            "incremental": incremental,
+            "cluster_order": cluster_order,
+        },
+        lane_kwargs=[
+            {"index_name": lane.index_name()} for lane in lanes
+        ],
+    )
+    for pass_code in [
         DISAMBIGUATED_CODE,
         NON_AMBIGUOUS_CODE,
     ]:
         proteomes = runner.make_pass(pass_code, proteomes)
     runner.add_ambig_to_total_assigned()
-    n_anchors = runner.get_total_assigned()
     #
     # Fourth pass -- merge, write anchor and homology info
     #
-    join_mb = DataMailboxes(
-        n_boxes=n_proteomes,
-        mb_dir_path=(set_path / MAILBOX_SUBDIR / "join"),
-        file_extension="tsv",
-    )
-    join_mb.write_tsv_headers(JOIN_COLS)
-    cluster_mb = DataMailboxes(
-        n_boxes=n_clusters,
-        mb_dir_path=(set_path / MAILBOX_SUBDIR / "clusters"),
-        file_extension="tsv",
-    )
-    cluster_mb.write_tsv_headers(CLUSTER_COLS)
-    anchor_mb = DataMailboxes(
-        n_boxes=n_anchors,
-        mb_dir_path=(set_path / MAILBOX_SUBDIR / "anchors"),
-        file_extension="tsv",
-    )
-    anchor_mb.write_tsv_headers(ANCHOR_COLS)
+    lane_kwargs = []
+    for lane in lanes:
+        join_mb = DataMailboxes(
+            n_boxes=n_proteomes,
+            mb_dir_path=lane.mailbox_path(
+                scratch_dirs["mailboxes"].path, "join"
+            ),
+            file_extension="tsv",
+        )
+        join_mb.write_tsv_headers(JOIN_COLS)
+        cluster_ds = BucketedDataset(
+            dataset_path=lane.mailbox_path(
+                scratch_dirs["merge"].path, "clusters"
+            ),
+            key="hom.cluster",
+        )
+        cluster_ds.init()
+        anchor_ds = BucketedDataset(
+            dataset_path=lane.mailbox_path(
+                scratch_dirs["merge"].path, "anchors"
+            ),
+            key="syn.anchor.id",
+        )
+        anchor_ds.init()
+        lane_kwargs.append(
+            {
+                "join_mb": join_mb,
+                "cluster_ds": cluster_ds,
+                "anchor_ds": anchor_ds,
+            }
+        )
     proteomes = runner.make_pass(
         INDIRECT_CODE,
         proteomes,
         extra_kwargs={
-            "join_mb": join_mb,
-            "cluster_mb": cluster_mb,
-            "anchor_mb": anchor_mb,
             "n_proteomes": n_proteomes,
             "write_ambiguous": write_ambiguous,
         },
+        lane_kwargs=lane_kwargs,
     )
+    runner.close()
+    runner.write_profile(set_path / _subset_file_name(PROFILE_FILE, subset))
+    proteomes.index = proteome_index
     write_tsv_or_parquet(
-        proteomes, set_path / PROTEOSYN_FILE, remove_tmp=False
-    )
-    adjacency_stats = anchors_to_adjacency(
-        set_path, n_proteomes, join_mb.open_then_delete
+        proteomes,
+        set_path / _subset_file_name(PROTEOSYN_FILE, subset),
+        remove_tmp=False,
     )
-    logger.info(f"adjacency_stats: {adjacency_stats}")
-    return
-    #
-    # Write anchors
-    #
-    click_loguru.elapsed_time("Anchor writing")
-    arg_list = [(i,) for i in range(n_anchors)]
-    anchor_path = set_path / "synteny"
-    anchor_path.mkdir(exist_ok=True)
-    logger.info(f"Writing {n_anchors} synteny anchors to {anchor_path}:")
-    if not options.quiet:
-        ProgressBar(dt=SPINNER_UPDATE_PERIOD).register()
-    if parallel:
-        bag = db.from_sequence(arg_list)
-        anchor_stats = bag.map(
-            write_anchor,
-            mailbox_reader=anchor_mb.open_then_delete,
-            synteny_parent=anchor_path,
-        ).compute()
-    else:
-        anchor_stats = []
-        for args in arg_list:
-            anchor_stats.append(
-                write_anchor(
-                    args,
-                    mailbox_reader=anchor_mb.open_then_delete,
-                    synteny_parent=anchor_path,
-                )
-            )
-    anchor_mb.delete()
-    anchor_stat_list = []
-    for results in anchor_stats:
-        if results is not None:
+    for lane, ds_kwargs in zip(lanes, lane_kwargs):
+        adjacency_stats = anchors_to_adjacency(
+            set_path,
+            n_proteomes,
+            ds_kwargs["join_mb"].open_then_delete,
+            anchors_path=set_path / lane.file_name(ANCHORS_FILE),
+        )
+        logger.info(f"{lane.log_name()}adjacency_stats: {adjacency_stats}")
+        #
+        # Write anchors
+        #
+        click_loguru.elapsed_time(f"{lane.log_name()}Anchor writing")
+        anchor_ds = ds_kwargs["anchor_ds"]
+        anchor_path = set_path / lane.file_name(ANCHOR_DATASET)
+        if anchor_path.exists():
+            shutil.rmtree(anchor_path)
+        anchor_path.mkdir()
+        logger.info(
+            f"Writing {lane.get_total_assigned()} synteny anchors"
+            + f" in {anchor_ds.n_buckets} buckets to {anchor_path}:"
+        )
+        anchor_stats = _map_buckets(
+            write_anchor_bucket,
+            anchor_ds.n_buckets,
+            executor=executor,
+            quiet=options.quiet,
+            anchor_ds=anchor_ds,
+            anchor_parent=anchor_path,
+        )
+        anchor_ds.delete()
+        anchor_stat_list = []
+        for results in anchor_stats:
             anchor_stat_list += results
-    anchor_frame = pd.DataFrame.from_dict(results)
-    write_tsv_or_parquet(
-        anchor_frame,
-        set_path / ANCHORS_FILE,
-        sort_cols=False,
-    )
-    #
-    # Merge synteny into clusters
-    #
-    arg_list = [(i,) for i in range(n_clusters)]
-    click_loguru.elapsed_time("Synteny joining")
-    homology_path = set_path / "homology"
-    logger.info(
-        f"Joining synteny info to {n_clusters} clusters in {homology_path}:"
-    )
-    if not options.quiet:
-        ProgressBar(dt=SPINNER_UPDATE_PERIOD).register()
-    if parallel:
-        bag = db.from_sequence(arg_list)
-        cluster_stats = bag.map(
-            join_synteny_to_clusters,
-            mailbox_reader=cluster_mb.open_then_delete,
-            cluster_parent=homology_path,
-        ).compute()
-    else:
-        cluster_stats = []
-        for args in arg_list:
-            cluster_stats.append(
-                join_synteny_to_clusters(
-                    args,
-                    mailbox_reader=cluster_mb.open_then_delete,
-                    cluster_parent=homology_path,
-                )
+        anchor_frame = pd.DataFrame.from_dict(anchor_stat_list)
+        if len(anchor_frame) > 0:
+            anchor_frame.sort_values(
+                by=["anchor.id", "sub"], inplace=True, ignore_index=True
             )
-    cluster_mb.delete()
-    cluster_frame = pd.DataFrame.from_dict(cluster_stats)
-    cluster_frame.set_index(["clust_id"], inplace=True)
-    cluster_frame.sort_index(inplace=True)
-    clusters = _concat_without_overlap(clusters, cluster_frame)
-    write_tsv_or_parquet(
-        clusters, set_path / CLUSTERSYN_FILE, float_format="%5.2f"
-    )
-    mean_gene_synteny = (
-        clusters["in_synteny"].sum() * 100.0 / clusters["size"].sum()
-    )
-    mean_clust_synteny = clusters["synteny_pct"].mean()
-    logger.info(
-        f"Mean anchor coverage: {mean_gene_synteny: .1f}% (on proteins)"
-    )
-    logger.info(
-        f"Mean cluster anchor coverage: {mean_clust_synteny:.1f}% (on clusters)"
-    )
+        write_tsv_or_parquet(
+            anchor_frame,
+            set_path / lane.file_name(ANCHOR_PROPS_FILE),
+            sort_cols=False,
+        )
+        #
+        # Merge synteny into clusters
+        #
+        click_loguru.elapsed_time(f"{lane.log_name()}Synteny joining")
+        cluster_ds = ds_kwargs["cluster_ds"]
+        cluster_path = set_path / lane.file_name(CLUSTER_DATASET)
+        if cluster_path.exists():
+            shutil.rmtree(cluster_path)
+        cluster_path.mkdir()
+        logger.info(
+            f"Joining synteny info to {n_clusters} clusters"
+            + f" in {cluster_ds.n_buckets} buckets to {cluster_path}:"
+        )
+        cluster_stats = _map_buckets(
+            join_synteny_to_cluster_bucket,
+            cluster_ds.n_buckets,
+            executor=executor,
+            quiet=options.quiet,
+            cluster_ds=cluster_ds,
+            cluster_parent=cluster_path,
+            cluster_sizes=clusters["size"],
+        )
+        cluster_ds.delete()
+        cluster_frame = pd.concat(
+            [stats for stats in cluster_stats if stats is not None]
+            + [pd.DataFrame(columns=CLUSTER_STATS_COLS)],
+            axis=0,
+        )
+        cluster_frame = cluster_frame.reindex(
+            clusters.index, fill_value=0
+        ).astype({col: "float64" for col in CLUSTER_STATS_COLS})
+        cluster_frame.index.name = clusters.index.name
+        lane_clusters = _concat_without_overlap(clusters, cluster_frame)
+        write_tsv_or_parquet(
+            lane_clusters,
+            set_path / lane.file_name(CLUSTERSYN_FILE),
+            float_format="%5.2f",
+        )
+        mean_gene_synteny = (
+            lane_clusters["in_synteny"].sum()
+            * 100.0
+            / lane_clusters["size"].sum()
+        )
+        mean_clust_synteny = lane_clusters["synteny_pct"].mean()
+        logger.info(
+            f"Mean anchor coverage: {mean_gene_synteny: .1f}% (on proteins)"
+        )
+        logger.info(
+            "Mean cluster anchor coverage:"
+            + f" {mean_clust_synteny:.1f}% (on clusters)"
+        )
+    for allocator in scratch_dirs.values():
+        allocator.release()
+    if profile_dir is not None:
+        report_path = set_path / _subset_file_name(REPORT_FILE, subset)
+        write_profile_report(
+            profile_dir,
+            report_path,
+            set_path / _subset_file_name(PSTATS_FILE, subset),
+        )
+        logger.info(f"Profile report written to {report_path}")
+    manifest.record(stage, specs)
     click_loguru.elapsed_time(None)
 
 
+def _subset_file_name(filename, subset):
+    """Return filename, with the subset name before the suffix if given."""
+    if subset is None:
+        return filename
+    path = Path(filename)
+    return f"{path.stem}.{subset}{path.suffix}"
+
+
+def _synteny_specs(manifest, set_path, proteomes, lanes, subset, params):
+    """Return manifest specifications of the outputs of synteny."""
+    set_inputs = [set_path / PROTEOMOLOGY_FILE, set_path / CLUSTERS_FILE]
+    if (set_path / CLUSTER_ORDER_DIR).exists():
+        set_inputs.append(set_path / CLUSTER_ORDER_DIR)
+    set_outputs = [set_path / _subset_file_name(PROTEOSYN_FILE, subset)]
+    for lane in lanes:
+        set_outputs += [
+            set_path / lane.file_name(name)
+            for name in (
+                ANCHORS_FILE,
+                ANCHOR_PROPS_FILE,
+                CLUSTERSYN_FILE,
+                ANCHOR_DATASET,
+                CLUSTER_DATASET,
+            )
+        ]
+    specs = {SET_ITEM: manifest.spec(set_inputs, set_outputs, params=params)}
+    for dotpath in proteomes["path"]:
+        proteome_path = dotpath_to_path(dotpath)
+        specs[dotpath] = manifest.spec(
+            [proteome_path / HOMOLOGY_FILE],
+            [proteome_path / lane.file_name(SYNTENY_FILE) for lane in lanes],
+        )
+    return specs
+
+
+@attr.s
+class SyntenyLane:
+    """Per-hash state carried through the passes.
+
+    Lanes of a subset run name their outputs by subset, then by hash.
+    """
+
+    hasher = attr.ib()
+    multi = attr.ib(default=False)
+    subset = attr.ib(default=None)
+    n_assigned_list = attr.ib(factory=list)
+    unambig = attr.ib(default=None)
+    ambig = attr.ib(default=None)
+
+    def _labels(self):
+        """Return the labels distinguishing this lane's outputs."""
+        labels = []
+        if self.subset is not None:
+            labels.append(self.subset)
+        if self.multi:
+            labels.append(self.hasher.base_name())
+        return labels
+
+    def file_name(self, filename):
+        """Return filename, with the lane labels before the suffix."""
+        labels = self._labels()
+        if not labels:
+            return filename
+        path = Path(filename)
+        return f"{path.stem}.{'.'.join(labels)}{path.suffix}"
+
+    def index_name(self):
+        """Return the name of per-proteome hash indexes, shared by subsets."""
+        if not self.multi:
+            return HASH_INDEX_DIR
+        return f"{HASH_INDEX_DIR}.{self.hasher.base_name()}"
+
+    def mailbox_path(self, scratch_path, name):
+        """Return the path to a mailbox directory or table for this lane."""
+        return scratch_path.joinpath(*self._labels(), name)
+
+    def stats_prefix(self):
+        """Return the prefix for this lane's synteny stats columns."""
+        if not self.multi:
+            return ""
+        return self.hasher.base_name()
+
+    def log_name(self):
+        """Return a lane label for log messages."""
+        labels = self._labels()
+        if not labels:
+            return ""
+        return f"{' '.join(labels)} "
+
+    def task_kwargs(self):
+        """Return the keyword arguments for a per-proteome pass function."""
+        return {
+            "hasher": self.hasher,
+            "unambig": self.unambig,
+            "ambig": self.ambig,
+            "synteny_file": self.file_name(SYNTENY_FILE),
+        }
+
+    def get_total_assigned(self):
+        """Return the total assigned anchors."""
+        return sum(self.n_assigned_list)
+
+    def delete_tables(self):
+        """Remove the hash tables published by the last merge."""
+        for table in (self.unambig, self.ambig):
+            if table is not None:
+                table.delete()
+        self.unambig = None
+        self.ambig = None
+
+
 class PassRunner:
     """Run a pass over all proteomes."""
 
     def __init__(self, std_kwargs):
         """Save initial pass info"""
         self.std_kwargs = std_kwargs
+        self.lanes = std_kwargs["lanes"]
         self.last_code = None
         self.pass_name = "Hashing"
         self.merger_kw_dict = {
@@ -305,133 +843,752 @@ class PassRunner:
             NON_AMBIGUOUS_CODE: merge_disambig_hashes,
             INDIRECT_CODE: merge_nonambig_hashes,
         }
-        self.n_assigned_list = []
-        self.ambig = None
-        self.unambig = None
         self.log_ambig = False
+        self.incremental = std_kwargs.get("incremental", False)
+        self.prune = std_kwargs.get("prune", False)
+        self.pool = None
+        self.profile_dir = std_kwargs.get("profile_dir", None)
+        self.profiles = []
+        self.write_behind = std_kwargs.get("write_behind", False)
+        if self.write_behind:
+            self.store = WriteBehindStore()
+        else:
+            self.store = DISK_STORE
+        if self.incremental and not std_kwargs.get("resident", False):
+            self.store = ChangedOnlyStore(
+                std_kwargs["scratch_dirs"]["frames"].path, self.store
+            )
+        self.executor = std_kwargs["executor"]
+        if self.profile_dir is not None and self.executor.shares_processes():
+            logger.warning(
+                "Per-proteome tasks are not profiled while they share"
+                + f" processes under the {self.executor.scheduler} scheduler"
+            )
+        # one hash-range shard per worker, rounded up to a power of 2
+        self.n_shards = min(
+            1 << (self.executor.worker_count() - 1).bit_length(), MAX_SHARDS
+        )
+        if std_kwargs.get("resident", False):
+            if self.executor.max_memory is not None:
+                logger.warning(
+                    "--max_memory does not apply to resident workers,"
+                    + " which each hold their proteomes for the whole run"
+                )
+            if self.executor.parallel:
+                n_workers = self.executor.worker_count()
+            else:
+                n_workers = 0
+            self.pool = ResidentWorkerPool(
+                std_kwargs["merge_args"],
+                n_workers,
+                changed_only=self.incremental,
+                write_behind=self.write_behind,
+            )
 
     def make_pass(
         self,
         code,
         proteomes,
         extra_kwargs=None,
+        lane_kwargs=None,
     ):
         """Make a calculate-merge pass over each proteome."""
         self.std_kwargs["click_loguru"].elapsed_time(self.pass_name)
-        if self.unambig is not None:
+        for lane in self.lanes:
+            if lane.unambig is None:
+                continue
             if self.log_ambig:
-                ambig_msg = f" and {len(self.ambig)} ambiguous"
+                ambig_msg = f" and {len(lane.ambig)} ambiguous"
             else:
                 ambig_msg = ""
             logger.info(
-                f"Merging {len(self.unambig)} {CODE_DICT[self.last_code]}"
-                + f"({self.last_code}){ambig_msg} synteny anchors into proteomes"
+                f"Merging {len(lane.unambig)} {lane.log_name()}"
+                + f"{CODE_DICT[self.last_code]}({self.last_code}){ambig_msg}"
+                + " synteny anchors into proteomes"
             )
         if extra_kwargs is None:
             extra_kwargs = {}
-        kwargs = {
-            "unambig": self.unambig,
-            "ambig": self.ambig,
-            "hasher": self.std_kwargs["hasher"],
-        }
-        if code in self.merger_kw_dict:
-            mailboxes = DataMailboxes(
-                n_boxes=self.std_kwargs["n_proteomes"],
-                mb_dir_path=(
-                    self.std_kwargs["set_path"]
-                    / MAILBOX_SUBDIR
-                    / CODE_DICT[code]
-                ),
-            )
-            mailboxes.write_headers("hash\n")
-            kwargs["mailboxes"] = mailboxes
+        if lane_kwargs is None:
+            lane_kwargs = [{} for lane in self.lanes]
+        count_hashes = self.incremental and code == UNAMBIGUOUS_CODE
+        task_lanes = []
+        for lane, lane_extra_kwargs in zip(self.lanes, lane_kwargs):
+            kwargs = lane.task_kwargs()
+            kwargs.update(lane_extra_kwargs)
+            if count_hashes:
+                kwargs["mailboxes"] = None
+            elif code in self.merger_kw_dict:
+                mailboxes = DataMailboxes(
+                    n_boxes=self.std_kwargs["n_proteomes"],
+                    mb_dir_path=lane.mailbox_path(
+                        self.std_kwargs["scratch_dirs"]["mailboxes"].path,
+                        CODE_DICT[code],
+                    ),
+                    n_shards=self.n_shards,
+                    hash_bits=lane.hasher.hash_bits,
+                )
+                mailboxes.write_headers("hash\n")
+                kwargs["mailboxes"] = mailboxes
+            task_lanes.append((lane.stats_prefix(), kwargs))
+        extra_kwargs["lanes"] = task_lanes
         merge_func = self.merge_function_dict[code]
+        if code != UNAMBIGUOUS_CODE:
+            extra_kwargs["merge_func"] = merge_func
+            merge_func = map_lanes
+        if self.profile_dir is not None and (
+            self.pool is not None or not self.executor.shares_processes()
+        ):
+            extra_kwargs["pass_func"] = merge_func
+            extra_kwargs["profile_dir"] = self.profile_dir
+            merge_func = run_profiled
         if not self.std_kwargs["quiet"]:
             ProgressBar(dt=SPINNER_UPDATE_PERIOD).register()
-        if self.std_kwargs["parallel"]:
-            stats_list = (
-                self.std_kwargs["bag"]
-                .map(merge_func, **kwargs, **extra_kwargs)
-                .compute()
+        watch = Stopwatch()
+        if code == UNAMBIGUOUS_CODE:
+            task_files = [HOMOLOGY_FILE]
+        else:
+            task_files = [kwargs["synteny_file"] for _, kwargs in task_lanes]
+        prune = self.prune and code in self.merger_kw_dict and not count_hashes
+        if prune:
+            # hashes go to per-worker filters, to be mailed once merged
+            n_hashes = self.std_kwargs["n_proteins"]
+            if code == DISAMBIGUATED_CODE:
+                n_hashes *= 2  # upstream and downstream
+            fold_init = functools.partial(
+                new_sketches, n_hashes, len(self.lanes)
             )
         else:
-            stats_list = []
-            for args in self.std_kwargs["merge_args"]:
-                stats_list.append(merge_func(args, **kwargs, **extra_kwargs))
+            fold_init = None
+        with watch.timing("map"):
+            stats_list = self._map_pass(
+                merge_func,
+                extra_kwargs,
+                task_mb=self._task_mb(task_files),
+                stage=f"{CODE_DICT[code]} pass",
+                fold_init=fold_init,
+            )
+        if prune:
+            stats_list, sketches = stats_list
+            with watch.timing("prune"):
+                self._mail_pruned(code, task_lanes, sketches, stats_list)
+        self._check_scratch()
+        proteome_profile = split_profile(stats_list, code)
         stats = (
             pd.DataFrame.from_dict(stats_list).set_index("idx").sort_index()
         )
         proteomes = log_and_add_to_stats(proteomes, stats)
         if code in self.merger_kw_dict:
-            merger = ExternalMerge(
-                file_path_func=mailboxes.path_to_mailbox,
-                n_merge=self.std_kwargs["n_proteomes"],
-            )
-            merger.init("hash")
-            merge_counter = AmbiguousMerger(
-                start_base=sum(self.n_assigned_list),
-                **self.merger_kw_dict[code],
-            )
-            self.unambig, self.ambig = merger.merge(merge_counter)
-            mailboxes.delete()
-        self.n_assigned_list.append(len(self.unambig))
+            with watch.timing("merge"):
+                self._merge(code, task_lanes, count_hashes)
+        self.profiles.append(
+            _pass_profile(code, watch.times, proteome_profile)
+        )
+        self.profiles.append(proteome_profile)
+        self._check_scratch()
+        for lane in self.lanes:
+            lane.n_assigned_list.append(len(lane.unambig))
         self.last_code = code
         self.pass_name = CODE_DICT[code]
         return proteomes
 
+    def _check_scratch(self):
+        """Update usage stats of scratch directories."""
+        for allocator in self.std_kwargs["scratch_dirs"].values():
+            allocator.check()
+
+    def _task_mb(self, file_names):
+        """Estimate per-proteome task memory from files, if budgeted."""
+        if self.executor.max_memory is None:
+            return None
+        return [
+            sum(
+                parquet_memory_mb(dotpath_to_path(dotpath) / name)
+                for name in file_names
+            )
+            for unused_idx, dotpath in self.std_kwargs["merge_args"]
+        ]
+
+    def _map_pass(
+        self,
+        merge_func,
+        extra_kwargs,
+        task_mb=None,
+        stage=None,
+        fold_init=None,
+    ):
+        """Call a pass function on every proteome, returning stats.
+
+        If fold_init is given, the pass is folded over proteomes with
+        sketch_pass() from the stats and filters it returns, and the
+        combined stats and filters are returned.
+        """
+        if self.pool is None:
+            extra_kwargs["store"] = self.store
+            if self.executor.parallel and self.write_behind:
+                # each worker waits for its writes before returning
+                extra_kwargs["task_func"] = merge_func
+                merge_func = run_and_flush
+        if fold_init is not None:
+            extra_kwargs["sketched_func"] = merge_func
+            if self.pool is not None:
+                return self.pool.fold(
+                    sketch_pass, fold_init, combine_sketches, **extra_kwargs
+                )
+            results = self.executor.fold(
+                sketch_pass,
+                self.std_kwargs["merge_args"],
+                fold_init,
+                combine_sketches,
+                task_mb=task_mb,
+                stage=stage,
+                **extra_kwargs,
+            )
+        elif self.pool is not None:
+            return self.pool.map(merge_func, **extra_kwargs)
+        else:
+            results = self.executor.map(
+                merge_func,
+                self.std_kwargs["merge_args"],
+                task_mb=task_mb,
+                stage=stage,
+                **extra_kwargs,
+            )
+        self.store.flush()
+        return results
+
+    def _mail_pruned(self, code, task_lanes, sketches, stats_list):
+        """Mail hashes that may be shared, adding counts to pass stats."""
+        mail_lanes = []
+        for lane, (stats_prefix, kwargs), sketch in zip(
+            self.lanes, task_lanes, sketches
+        ):
+            shared = sketch.publish(
+                lane.mailbox_path(
+                    self.std_kwargs["scratch_dirs"]["merge"].path,
+                    f"sketch.{CODE_DICT[code]}",
+                )
+            )
+            mail_lanes.append(
+                (
+                    stats_prefix,
+                    {
+                        "hasher": kwargs["hasher"],
+                        "mailboxes": kwargs["mailboxes"],
+                        "synteny_file": kwargs["synteny_file"],
+                        "sketch": shared,
+                    },
+                )
+            )
+        del sketches
+        mail_stats = {
+            stats["idx"]: stats
+            for stats in self._map_pass(
+                mail_pruned_hashes,
+                {"lanes": mail_lanes, "mail_code": code},
+                stage=f"{CODE_DICT[code]} mail",
+            )
+        }
+        for stats in stats_list:
+            add_stats(stats, mail_stats[stats["idx"]])
+        for lane, (stats_prefix, kwargs) in zip(self.lanes, mail_lanes):
+            kwargs["sketch"].delete()
+            keys = _namespace_stats(
+                {f"syn.merge_input.{code}": 0, f"syn.merge_pruned.{code}": 0},
+                stats_prefix,
+            )
+            n_input, n_pruned = [
+                sum(stats[key] for stats in stats_list) for key in keys
+            ]
+            n_hashes = n_input + n_pruned
+            pct_pruned = n_pruned * 100.0 / max(n_hashes, 1)
+            logger.info(
+                f"Pruned {n_pruned} of {n_hashes} {lane.log_name()}"
+                + f"{CODE_DICT[code]} hashes ({pct_pruned:.1f}%)"
+                + " before merging"
+            )
+
+    def _merge(self, code, task_lanes, count_hashes):
+        """Merge hashes of all proteomes into each lane's tables."""
+        merge_args = []
+        for lane, (unused_prefix, kwargs) in zip(self.lanes, task_lanes):
+            lane.delete_tables()
+            if count_hashes:
+                source = self._hash_indexes(
+                    kwargs["index_name"], lane.file_name(HASH_INDEX_DIR)
+                )
+            else:
+                source = kwargs["mailboxes"]
+            merge_args.append(
+                (
+                    source,
+                    lane.get_total_assigned(),
+                    lane.mailbox_path(
+                        self.std_kwargs["scratch_dirs"]["merge"].path,
+                        TABLE_PREFIX,
+                    ),
+                    lane.hasher,
+                )
+            )
+        merge_kwargs = {
+            "n_proteomes": self.std_kwargs["n_proteomes"],
+            "merger_kwargs": self.merger_kw_dict[code],
+        }
+        if count_hashes:
+            tables = self._map_merges(
+                merge_lane_counts, merge_args, merge_kwargs
+            )
+        else:
+            tables = self._merge_shards(merge_args, merge_kwargs)
+        for lane, (unambig, ambig) in zip(self.lanes, tables):
+            lane.unambig = unambig
+            lane.ambig = ambig
+
+    def _map_merges(self, func, args_list, merge_kwargs):
+        """Map a merge function over args, in parallel if possible."""
+        if self.executor.parallel and len(args_list) > 1:
+            if (
+                self.profile_dir is not None
+                and not self.executor.shares_processes()
+            ):
+                merge_kwargs = {
+                    "pass_func": func,
+                    "profile_dir": self.profile_dir,
+                    **merge_kwargs,
+                }
+                func = run_profiled
+            return self.executor.map(func, args_list, **merge_kwargs)
+        with profiling(self.profile_dir):
+            return [func(args, **merge_kwargs) for args in args_list]
+
+    def _merge_shards(self, merge_args, merge_kwargs):
+        """Merge hash-range shards of all lanes, then publish per lane.
+
+        Shards are merged in parallel and their merges are concatenated
+        in hash order, so ordinals are the same as for a single merge.
+        """
+        shard_args = [
+            (mailboxes, shard, start_base, hasher)
+            for mailboxes, start_base, unused_prefix, hasher in merge_args
+            for shard in range(mailboxes.n_shards)
+        ]
+        shard_mergers = iter(
+            self._map_merges(merge_hash_shard, shard_args, merge_kwargs)
+        )
+        tables = []
+        with profiling(self.profile_dir):
+            for mailboxes, unused_base, table_prefix, hasher in merge_args:
+                merger = next(shard_mergers)
+                for unused_shard in range(1, mailboxes.n_shards):
+                    merger.extend(next(shard_mergers))
+                unambig, ambig = merger.results()
+                mailboxes.delete()
+                tables.append(
+                    _publish_tables(unambig, ambig, table_prefix, hasher)
+                )
+        return tables
+
+    def _hash_indexes(self, index_name, counts_name):
+        """Return set-wide hash counts and per-proteome hash indexes."""
+        counts = HashCounts(self.std_kwargs["set_path"] / counts_name)
+        indexes = {
+            dotpath: ProteomeHashIndex(dotpath_to_path(dotpath) / index_name)
+            for unused_idx, dotpath in self.std_kwargs["merge_args"]
+        }
+        return counts, indexes
+
     def add_ambig_to_total_assigned(self):
         """Include the most recent ambiguous assignment in the total."""
-        self.n_assigned_list.append(len(self.ambig))
+        for lane in self.lanes:
+            lane.n_assigned_list.append(len(lane.ambig))
         self.log_ambig = True
 
-    def get_total_assigned(self):
-        """Return the total assigned anchors."""
-        return sum(self.n_assigned_list)
+    def close(self):
+        """Remove hash tables, write changed frames and stop workers."""
+        for lane in self.lanes:
+            lane.delete_tables()
+        if self.pool is not None or isinstance(self.store, ChangedOnlyStore):
+            self.std_kwargs["click_loguru"].elapsed_time("Writing proteomes")
+            flush_start = time.perf_counter()
+            if self.pool is None:
+                n_written = self.executor.map(
+                    commit_frames,
+                    self.std_kwargs["merge_args"],
+                    store=self.store,
+                    file_names=[
+                        lane.file_name(SYNTENY_FILE) for lane in self.lanes
+                    ],
+                )
+            else:
+                n_written = self.pool.flush()
+            if self.incremental:
+                logger.info(
+                    f"Wrote {sum(n_written)} changed proteome files of"
+                    + f" {self.std_kwargs['n_proteomes'] * len(self.lanes)}"
+                )
+            self.profiles.append(
+                pd.DataFrame(
+                    [
+                        {
+                            "level": "pass",
+                            "pass": "flush",
+                            "write_s": time.perf_counter() - flush_start,
+                        }
+                    ]
+                )
+            )
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+
+    def write_profile(self, profile_path):
+        """Write per-pass and per-proteome timings and counts."""
+        write_tsv_or_parquet(
+            pd.concat(self.profiles, axis=0, ignore_index=True),
+            profile_path,
+            sort_cols=False,
+            enforce_types=False,
+        )
+        logger.debug(f"Profile written to {profile_path}")
+
+
+def _pass_profile(code, times, proteome_profile):
+    """Return a frame of driver timings and merge throughput for a pass."""
+    row = {"level": "pass", "pass": code}
+    for name, val in times.items():
+        row[f"{name}_s"] = val
+    if "mailbox_rows" in proteome_profile and "merge_s" in row:
+        row["merge_rows"] = proteome_profile["mailbox_rows"].sum()
+        row["merge_rows_per_s"] = row["merge_rows"] / max(
+            row["merge_s"], 1e-9
+        )
+    return pd.DataFrame([row])
+
+
+def merge_hash_shard(args, n_proteomes=None, merger_kwargs=None):
+    """Merge one hash-range shard of a lane's mailboxes."""
+    mailboxes, shard, start_base, hasher = args
+    merger = ExternalMerge(
+        file_path_func=functools.partial(
+            mailboxes.path_to_mailbox, shard=shard
+        ),
+        n_merge=n_proteomes,
+        value_dtype=hasher.key_dtype(),
+    )
+    merger.init("hash")
+    merge_counter = AmbiguousMerger(
+        start_base=start_base,
+        hash_bits=hasher.hash_bits,
+        **merger_kwargs,
+    )
+    return merger.merge(merge_counter, results=False)
+
+
+def merge_lane_counts(args, n_proteomes=None, merger_kwargs=None):
+    """Update one lane's persisted hash counts and publish the tables."""
+    (counts, indexes), start_base, table_prefix, hasher = args
+    added = counts.update(indexes)
+    logger.debug(
+        f"Counted hashes of {len(added)} of {n_proteomes} proteomes"
+        + f" into {counts.counts_dir}"
+    )
+    merge_counter = AmbiguousMerger(
+        start_base=start_base,
+        hash_bits=hasher.hash_bits,
+        **merger_kwargs,
+    )
+    merge_counter.add_merges(*counts.shared())
+    unambig, ambig = merge_counter.results()
+    return _publish_tables(unambig, ambig, table_prefix, hasher)
+
+
+def _publish_tables(unambig, ambig, table_prefix, hasher):
+    """Publish merged hashes as shared tables."""
+    return (
+        SharedHashTable.publish(
+            unambig,
+            table_prefix.parent / (table_prefix.name + "unambig"),
+            key_dtype=hasher.key_dtype(),
+        ),
+        SharedHashTable.publish(
+            ambig,
+            table_prefix.parent / (table_prefix.name + "ambig"),
+            key_dtype=hasher.key_dtype(),
+        ),
+    )
+
+
+def _namespace_stats(stats, prefix):
+    """Insert a lane prefix into the names of synteny stats."""
+    if not prefix:
+        return stats
+    return {
+        (f"syn.{prefix}.{key[4:]}" if key.startswith("syn.") else key): val
+        for key, val in stats.items()
+    }
+
+
+def map_lanes(args, merge_func=None, lanes=None, store=DISK_STORE, **kwargs):
+    """Run a per-proteome pass function for each lane, combining stats."""
+    stats = {}
+    for stats_prefix, lane_kwargs in lanes:
+        add_stats(
+            stats,
+            _namespace_stats(
+                merge_func(args, store=store, **lane_kwargs, **kwargs),
+                stats_prefix,
+            ),
+        )
+    return stats
+
+
+def sketch_pass(acc, args, sketched_func=None, lanes=None, **kwargs):
+    """Run a pass on a proteome, adding the hashes it mails to filters."""
+    stats_list, sketches = acc
+    sketch_lanes = [
+        (stats_prefix, {**lane_kwargs, "mailboxes": sketch})
+        for (stats_prefix, lane_kwargs), sketch in zip(lanes, sketches)
+    ]
+    stats_list.append(sketched_func(args, lanes=sketch_lanes, **kwargs))
+    return acc
+
+
+def new_sketches(n_hashes, n_lanes):
+    """Return empty pass stats and a filter per lane."""
+    return (
+        [],
+        [SeenTwiceFilter.for_size(n_hashes) for unused_lane in range(n_lanes)],
+    )
+
+
+def combine_sketches(acc, other):
+    """Concatenate pass stats and merge filters lane by lane."""
+    return (
+        acc[0] + other[0],
+        [sketch.merge(o_sketch) for sketch, o_sketch in zip(acc[1], other[1])],
+    )
+
+
+def mail_pruned_hashes(args, lanes=None, store=DISK_STORE, mail_code=None):
+    """Mail a proteome's hashes that may be shared with other proteomes."""
+    watch = Stopwatch()
+    idx, dotpath = args
+    outpath = dotpath_to_path(dotpath)
+    stats = {"idx": idx, "path": dotpath}
+    for stats_prefix, lane_kwargs in lanes:
+        hasher = lane_kwargs["hasher"]
+        with watch.timing("read"):
+            syn = store.read(
+                outpath / lane_kwargs["synteny_file"],
+                columns=_mail_columns(mail_code, hasher),
+            )
+        hashes = _mail_frame(mail_code, syn, hasher)
+        del syn
+        keep = lane_kwargs["sketch"].maybe_shared(hashes.index.to_numpy())
+        _write_mailbox(watch, lane_kwargs["mailboxes"], idx, hashes[keep])
+        n_kept = int(keep.sum())
+        stats.update(
+            _namespace_stats(
+                {
+                    f"syn.merge_input.{mail_code}": n_kept,
+                    f"syn.merge_pruned.{mail_code}": len(keep) - n_kept,
+                },
+                stats_prefix,
+            )
+        )
+    stats.update(watch.stats())
+    return stats
+
+
+def commit_frames(args, store=None, file_names=None):
+    """Replace a proteome's changed files, returning the number replaced."""
+    unused_idx, dotpath = args
+    outpath = dotpath_to_path(dotpath)
+    return sum(store.commit(outpath / name) for name in file_names)
 
 
 def calculate_synteny_hashes(
-    args, mailboxes=None, hasher=None, unambig=None, ambig=None
+    args,
+    lanes=None,
+    store=DISK_STORE,
+    incremental=False,
+    cluster_order=None,
 ):
-    """Calculate synteny hashes for proteins per-genome."""
+    """Calculate synteny hashes for proteins per-genome.
+
+    Homology is read and segmented once, then hashed for every lane.
+    Segments are slices of the set's cluster order when it is current,
+    otherwise fragments are grouped.
+    If incremental is True, hashes are taken from the proteome's hash
+    index when its key is current, and the index is saved otherwise.
+    """
+    watch = Stopwatch()
     idx, dotpath = args
     outpath = dotpath_to_path(dotpath)
-    hom = read_tsv_or_parquet(outpath / HOMOLOGY_FILE)
-    hom["tmp.nan_group"] = (
+    with watch.timing("read"):
+        # sequences are not carried into synteny files
+        hom = read_tsv_or_parquet(
+            outpath / HOMOLOGY_FILE,
+            columns=parquet_columns(
+                outpath / HOMOLOGY_FILE, exclude=SEQUENCE_COLS
+            ),
+        )
+    watch.count("rows", len(hom))
+    segments = _order_segments(cluster_order, dotpath, hom)
+    if segments is None:
+        segments = _grouped_segments(hom)
+    stats = {
+        "idx": idx,
+        "path": dotpath,
+        "hom.clusters": hom["hom.cluster"].notna().sum(),
+    }
+    for stats_prefix, lane_kwargs in lanes:
+        hasher = lane_kwargs["hasher"]
+        hash_name = hasher.hash_name()
+        if hasher.thorny:  # drop rows
+            syn = hom[hom["hom.cluster"].notna()]
+        else:
+            syn = hom
+        hash_fr = None
+        if incremental:
+            index = ProteomeHashIndex(outpath / lane_kwargs["index_name"])
+            key = index_key(hasher, hom)
+            if index.matches(key):
+                with watch.timing("read"):
+                    hash_fr = index.hash_frame()
+        if hash_fr is None:
+            syn_list = [hasher.calculate(segment) for segment in segments]
+            hash_fr = pd.concat(
+                [df for df in syn_list if df is not None], axis=0
+            )
+            del syn_list
+            if incremental:
+                unique_hashes = _unique_hashes(hash_fr, hash_name)
+                with watch.timing("write"):
+                    index.save(
+                        key,
+                        hash_fr,
+                        unique_hashes,
+                        key_dtype=hasher.key_dtype(),
+                    )
+        syn = syn.join(hash_fr)
+        del hash_fr
+        with watch.timing("write"):
+            store.write(
+                syn,
+                outpath / lane_kwargs["synteny_file"],
+                remove_tmp=False,
+                row_group_size=PROTEIN_ROW_GROUP_SIZE,
+            )
+        if lane_kwargs["mailboxes"] is not None:
+            unique_hashes = _unique_hashes(syn, hash_name)
+            _write_mailbox(watch, lane_kwargs["mailboxes"], idx, unique_hashes)
+        stats.update(
+            _namespace_stats(
+                {"syn.hashes.n": syn[hash_name].notna().sum()}, stats_prefix
+            )
+        )
+    stats.update(watch.stats())
+    return stats
+
+
+def _write_mailbox(watch, mailboxes, box_no, frame):
+    """Write a frame to a mailbox, counting rows, bytes and lock waits.
+
+    If mailboxes is a filter, the hashes are only added to it and the
+    frame is mailed later by mail_pruned_hashes().
+    """
+    if isinstance(mailboxes, SeenTwiceFilter):
+        mailboxes.add(frame.index.to_numpy())
+        return
+    lock_wait = mailboxes.lock_wait
+    with watch.timing("write"):
+        watch.count("mailbox_bytes", mailboxes.write_frame(box_no, frame))
+    watch.count("mailbox_rows", len(frame))
+    watch.count("lock_wait_s", mailboxes.lock_wait - lock_wait)
+
+
+def _order_segments(cluster_order, dotpath, hom):
+    """Return segments as slices of the cluster order, or None if stale."""
+    if cluster_order is None:
+        return None
+    if cluster_order.clusters is None:
+        cluster_order.load()
+    proteome_no = cluster_order.proteome_number(dotpath)
+    if proteome_no is None or not cluster_order.matches(
+        proteome_no, hom["hom.cluster"]
+    ):
+        logger.debug(f"Cluster order is stale for {dotpath}")
+        return None
+    vec = cluster_order.proteome_clusters(proteome_no)
+    return [
+        pd.Series(vec[start:end], index=hom.index[start:end])
+        for start, end in zip(*cluster_order.segments(proteome_no))
+    ]
+
+
+def _grouped_segments(hom):
+    """Return segments by grouping on fragment and null clusters."""
+    nan_group = (
         (hom["hom.cluster"].isnull()).astype(int).cumsum() + 1
     ) * (~hom["hom.cluster"].isnull())
-    hom.replace(to_replace={"tmp.nan_group": 0}, value=pd.NA, inplace=True)
-    hash_name = hasher.hash_name()
-    syn_list = []
-    if hasher.thorny:  # drop rows
-        hom = hom[hom["hom.cluster"].notna()]
-    for unused_id_tuple, subframe in hom.groupby(
-        by=["frag.id", "tmp.nan_group"]
-    ):
-        syn_list.append(hasher.calculate(subframe["hom.cluster"]))
-    del hom["tmp.nan_group"]
-    syn = hom.join(
-        pd.concat([df for df in syn_list if df is not None], axis=0)
-    )
-    del syn_list
-    write_tsv_or_parquet(syn, outpath / SYNTENY_FILE, remove_tmp=False)
+    nan_group = nan_group.astype("Int64").mask(nan_group == 0)
+    # segments don't include null clusters, whether thorny or not
+    return [
+        subframe["hom.cluster"]
+        for unused_id_tuple, subframe in hom[hom["hom.cluster"].notna()]
+        .assign(**{"tmp.nan_group": nan_group})
+        .groupby(by=["frag.id", "tmp.nan_group"])
+    ]
+
+
+def _unique_hashes(syn, hash_name):
+    """Return a frame of self-counts indexed by sorted unique hashes."""
+    syn = syn[[hash_name]].copy()
     syn["tmp.self_count"] = pd.array(
         syn[hash_name].map(syn[hash_name].value_counts()),
         dtype=pd.UInt32Dtype(),
     )
-    unique_hashes = (
-        syn[[hash_name, "tmp.self_count"]]
-        .drop_duplicates(subset=[hash_name])
-        .dropna(how="any")
+    unique_hashes = syn.drop_duplicates(subset=[hash_name]).dropna(
+        how="any"
     )
-    unique_hashes = unique_hashes.set_index(hash_name).sort_index()
-    with mailboxes.locked_open_for_write(idx) as file_handle:
-        unique_hashes.to_csv(file_handle, header=False, sep="\t")
-    return {
-        "idx": idx,
-        "path": dotpath,
-        "hom.clusters": syn["hom.cluster"].notna().sum(),
-        "syn.hashes.n": syn[hash_name].notna().sum(),
-    }
+    return unique_hashes.set_index(hash_name).sort_index()
+
+
+def _disambig_hashes(syn):
+    """Return self-counts and alternates of up- and downstream hashes."""
+    merged_hashes = pd.concat(
+        [
+            _rename_and_fill_alt(syn, "tmp.disambig.up", "tmp.disambig.down"),
+            _rename_and_fill_alt(syn, "tmp.disambig.down", "tmp.disambig.up"),
+        ],
+        ignore_index=True,
+    )
+    merged_hashes["self_count"] = pd.array(
+        merged_hashes["hash"].map(merged_hashes["hash"].value_counts()),
+        dtype=pd.UInt32Dtype(),
+    )
+    merged_hashes = merged_hashes.reindex(
+        columns=["hash", "self_count", "alt_hash"]
+    )
+    return (
+        merged_hashes.drop_duplicates(subset=["hash"])
+        .set_index("hash")
+        .sort_index()
+    )
+
+
+def _mail_columns(code, hasher):
+    """Return the synteny columns a pass's mailed hashes are made from."""
+    if code == DISAMBIGUATED_CODE:
+        return ["tmp.disambig.up", "tmp.disambig.down"]
+    return [hasher.hash_name()]
+
+
+def _mail_frame(code, syn, hasher):
+    """Return the frame of hashes a pass mails for merging."""
+    if code == DISAMBIGUATED_CODE:
+        return _disambig_hashes(syn)
+    return _unique_hashes(syn, hasher.hash_name())
 
 
 def merge_unambig_hashes(
@@ -440,14 +1597,19 @@ def merge_unambig_hashes(
     ambig=None,
     hasher=None,
     mailboxes=None,
+    synteny_file=SYNTENY_FILE,
+    store=DISK_STORE,
 ):
     """Merge unambiguous synteny hashes into proteomes per-proteome."""
     hash_name = hasher.hash_name()
+    watch = Stopwatch()
     idx, dotpath = args
     outpath = dotpath_to_path(dotpath)
-    syn = read_tsv_or_parquet(outpath / SYNTENY_FILE)
-    syn = _join_on_col_with_na(syn, unambig, hash_name)
-    syn = _join_on_col_with_na(syn, ambig, hash_name)
+    with watch.timing("read"):
+        syn = store.read(outpath / synteny_file)
+    watch.count("rows", len(syn))
+    syn = unambig.join(syn, hash_name)
+    syn = ambig.join(syn, hash_name)
     syn["syn.code"] = pd.NA
     syn["syn.code"] = _fill_col1_val_where_col2_notna(
         syn["syn.code"], syn["syn.anchor.id"], UNAMBIGUOUS_CODE
@@ -461,36 +1623,22 @@ def merge_unambig_hashes(
     )
     disambig_fr = disambig_fr.dropna(how="all")
     syn = syn.join(disambig_fr)
-    write_tsv_or_parquet(syn, outpath / SYNTENY_FILE, remove_tmp=False)
+    with watch.timing("write"):
+        store.write(
+            syn,
+            outpath / synteny_file,
+            remove_tmp=False,
+            row_group_size=PROTEIN_ROW_GROUP_SIZE,
+        )
     # Write out unified upstream/downstream hash values
-    merged_hashes = pd.concat(
-        [
-            _rename_and_fill_alt(syn, "tmp.disambig.up", "tmp.disambig.down"),
-            _rename_and_fill_alt(syn, "tmp.disambig.down", "tmp.disambig.up"),
-        ],
-        ignore_index=True,
-    )
-    merged_hashes["self_count"] = pd.array(
-        merged_hashes["hash"].map(merged_hashes["hash"].value_counts()),
-        dtype=pd.UInt32Dtype(),
-    )
-    merged_hashes = merged_hashes.reindex(
-        columns=["hash", "self_count", "alt_hash"]
-    )
-    unique_hashes = (
-        merged_hashes.drop_duplicates(subset=["hash"])
-        .set_index("hash")
-        .sort_index()
-    )
-    del merged_hashes
-    with mailboxes.locked_open_for_write(idx) as file_handle:
-        unique_hashes.to_csv(file_handle, header=False, sep="\t")
+    _write_mailbox(watch, mailboxes, idx, _disambig_hashes(syn))
     return {
         "idx": idx,
         "path": dotpath,
         "syn.anchors.unambiguous": _count_code(
             syn["syn.code"], UNAMBIGUOUS_CODE
         ),
+        **watch.stats(),
     }
 
 
@@ -500,15 +1648,20 @@ def merge_disambig_hashes(
     ambig=None,
     hasher=None,
     mailboxes=None,
+    synteny_file=SYNTENY_FILE,
+    store=DISK_STORE,
 ):
     """Merge disambiguated synteny hashes into proteomes per-proteome."""
+    watch = Stopwatch()
     idx, dotpath = args
     plain_hash_name = hasher.hash_name(no_prefix=True)
     hash_name = "syn." + plain_hash_name
     outpath = dotpath_to_path(dotpath)
-    syn = read_tsv_or_parquet(outpath / SYNTENY_FILE)
-    syn = _join_on_col_with_na(syn, unambig, "tmp.disambig.up")
-    syn = _join_on_col_with_na(syn, unambig, "tmp.disambig.down")
+    with watch.timing("read"):
+        syn = store.read(outpath / synteny_file)
+    watch.count("rows", len(syn))
+    syn = unambig.join(syn, "tmp.disambig.up")
+    syn = unambig.join(syn, "tmp.disambig.down")
     for dup_col in [
         "tmp.disambig.anchor.count",
         "tmp.disambig.anchor.id",
@@ -536,20 +1689,16 @@ def merge_disambig_hashes(
     syn = syn.drop(columns=non_needed_cols)
     # null hashes are already assigned
     syn[hash_name][syn["syn.anchor.id"].notna()] = pd.NA
-    write_tsv_or_parquet(syn, outpath / SYNTENY_FILE, remove_tmp=False)
+    with watch.timing("write"):
+        store.write(
+            syn,
+            outpath / synteny_file,
+            remove_tmp=False,
+            row_group_size=PROTEIN_ROW_GROUP_SIZE,
+        )
     # Write out non-ambiguous hashes
-    syn["tmp.self_count"] = pd.array(
-        syn[hash_name].map(syn[hash_name].value_counts()),
-        dtype=pd.UInt32Dtype(),
-    )
-    unique_hashes = (
-        syn[[hash_name, "tmp.self_count"]]
-        .drop_duplicates(subset=[hash_name])
-        .dropna(how="any")
-    )
-    unique_hashes = unique_hashes.set_index(hash_name).sort_index()
-    with mailboxes.locked_open_for_write(idx) as file_handle:
-        unique_hashes.to_csv(file_handle, header=False, sep="\t")
+    unique_hashes = _unique_hashes(syn, hash_name)
+    _write_mailbox(watch, mailboxes, idx, unique_hashes)
     # logger.debug(f"{dotpath} has {syn['syn.anchor.id'].notna().sum()} assignments")
     return {
         "idx": idx,
@@ -557,6 +1706,7 @@ def merge_disambig_hashes(
         "syn.anchors.disambiguated": _count_code(
             syn["syn.code"], DISAMBIGUATED_CODE
         ),
+        **watch.stats(),
     }
 
 
@@ -567,17 +1717,22 @@ def merge_nonambig_hashes(
     ambig=None,
     hasher=None,
     n_proteomes=None,
-    cluster_mb=None,
-    anchor_mb=None,
+    cluster_ds=None,
+    anchor_ds=None,
     write_ambiguous=True,
+    synteny_file=SYNTENY_FILE,
+    store=DISK_STORE,
 ):
     """Merge disambiguated synteny hashes into proteomes per-proteome."""
+    watch = Stopwatch()
     idx, dotpath = args
     plain_hash_name = hasher.hash_name(no_prefix=True)
     hash_name = "syn." + plain_hash_name
     outpath = dotpath_to_path(dotpath)
-    syn = read_tsv_or_parquet(outpath / SYNTENY_FILE)
-    syn = _join_on_col_with_na(syn, unambig, hash_name)
+    with watch.timing("read"):
+        syn = store.read(outpath / synteny_file)
+    watch.count("rows", len(syn))
+    syn = unambig.join(syn, hash_name)
     #
     # Do the indirects (formerly ambig made nonambig)
     #
@@ -593,7 +1748,7 @@ def merge_nonambig_hashes(
     #
     # Do the nonambig (w.r.t. this proteome) and ambig, if requested
     #
-    syn = _join_on_col_with_na(syn, ambig, hash_name)
+    syn = ambig.join(syn, hash_name)
     n_proteins = len(syn)
     syn["tmp.i"] = range(n_proteins)
     ambig_code = syn["syn.code"].copy()
@@ -628,45 +1783,41 @@ def merge_nonambig_hashes(
     #
     # Do shingling
     #
-    # shingle_id = np.array([np.nan] * n_proteins)
-    # shingle_count = np.array([np.nan] * n_proteins)
-    # shingle_code = syn["syn.code"].to_numpy()
-    # shingle_direction = syn["syn.anchor.direction"].to_numpy()
-    # shingle_sub = np.array([np.nan] * n_proteins)
-    with join_mb.locked_open_for_write(idx) as file_handle:
-        for anchor_count, subframe in syn.groupby(by=["syn.anchor.count"]):
-            for unused_i, row in subframe.iterrows():
-                anchor_id = row["syn.anchor.id"]
-                if pd.isnull(anchor_id):
-                    continue
-                first_row = row["tmp.i"]
-                last_row = first_row + row["syn.anchor.footprint"]
-                # shingle_id[first_row:last_row] = anchor_id
-                # shingle_count[first_row:last_row] = anchor_count
-                # shingle_code[first_row:last_row] = row["syn.code"]
-                # shingle_direction[first_row:last_row] = row[
-                #    "syn.anchor.direction"
-                # ]
-                # shingle_sub[first_row:last_row] = hasher.shingle(
-                #    syn["hom.cluster"][first_row:last_row],
-                #    row["syn.anchor.direction"],
-                #    row[hash_name],
-                # )
-                shingle_fr = pd.DataFrame(
-                    {
-                        "member_ids": syn.iloc[first_row:last_row].index,
-                        "syn.anchor.sub_id": hasher.shingle(
-                            syn["hom.cluster"][first_row:last_row],
-                            row["syn.anchor.direction"],
-                            row[hash_name],
-                        ),
-                    }
-                )
-                shingle_fr["syn.anchor.id"] = anchor_id
-                shingle_fr["syn.anchor.count"] = anchor_count
-                shingle_fr["syn.code"] = row["syn.code"]
-                shingle_fr["frag.idx"] = row["frag.idx"]
-                shingle_fr.to_csv(file_handle, header=False, sep="\t")
+    anchors = syn[
+        syn["syn.anchor.id"].notna() & syn["syn.anchor.count"].notna()
+    ]
+    # same order as grouping by anchor count
+    anchors = anchors.iloc[
+        np.argsort(
+            anchors["syn.anchor.count"].to_numpy(dtype=np.int64),
+            kind="stable",
+        )
+    ]
+    rows, offsets, sub_ids, anchor_no = hasher.shingle_all(
+        syn["hom.cluster"].to_numpy(dtype=np.int64, na_value=-1),
+        anchors["tmp.i"].to_numpy(dtype=np.int64),
+        anchors["syn.anchor.footprint"].to_numpy(dtype=np.int64),
+        anchors["syn.anchor.direction"].to_numpy(),
+        anchors[hash_name].to_numpy(),
+    )
+    shingle_fr = pd.DataFrame(
+        {
+            "member_ids": syn.index[rows],
+            "syn.anchor.sub_id": sub_ids,
+        },
+        index=offsets,
+    )
+    for col in JOIN_COLS[2:]:
+        shingle_fr[col] = anchors[col].to_numpy()[anchor_no]
+    join_buf = io.StringIO()
+    shingle_fr.to_csv(join_buf, header=False, sep="\t")
+    del shingle_fr
+    lock_wait = join_mb.lock_wait
+    with watch.timing("write"):
+        watch.count(
+            "mailbox_bytes", join_mb.write_text(idx, join_buf.getvalue())
+        )
+    watch.count("lock_wait_s", join_mb.lock_wait - lock_wait)
     # syn["syn.anchor.id"] = shingle_id
     # syn["syn.anchor.count"] = shingle_count
     # syn["syn.code"] = shingle_code
@@ -681,17 +1832,27 @@ def merge_nonambig_hashes(
     #    syn,
     #    outpath / SYNTENY_FILE,
     # )
-    # Write anchor info to mailbox
-    # for anchor_id, subframe in syn.groupby(by=["syn.anchor.id"]):
-    #    anchor_frame = subframe.copy()
-    #    anchor_frame["path"] = dotpath
-    #    with anchor_mb.locked_open_for_write(anchor_id) as file_handle:
-    #        anchor_frame[ANCHOR_COLS].to_csv(
-    #            file_handle, header=False, sep="\t"
-    #        )
-    # for cluster_id, subframe in syn.groupby(by=["hom.cluster"]):
-    #    with cluster_mb.locked_open_for_write(cluster_id) as file_handle:
-    #        subframe[CLUSTER_COLS].to_csv(file_handle, header=False, sep="\t")
+    # Write anchor and cluster info to bucketed datasets
+    anchor_fr = syn.iloc[rows][ANCHOR_COLS].copy()
+    anchor_fr["path"] = dotpath
+    anchor_fr["syn.anchor.sub_id"] = pd.array(sub_ids, dtype=pd.UInt32Dtype())
+    for col in [
+        "syn.anchor.id",
+        "syn.anchor.count",
+        "syn.anchor.direction",
+        "syn.code",
+    ]:
+        anchor_fr[col] = anchors[col].iloc[anchor_no].array
+    with watch.timing("write"):
+        anchor_ds.write(anchor_fr, idx)
+        # where shingles overlap, proteins are in the last anchor
+        cluster_ds.write(
+            anchor_fr[~anchor_fr.index.duplicated(keep="last")][
+                CLUSTER_COLS
+            ],
+            idx,
+        )
+    del anchor_fr
     in_synteny = syn["syn.anchor.id"].notna().sum()
     n_assigned = syn["hom.cluster"].notna().sum()
     avg_ortho = syn["syn.anchor.count"].mean()
@@ -715,60 +1876,76 @@ def merge_nonambig_hashes(
         "syn.anchors.total": in_synteny,
         "syn.anchors.total_pct": synteny_pct,
         "syn.orthogenomic_pct": avg_ortho * 100.0 / n_proteomes,
+        **watch.stats(),
     }
     return synteny_stats
 
 
-def join_synteny_to_clusters(args, cluster_parent=None, mailbox_reader=None):
-    """Read homology info from mailbox and join it to proteome file."""
-    idx = args[0]
-    cluster_path = cluster_parent / f"{idx}.parq"
-    cluster = pd.read_parquet(cluster_path)
-    n_cluster = len(cluster)
-    with mailbox_reader(idx) as file_handle:
-        synteny_frame = pd.read_csv(
-            file_handle, sep="\t", index_col=0
-        ).convert_dtypes()
-        in_synteny = len(synteny_frame)
-    # cluster files are unusual in that I don't bother to version them,
-    # so overlapping info has to be deleted each time
-    clust_syn = _concat_without_overlap(cluster, synteny_frame)
-    write_tsv_or_parquet(clust_syn, cluster_path)
-    anchor_count = clust_syn["syn.anchor.id"].value_counts()
-    anchor_frag_counts = [0]
-    for unused_id_tuple, subframe in clust_syn.groupby(
-        by=["syn.anchor.id", "path"]
-    ):
-        if len(subframe) == 1:
-            anchor_frag_counts.append(1)
-        else:
-            anchor_frag_counts.append(len(subframe["frag.idx"].value_counts()))
-    return {
-        "clust_id": idx,
-        "in_synteny": in_synteny,
-        "n_anchors": len(anchor_count),
-        "max_frags_per_anch": max(anchor_frag_counts),
-        "synteny_pct": in_synteny * 100.0 / n_cluster,
-    }
+def _map_buckets(func, n_buckets, executor=None, quiet=False, **kwargs):
+    """Call func on every bucket, returning a list of results."""
+    if not quiet:
+        ProgressBar(dt=SPINNER_UPDATE_PERIOD).register()
+    return executor.map(func, range(n_buckets), **kwargs)
 
 
-def write_anchor(args, synteny_parent=None, mailbox_reader=None):
-    """Read synteny anchor info from mailbox and join it to synteny file."""
-    idx = args[0]
-    with mailbox_reader(idx) as file_handle:
-        anchor_frame = pd.read_csv(
-            file_handle, sep="\t", index_col=0
-        ).convert_dtypes()
-    in_anchor = len(anchor_frame)
-    if in_anchor == 0:
+def join_synteny_to_cluster_bucket(
+    bucket, cluster_ds=None, cluster_parent=None, cluster_sizes=None
+):
+    """Write synteny info for one bucket of clusters and return stats."""
+    cluster_frame = cluster_ds.read_bucket(bucket)
+    if cluster_frame is None:
         return None
-    # drop any duplicated ID's--normally shouldn't happen
-    anchor_frame.drop(
-        anchor_frame[anchor_frame.index.duplicated()].index, inplace=True
+    cluster_frame.index.name = "prot.id"
+    cluster_frame = cluster_frame.reset_index().sort_values(
+        by=["hom.cluster", "prot.id"], ignore_index=True
+    )
+    write_tsv_or_parquet(
+        cluster_frame.set_index("prot.id"),
+        cluster_parent / f"{bucket}.parq",
+        sort_cols=False,
+        row_group_size=ANCHOR_ROW_GROUP_SIZE,
     )
-    anchor_frame.sort_values(
-        by=["syn.anchor.sub_id", "frag.idx", "frag.pos"], inplace=True
+    by_cluster = cluster_frame.groupby(by="hom.cluster")
+    frags_per_anchor = cluster_frame.groupby(
+        by=["hom.cluster", "syn.anchor.id", "path"], observed=True
+    )["frag.idx"].nunique()
+    stats = pd.DataFrame(
+        {
+            "in_synteny": by_cluster.size(),
+            "n_anchors": by_cluster["syn.anchor.id"].nunique(),
+            "max_frags_per_anch": frags_per_anchor.groupby(level=0).max(),
+        }
     )
+    stats["synteny_pct"] = (
+        stats["in_synteny"] * 100.0 / cluster_sizes[stats.index].to_numpy()
+    )
+    return stats
+
+
+def write_anchor_bucket(bucket, anchor_ds=None, anchor_parent=None):
+    """Write one bucket of anchors and return a list of anchor properties."""
+    anchor_frame = anchor_ds.read_bucket(bucket)
+    if anchor_frame is None:
+        return []
+    anchor_frame.sort_values(by=ANCHOR_SORT_COLS, inplace=True)
+    prop_list = []
+    for anchor_id, subframe in anchor_frame.groupby(
+        by="syn.anchor.id", sort=False
+    ):
+        prop_list += _anchor_props(anchor_id, subframe)
+    write_tsv_or_parquet(
+        anchor_frame,
+        anchor_parent / f"{bucket}.parq",
+        sort_cols=False,
+        row_group_size=ANCHOR_ROW_GROUP_SIZE,
+    )
+    return prop_list
+
+
+def _anchor_props(idx, anchor_frame):
+    """Return a list of properties of an anchor, one per sub-anchor."""
+    # drop any duplicated ID's--normally shouldn't happen
+    anchor_frame = anchor_frame[~anchor_frame.index.duplicated()]
     # Make a dictionary of common anchor properties, order will be kept
     anchor_props = {
         "anchor.id": idx,
@@ -791,33 +1968,23 @@ def write_anchor(args, synteny_parent=None, mailbox_reader=None):
             break
     bad_subframe = False
     prop_list = []
-    for sub_no, subframe in anchor_frame.groupby(by=["syn.anchor.sub_id"]):
-        (subanchor_props, anchor_subframe, bad_subframe) = _subframe_props(
+    for sub_no, subframe in anchor_frame.groupby(by="syn.anchor.sub_id"):
+        subanchor_props, bad_subframe = _subframe_props(
             anchor_props, subframe, sub_no
         )
         if bad_subframe:
             break
-        write_tsv_or_parquet(
-            anchor_subframe,
-            synteny_parent / f"{idx}.{sub_no}.{SYNTENY_FILETYPE}",
-            sort_cols=False,
-        )
         prop_list.append(subanchor_props)
     if bad_subframe:  # Probably means a hash collision
         logger.error(f"bad anchor set {idx}")
         prop_list = []
         sub_no = 0
         anchor_props["anchor.subframe.ok"] = False
-        for cluster_id, subframe in anchor_frame.groupby(by=["hom.cluster"]):
-            (
-                subanchor_props,
-                anchor_subframe,
-                unused_bad_subframe,
-            ) = _subframe_props(anchor_props, subframe, sub_no)
-            write_tsv_or_parquet(
-                anchor_subframe,
-                synteny_parent / f"{idx}.{sub_no}.{SYNTENY_FILETYPE}",
-                sort_cols=False,
+        for unused_cluster_id, subframe in anchor_frame.groupby(
+            by="hom.cluster"
+        ):
+            subanchor_props, unused_bad_subframe = _subframe_props(
+                anchor_props, subframe, sub_no
             )
             sub_no += 1
             prop_list.append(subanchor_props)
@@ -825,41 +1992,35 @@ def write_anchor(args, synteny_parent=None, mailbox_reader=None):
 
 
 def _subframe_props(anchor_props, subframe, sub_no):
-    """Calculate subframe properties and write subframe"""
-    anchor_subframe = subframe.copy()
+    """Calculate subframe properties."""
+    bad_subframe = False
     subanchor_props = anchor_props.copy()
     subanchor_props["sub"] = sub_no
-    anchor_dir_set = set(anchor_subframe["syn.anchor.direction"])
+    anchor_dir_set = set(subframe["syn.anchor.direction"])
     if len(anchor_dir_set) == 1:
         subanchor_props["syn.anchor.direction"] = list(anchor_dir_set)[0]
-    frag_dir_set = set(anchor_subframe["frag.direction"])
+    frag_dir_set = set(subframe["frag.direction"])
     if len(frag_dir_set) == 1:
         subanchor_props["frag.direction"] = list(frag_dir_set)[0]
-    subanchor_props["count"] = anchor_subframe["syn.anchor.count"].iloc[0]
+    subanchor_props["count"] = subframe["syn.anchor.count"].iloc[0]
     subanchor_props["n_ambig"] = _count_code(
-        anchor_subframe["syn.code"], AMBIGUOUS_CODE
+        subframe["syn.code"], AMBIGUOUS_CODE
     )
-    hom_clust_set = set(anchor_subframe["hom.cluster"])
+    hom_clust_set = set(subframe["hom.cluster"])
     if len(hom_clust_set) == 1:
         subanchor_props[f"anchor.{sub_no}.cluster"] = list(hom_clust_set)[0]
     else:
         bad_subframe = True
-    del (
-        anchor_subframe["syn.anchor.count"],
-        anchor_subframe["syn.anchor.sub_id"],
-    )
-    subanchor_props["n"] = len(anchor_subframe)
+    subanchor_props["n"] = len(subframe)
     subanchor_props["hash"] = hash_array(
-        np.sort(anchor_subframe.index.to_numpy())
+        np.sort(subframe.index.to_numpy().astype(str))
     )
     (
         subanchor_props["n_adj"],
         subanchor_props["adj_groups"],
         unused_adj_group,
-    ) = calculate_adjacency_group(
-        anchor_subframe["frag.pos"], anchor_subframe["frag.idx"]
-    )
-    return subanchor_props, anchor_subframe, bad_subframe
+    ) = calculate_adjacency_group(subframe["frag.pos"], subframe["frag.idx"])
+    return subanchor_props, bad_subframe
 
 
 def _concat_without_overlap(df1, df2):
@@ -877,17 +2038,6 @@ def _rename_and_fill_alt(df1, key, alt_key):
     return df2.dropna(how="any")
 
 
-def _join_on_col_with_na(left, right, col_name):
-    """Join on a temporary column of type 'O'."""
-    tmp_col_name = "tmp." + col_name
-    left[tmp_col_name] = left[col_name].astype("O")
-    merged = pd.merge(
-        left, right, left_on=tmp_col_name, right_index=True, how="left"
-    )
-    del merged[tmp_col_name]
-    return merged
-
-
 def _fill_col1_val_where_col2_notna(col1, col2, val):
     """Set col1 to val  where col2 is not NA if col1 is not set."""
     fill_ser = col1.copy()
@@ -900,7 +2050,9 @@ def _count_code(code_ser, code):
     return (code_ser == code).sum()
 
 
-def anchors_to_adjacency(set_path, n_proteomes, mailbox_reader):
+def anchors_to_adjacency(
+    set_path, n_proteomes, mailbox_reader, anchors_path=None
+):
     """Merge adjacencies and produce and adjacency graph."""
     frame_list = []
     for idx in range(n_proteomes):
@@ -915,63 +2067,20 @@ def anchors_to_adjacency(set_path, n_proteomes, mailbox_reader):
         ignore_index=True,
     )
     del frame_list
-    graph = nx.Graph()
-    for unused_tuple, subframe in nodes.groupby(
-        by=["syn.anchor.id", "syn.anchor.sub_id"]
-    ):
-        ids = subframe["member_ids"]
-        n_ids = len(ids)
-        graph.add_nodes_from(ids)
-        if n_ids > 1:
-            edges = combinations(ids, 2)
-            graph.add_edges_from(edges, weight=n_ids)
-    outpath = set_path / ANCHORS_FILE
-    summarypath = outpath.parent / (
-        outpath.name[: -len(outpath.suffix)] + "_summary.tsv"
+    nodes = nodes.dropna(subset=["syn.anchor.id", "syn.anchor.sub_id"])
+    nodes = nodes.sort_values(
+        by=["syn.anchor.id", "syn.anchor.sub_id"], kind="mergesort"
     )
-    histpath = outpath.parent / (
-        outpath.name[: -len(outpath.suffix)] + "_hist.tsv"
+    groups = nodes.groupby(
+        by=["syn.anchor.id", "syn.anchor.sub_id"], sort=False
+    ).ngroup()
+    comp_fr = adjacency_components(groups, nodes["member_ids"])
+    del nodes, groups
+    if anchors_path is None:
+        anchors_path = set_path / ANCHORS_FILE
+    n_items, n_clusts, largest_cluster = write_adjacency(
+        comp_fr, anchors_path
     )
-    components = [
-        c
-        for c in sorted(nx.connected_components(graph), key=len, reverse=True)
-        if len(c) > 1
-    ]
-    fh = outpath.open("w")
-    fh.write("idx\tcluster_id\tsize\tmembers\n")
-    n_items = 0
-    count_list = []
-    hash_list = []
-    id_list = []
-    for i, comp in enumerate(components):
-        component = np.sort(pd.Index(list(comp)).to_numpy())
-        id_list.append(i)
-        size = len(comp)
-        count_list.append(size)
-        hash_list.append(hash_array(component))
-        for node in component:
-            fh.write(f"{n_items}\t{i}\t{size}\t{node}\n")
-            n_items += 1
-    fh.close()
-    n_clusts = len(count_list)
-    del graph, components
-    cluster_counts = pd.DataFrame({"size": count_list})
-    largest_cluster = cluster_counts["size"].max()
-    cluster_hist = (
-        pd.DataFrame(cluster_counts.value_counts()).sort_index().reset_index()
-    )
-    cluster_hist = cluster_hist.set_index("size")
-    cluster_hist = cluster_hist.rename(columns={0: "n"})
-    cluster_hist["item_pct"] = (
-        cluster_hist["n"] * cluster_hist.index * 100.0 / n_items
-    )
-    cluster_hist.to_csv(histpath, sep="\t", float_format="%5.2f")
-    cluster_hist["cluster_pct"] = cluster_hist["n"] * 100.0 / n_clusts
-    cluster_hist.to_csv(histpath, sep="\t", float_format="%5.2f")
-    clusters = pd.DataFrame(
-        {"anchor.id": id_list, "count": count_list, "hash": hash_list}
-    )
-    clusters.to_csv(summarypath, sep="\t")
     stats_dict = {
         "in_anchor": n_items,
         "syn.anchors.n": n_clusts,
@@ -980,74 +2089,47 @@ def anchors_to_adjacency(set_path, n_proteomes, mailbox_reader):
     return stats_dict
 
 
-def intersect_anchors(set1_file, set2_file):
-    set1_path = Path(set1_file)
-    set2_path = Path(set2_file)
-    set1_fr = pd.read_csv(set1_path, sep="\t", index_col=0)
-    set2_fr = pd.read_csv(set2_path, sep="\t", index_col=0)
-    set1_dict = {}
-    for cluster_id, subframe in set1_fr.groupby(by=["cluster_id"]):
-        set1_dict[cluster_id] = set(subframe["members"].to_numpy())
-    set2_dict = {}
-    for cluster_id, subframe in set2_fr.groupby(by=["cluster_id"]):
-        set2_dict[cluster_id] = set(subframe["members"].to_numpy())
-    identity_sets = []
-    s1_subset = []
-    s2_subset = []
-    incongruent = []
-    match_keys = list(set2_dict.keys())
-    for key1 in set1_dict:
-        s1 = set1_dict[key1]
-        for i, key2 in enumerate(match_keys):
-            s2 = set2_dict[key2]
-            if len(s1.intersection(s2)) == 0:
-                continue
-            elif s1 == s2:
-                identity_sets.append(
-                    (
-                        key1,
-                        key2,
-                    )
-                )
-                match_keys.pop(i)
-                break
-            elif s1.issubset(s2):
-                s1_subset.append(
-                    (
-                        key1,
-                        key2,
-                    )
-                )
-                match_keys.pop(i)
-                break
-            elif s2.issubset(s1):
-                s2_subset.append(
-                    (
-                        key1,
-                        key2,
-                    )
-                )
-                match_keys.pop(i)
-                break
-            else:
-                incongruent.append(
-                    (
-                        key1,
-                        key2,
-                    )
-                )
-    logger.info(f"set 1 ({set1_file}): {len(set1_dict)}")
-    logger.info(f"set 2 ({set2_file}): {len(set2_dict)}")
-    min_sets = min(len(set1_dict), len(set2_dict))
-    id_len = len(identity_sets)
-    id_pct = id_len * 100.0 / min_sets
-    logger.info(f"identity: {id_len} ({id_pct:.1f}%)")
-    s1_len = len(s1_subset)
-    s1_pct = s1_len * 100.0 / min_sets
-    logger.info(f"set 1 is subset: {s1_len} ({s1_pct:.1f}%)")
-    s2_len = len(s2_subset)
-    s2_pct = s2_len * 100.0 / min_sets
-    logger.info(f"set 2 is subset: {s2_len} ({s2_pct:.1f}%)")
-    incon_len = len(incongruent)
-    incon_pct = incon_len * 100.0 / min_sets
-    logger.info(f"incongruent: {incon_len}({incon_pct}%)")
+def intersect_anchors(set1_file, set2_files, pairs_file=None):
+    """Classify overlaps of anchors in set 1 with each comparison set."""
+    set1_fr = pd.read_csv(Path(set1_file), sep="\t", index_col=0)
+    n_set1 = set1_fr["cluster_id"].nunique()
+    pair_frames = []
+    for set2_file in set2_files:
+        set2_fr = pd.read_csv(Path(set2_file), sep="\t", index_col=0)
+        n_set2 = set2_fr["cluster_id"].nunique()
+        pair_fr = component_overlaps(
+            set1_fr["cluster_id"],
+            set1_fr["members"],
+            set2_fr["cluster_id"],
+            set2_fr["members"],
+        )
+        relation_counts = relation_anchor_counts(pair_fr)
+        logger.info(f"set 1 ({set1_file}): {n_set1}")
+        logger.info(f"set 2 ({set2_file}): {n_set2}")
+        min_sets = min(n_set1, n_set2)
+        for relation, desc in (
+            ("identity", "identity"),
+            ("set1_subset", "set 1 is subset"),
+            ("set2_subset", "set 2 is subset"),
+            ("incongruent", "incongruent"),
+        ):
+            counts = relation_counts.loc[relation]
+            # anchors shared, counted once on the side with fewer
+            n_anchors = min(counts["set1"], counts["set2"])
+            pct = n_anchors * 100.0 / min_sets
+            logger.info(
+                f"{desc}: {n_anchors} anchors in {counts['pairs']} pairs"
+                + f" ({pct:.1f}%)"
+            )
+        mean_jaccard = pair_fr["jaccard"].mean()
+        logger.info(f"mean Jaccard of overlapping pairs: {mean_jaccard:.3f}")
+        pair_fr.insert(0, "compfile", str(set2_file))
+        pair_frames.append(pair_fr)
+    if pairs_file is not None:
+        write_tsv_or_parquet(
+            pd.concat(pair_frames, ignore_index=True),
+            pairs_file,
+            desc="anchor overlaps",
+            sort_cols=False,
+            enforce_types=False,
+        )
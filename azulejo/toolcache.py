@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""Reuse outputs of external tools run on identical inputs."""
+# standard library imports
+import json
+import os
+import shutil
+import sys
+import time
+from pathlib import Path
+
+# third-party imports
+import attr
+import xxhash
+
+# first-party imports
+import sh
+
+# module imports
+from .common import MEGABYTES
+from .common import NAME
+from .common import SEARCH_PATHS
+from .common import logger
+from .manifest import file_digest
+from .manifest import tool_version
+
+# global constants
+DEFAULT_TOOL_CACHE = (
+    Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache"))
+    / NAME
+    / "tools"
+)
+DEFAULT_TOOL_CACHE_MB = 4096
+META_FILE = "meta.json"
+
+
+def _link_or_copy(source, dest, link=True):
+    """Hard-link source to dest, copying if not link or links fail."""
+    if link:
+        try:
+            os.link(source, dest)
+            return
+        except OSError:
+            pass
+    shutil.copy2(source, dest)
+
+
+def _run_tool(tool, args):
+    """Run an external tool on the search paths."""
+    try:
+        command = sh.Command(tool, search_paths=SEARCH_PATHS)
+    except sh.CommandNotFound:
+        logger.error(f"{tool} must be installed first.")
+        sys.exit(1)
+    logger.debug(command(args))
+
+
+def _remove(path):
+    """Remove a file or directory tree, if it exists."""
+    if path.is_dir():
+        shutil.rmtree(path)
+    elif path.exists():
+        path.unlink()
+
+
+@attr.s
+class ToolCache:
+    """Outputs of external tools, keyed by tool, version, args and inputs.
+
+    args name inputs and outputs by their keys in braces, so keys do
+    not depend on paths.  Outputs that are directories are cached with
+    all the files in them.  Entries are evicted least recently used
+    first when the cache is over max_mb.  If cache_dir is None, tools
+    are always run.
+    """
+
+    cache_dir = attr.ib(default=DEFAULT_TOOL_CACHE)
+    max_mb = attr.ib(default=DEFAULT_TOOL_CACHE_MB)
+
+    def key(self, tool, args, inputs):
+        """Return the cache key of a tool run."""
+        return xxhash.xxh3_128_hexdigest(
+            json.dumps(
+                [
+                    tool,
+                    tool_version(tool),
+                    args,
+                    {
+                        name: file_digest(path)
+                        for name, path in sorted(inputs.items())
+                    },
+                ]
+            ).encode("utf-8")
+        )
+
+    def entry_path(self, key):
+        """Return the directory of a cache entry."""
+        return Path(self.cache_dir) / key[:2] / key
+
+    def run(self, tool, args, inputs=None, outputs=None, link=True):
+        """Run a tool unless cached, returning True on a cache hit.
+
+        Outputs are hard-linked to and from the cache if link is True,
+        otherwise copied, as they must be if they are modified in place.
+        Existing outputs are removed first, so tools never write through
+        links to cached files.
+        """
+        if inputs is None:
+            inputs = {}
+        if outputs is None:
+            outputs = {}
+        paths = {name: str(path) for name, path in inputs.items()}
+        paths.update({name: str(path) for name, path in outputs.items()})
+        if self.cache_dir is None:
+            _run_tool(tool, [arg.format(**paths) for arg in args])
+            return False
+        key = self.key(tool, args, inputs)
+        entry_path = self.entry_path(key)
+        for path in [Path(path) for path in outputs.values()]:
+            if path.is_dir():  # tools may need it to exist
+                for child in path.iterdir():
+                    _remove(child)
+            else:
+                _remove(path)
+        if (entry_path / META_FILE).exists():
+            self._materialize(entry_path, outputs, link)
+            os.utime(entry_path)
+            return True
+        _run_tool(tool, [arg.format(**paths) for arg in args])
+        self._store(entry_path, outputs, link)
+        return False
+
+    def _materialize(self, entry_path, outputs, link):
+        """Link or copy the cached outputs of an entry to their paths."""
+        for name, path in outputs.items():
+            cached = entry_path / name
+            path = Path(path)
+            if cached.is_dir():
+                path.mkdir(parents=True, exist_ok=True)
+                for cached_file in cached.iterdir():
+                    _link_or_copy(cached_file, path / cached_file.name, link)
+            elif cached.exists():
+                _link_or_copy(cached, path, link)
+
+    def _store(self, entry_path, outputs, link):
+        """Save outputs as a cache entry, unless another worker did."""
+        tmp_path = entry_path.parent / f".{entry_path.name}.{os.getpid()}"
+        _remove(tmp_path)
+        tmp_path.mkdir(parents=True)
+        n_bytes = 0
+        for name, path in outputs.items():
+            path = Path(path)
+            if path.is_dir():
+                (tmp_path / name).mkdir()
+                for output_file in path.iterdir():
+                    _link_or_copy(
+                        output_file, tmp_path / name / output_file.name, link
+                    )
+                    n_bytes += output_file.stat().st_size
+            elif path.exists():
+                _link_or_copy(path, tmp_path / name, link)
+                n_bytes += path.stat().st_size
+        with (tmp_path / META_FILE).open("w") as meta_fh:
+            json.dump({"created": time.time(), "bytes": n_bytes}, meta_fh)
+        try:
+            tmp_path.rename(entry_path)
+        except OSError:  # stored by another worker
+            shutil.rmtree(tmp_path)
+
+    def log_report(self, stage, start_time):
+        """Log hits and misses since start_time, then evict to max_mb."""
+        if self.cache_dir is None:
+            return
+        entries = []
+        n_hits = 0
+        n_misses = 0
+        for meta_path in Path(self.cache_dir).glob(f"*/*/{META_FILE}"):
+            with meta_path.open() as meta_fh:
+                meta = json.load(meta_fh)
+            last_used = meta_path.parent.stat().st_mtime
+            if meta["created"] >= start_time:
+                n_misses += 1
+            elif last_used >= start_time:
+                n_hits += 1
+            entries.append((last_used, meta["bytes"], meta_path.parent))
+        if n_hits + n_misses:
+            logger.info(
+                f"{stage} tool cache: {n_hits} hits, {n_misses} misses"
+                + f" ({n_hits * 100.0 / (n_hits + n_misses):.1f}% hits)"
+            )
+        entries.sort()
+        total_bytes = sum(entry[1] for entry in entries)
+        n_evicted = 0
+        while entries and total_bytes > self.max_mb * MEGABYTES:
+            unused_last_used, n_bytes, entry_path = entries.pop(0)
+            shutil.rmtree(entry_path, ignore_errors=True)
+            total_bytes -= n_bytes
+            n_evicted += 1
+        logger.debug(
+            f"Tool cache holds {total_bytes / MEGABYTES:.0f} MB"
+            + f" in {len(entries)} entries, {n_evicted} evicted"
+        )
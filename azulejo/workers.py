@@ -0,0 +1,453 @@
+# -*- coding: utf-8 -*-
+"""Long-lived workers that own per-proteome frames across passes."""
+# standard library imports
+import functools
+import json
+import multiprocessing
+import shutil
+import sys
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# third-party imports
+import pandas as pd
+import xxhash
+
+# module imports
+from .common import MEGABYTES
+from .common import atomic_path
+from .common import canonicalize_frame
+from .common import logger
+from .common import read_tsv_or_parquet
+from .common import write_tsv_or_parquet
+
+# global constants
+FLUSH_COMMAND = "flush"
+FOLD_COMMAND = "fold"
+STOP_COMMAND = "stop"
+PREP_KWARGS = ("remove_tmp", "sort_cols", "enforce_types")
+WRITE_BEHIND_THREADS = 2
+WRITE_BEHIND_MB = 512
+DIGESTS_FILE = "frame_digests.json"
+DIGEST_SUFFIX = ".digest"
+
+
+def _prepare(frame, kwargs):
+    """Return a frame as it would be written and kwargs to write it as is."""
+    prep_kwargs = {k: kwargs[k] for k in PREP_KWARGS if k in kwargs}
+    write_kwargs = {k: v for k, v in kwargs.items() if k not in PREP_KWARGS}
+    write_kwargs.update(
+        {"remove_tmp": False, "sort_cols": False, "enforce_types": False}
+    )
+    return canonicalize_frame(frame, **prep_kwargs), write_kwargs
+
+
+def frame_digest(frame):
+    """Return a digest of the columns, types, index and values of a frame."""
+    hasher = xxhash.xxh3_128()
+    hasher.update(
+        json.dumps(
+            [[str(col), str(dtype)] for col, dtype in frame.dtypes.items()]
+        ).encode("utf-8")
+    )
+    hasher.update(
+        pd.util.hash_pandas_object(frame, index=True).to_numpy().tobytes()
+    )
+    return hasher.hexdigest()
+
+
+def recorded_digest(filepath):
+    """Return the digest of the frame last written to filepath, or None.
+
+    Digests are valid only while the file's size and modification time
+    are those recorded, so files written otherwise are never matched.
+    """
+    digests_path = filepath.parent / DIGESTS_FILE
+    if not filepath.exists() or not digests_path.exists():
+        return None
+    with digests_path.open() as digests_fh:
+        record = json.load(digests_fh).get(filepath.name, None)
+    stat = filepath.stat()
+    if record is None or record[:2] != [stat.st_size, stat.st_mtime_ns]:
+        return None
+    return record[2]
+
+
+def record_digest(filepath, digest):
+    """Record the digest of the frame just written to filepath."""
+    digests_path = filepath.parent / DIGESTS_FILE
+    digests = {}
+    if digests_path.exists():
+        with digests_path.open() as digests_fh:
+            digests = json.load(digests_fh)
+    stat = filepath.stat()
+    digests[filepath.name] = [stat.st_size, stat.st_mtime_ns, digest]
+    with atomic_path(digests_path) as tmp_path:
+        with tmp_path.open("w") as digests_fh:
+            json.dump(digests, digests_fh, sort_keys=True)
+
+
+class WriteBehindQueue:
+    """Compress and write frames in threads while computation continues.
+
+    Submissions wait while the frames queued would exceed max_mb, so
+    the memory held by the queue is bounded.  Writes to a path are
+    done in the order submitted.
+    """
+
+    def __init__(
+        self, n_threads=WRITE_BEHIND_THREADS, max_mb=WRITE_BEHIND_MB
+    ):
+        """Set limits; threads are started on first use."""
+        self.n_threads = n_threads
+        self.max_mb = max_mb
+        self._init_state()
+
+    def _init_state(self):
+        """Initialize the per-process executor and counts."""
+        self.executor = None
+        self.pending = {}
+        self.queued_bytes = 0
+        self.cond = threading.Condition()
+
+    def __getstate__(self):
+        """Pickle only the limits, so queues can be sent to processes."""
+        return {"n_threads": self.n_threads, "max_mb": self.max_mb}
+
+    def __setstate__(self, state):
+        """Restore limits with an empty queue."""
+        self.__dict__.update(state)
+        self._init_state()
+
+    def submit(self, frame, filepath, **kwargs):
+        """Queue a frame to be written by write_tsv_or_parquet.
+
+        The frame must not be modified after it is submitted.
+        """
+        n_bytes = int(frame.memory_usage(index=True, deep=True).sum())
+        with self.cond:
+            while (
+                self.queued_bytes > 0
+                and self.queued_bytes + n_bytes > self.max_mb * MEGABYTES
+            ):
+                self.cond.wait()
+            self.queued_bytes += n_bytes
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(
+                    max_workers=self.n_threads
+                )
+        self.wait(filepath)
+        future = self.executor.submit(
+            write_tsv_or_parquet, frame, filepath, **kwargs
+        )
+        future.add_done_callback(functools.partial(self._release, n_bytes))
+        self.pending[filepath] = future
+
+    def _release(self, n_bytes, unused_future):
+        """Account for a finished write and wake waiting submitters."""
+        with self.cond:
+            self.queued_bytes -= n_bytes
+            self.cond.notify_all()
+
+    def wait(self, filepath):
+        """Wait for a queued write to filepath, raising its exception."""
+        future = self.pending.pop(filepath, None)
+        if future is not None:
+            future.result()
+
+    def flush(self):
+        """Wait for all queued writes."""
+        for filepath in list(self.pending):
+            self.wait(filepath)
+
+
+class FrameStore:
+    """Read and write per-proteome frames straight through to disk."""
+
+    def read(self, filepath, columns=None):
+        """Read a frame, or only columns of it, from filepath."""
+        return read_tsv_or_parquet(filepath, columns=columns)
+
+    def write(self, frame, filepath, **kwargs):
+        """Write a frame to filepath."""
+        write_tsv_or_parquet(frame, filepath, **kwargs)
+
+    def flush(self):
+        """Nothing is held, so nothing needs to be written."""
+
+
+class WriteBehindStore(FrameStore):
+    """Write per-proteome frames through a write-behind queue.
+
+    Reads of a path wait for its queued write.  Writes must be flushed
+    before the files are read by another process.
+    """
+
+    def __init__(self, queue=None):
+        """Use queue, or a default queue."""
+        if queue is None:
+            queue = WriteBehindQueue()
+        self.queue = queue
+
+    def read(self, filepath, columns=None):
+        """Read a frame from filepath once its queued write is done."""
+        self.queue.wait(filepath)
+        return read_tsv_or_parquet(filepath, columns=columns)
+
+    def write(self, frame, filepath, **kwargs):
+        """Queue the frame as it would have been written."""
+        frame, write_kwargs = _prepare(frame, kwargs)
+        self.queue.submit(frame, filepath, **write_kwargs)
+
+    def flush(self):
+        """Wait for queued writes."""
+        self.queue.flush()
+
+
+def run_and_flush(args, task_func=None, store=None, **kwargs):
+    """Call a per-proteome task, then wait for the writes it queued."""
+    try:
+        return task_func(args, store=store, **kwargs)
+    finally:
+        store.flush()
+
+
+class ChangedOnlyStore(FrameStore):
+    """Write per-proteome frames to scratch, replacing only changed files.
+
+    Later passes read frames back from scratch.  commit() moves the last
+    frame written to a path into place only if its digest differs from
+    the one recorded when the file was last written, so unchanged files
+    are not touched.
+    """
+
+    def __init__(self, scratch_dir, store=None):
+        """Write to scratch_dir through store, by default straight to disk."""
+        if store is None:
+            store = FrameStore()
+        self.scratch_dir = scratch_dir
+        self.store = store
+
+    def scratch_path(self, filepath):
+        """Return the scratch path standing in for filepath."""
+        filepath = Path(filepath)
+        return self.scratch_dir / filepath.relative_to(filepath.anchor)
+
+    def read(self, filepath, columns=None):
+        """Read the frame written to scratch, or from filepath if none."""
+        scratch_path = self.scratch_path(filepath)
+        if scratch_path.exists():
+            return self.store.read(scratch_path, columns=columns)
+        return self.store.read(filepath, columns=columns)
+
+    def write(self, frame, filepath, **kwargs):
+        """Write the frame to scratch, with its digest."""
+        frame, write_kwargs = _prepare(frame, kwargs)
+        scratch_path = self.scratch_path(filepath)
+        scratch_path.parent.mkdir(parents=True, exist_ok=True)
+        (scratch_path.parent / (scratch_path.name + DIGEST_SUFFIX)).write_text(
+            frame_digest(frame)
+        )
+        self.store.write(frame, scratch_path, **write_kwargs)
+
+    def flush(self):
+        """Wait for writes to scratch."""
+        self.store.flush()
+
+    def commit(self, filepath):
+        """Replace filepath with its frame if changed, returning True if so."""
+        scratch_path = self.scratch_path(filepath)
+        digest_path = scratch_path.parent / (scratch_path.name + DIGEST_SUFFIX)
+        if not digest_path.exists():
+            return False
+        digest = digest_path.read_text()
+        digest_path.unlink()
+        if recorded_digest(filepath) == digest:
+            scratch_path.unlink()
+            return False
+        shutil.move(str(scratch_path), str(filepath))
+        record_digest(filepath, digest)
+        return True
+
+
+class ResidentFrameStore(FrameStore):
+    """Keep per-proteome frames in memory, writing them only on flush.
+
+    If changed_only is True, frames whose digest matches the one recorded
+    when the file was last written are not rewritten.  If write_behind is
+    True, frames are written on flush by a write-behind queue.
+    """
+
+    def __init__(self, changed_only=False, write_behind=False):
+        """Initialize the in-memory frames."""
+        self.frames = {}
+        self.write_kwargs = {}
+        self.changed_only = changed_only
+        if write_behind:
+            self.queue = WriteBehindQueue()
+        else:
+            self.queue = None
+
+    def read(self, filepath, columns=None):
+        """Return a copy of the held frame, reading from disk on first use."""
+        if filepath not in self.frames:
+            return read_tsv_or_parquet(filepath, columns=columns)
+        if columns is None:
+            return self.frames[filepath].copy()
+        return self.frames[filepath][columns].copy()
+
+    def write(self, frame, filepath, **kwargs):
+        """Hold the frame as it would have been written."""
+        self.frames[filepath], self.write_kwargs[filepath] = _prepare(
+            frame, kwargs
+        )
+
+    def flush(self):
+        """Write held frames to disk, returning the number written."""
+        written = []
+        for filepath, frame in self.frames.items():
+            digest = frame_digest(frame)
+            if self.changed_only and recorded_digest(filepath) == digest:
+                continue
+            written.append((filepath, digest))
+            if self.queue is None:
+                write_tsv_or_parquet(
+                    frame, filepath, **self.write_kwargs[filepath]
+                )
+            else:
+                self.queue.submit(
+                    frame, filepath, **self.write_kwargs[filepath]
+                )
+        if self.queue is not None:
+            self.queue.flush()
+        for filepath, digest in written:
+            record_digest(filepath, digest)
+        return len(written)
+
+
+def _fold(arg_list, store, func=None, init=None, kwargs=None):
+    """Fold func(acc, args) over a partition of proteomes from init()."""
+    acc = init()
+    for args in arg_list:
+        acc = func(acc, args, store=store, **kwargs)
+    return acc
+
+
+def _resident_worker(conn, arg_list, changed_only, write_behind):
+    """Run commands on a fixed partition of proteomes until told to stop."""
+    store = ResidentFrameStore(
+        changed_only=changed_only, write_behind=write_behind
+    )
+    while True:
+        command, kwargs = conn.recv()
+        if command == STOP_COMMAND:
+            break
+        try:
+            if command == FLUSH_COMMAND:
+                result = [store.flush()]
+            elif command == FOLD_COMMAND:
+                result = [_fold(arg_list, store, **kwargs)]
+            else:
+                result = [
+                    command(args, store=store, **kwargs) for args in arg_list
+                ]
+        except Exception:  # pylint: disable=broad-except
+            result = RuntimeError(traceback.format_exc())
+        conn.send(result)
+    conn.close()
+
+
+class ResidentWorkerPool:
+    """Workers that each own a fixed partition of proteomes.
+
+    Frames stay in worker memory between passes, so only the per-pass
+    keyword arguments (hash tables and mailboxes) cross process boundaries.
+    With n_workers of 0, the partition is held in the calling process.
+    """
+
+    def __init__(
+        self, arg_list, n_workers, changed_only=False, write_behind=False
+    ):
+        """Start the workers and hand each its partition."""
+        self.n_workers = min(n_workers, len(arg_list))
+        self.conns = []
+        self.procs = []
+        if self.n_workers < 1:
+            self.arg_list = arg_list
+            self.store = ResidentFrameStore(
+                changed_only=changed_only, write_behind=write_behind
+            )
+            return
+        for i in range(self.n_workers):
+            parent_conn, child_conn = multiprocessing.Pipe()
+            proc = multiprocessing.Process(
+                target=_resident_worker,
+                args=(
+                    child_conn,
+                    arg_list[i :: self.n_workers],
+                    changed_only,
+                    write_behind,
+                ),
+                daemon=True,
+            )
+            proc.start()
+            child_conn.close()
+            self.conns.append(parent_conn)
+            self.procs.append(proc)
+        logger.debug(f"Started {self.n_workers} resident workers")
+
+    def _broadcast(self, command, kwargs):
+        """Send a command to all workers and collect their results."""
+        if self.n_workers < 1:
+            if command == FLUSH_COMMAND:
+                return [self.store.flush()]
+            if command == FOLD_COMMAND:
+                return [_fold(self.arg_list, self.store, **kwargs)]
+            return [
+                command(args, store=self.store, **kwargs)
+                for args in self.arg_list
+            ]
+        for conn in self.conns:
+            conn.send((command, kwargs))
+        results = []
+        for conn in self.conns:
+            result = conn.recv()
+            if isinstance(result, Exception):
+                logger.error(f"Resident worker failed:\n{result}")
+                self.close()
+                sys.exit(1)
+            results += result
+        return results
+
+    def map(self, func, **kwargs):
+        """Call func on every proteome, returning a list of results."""
+        return self._broadcast(func, kwargs)
+
+    def fold(self, func, init, combine, **kwargs):
+        """Fold func(acc, args) over every proteome, combining the folds.
+
+        Each worker folds over its partition from init(), then the folds
+        are combined in worker order by combine(acc, acc).
+        """
+        return functools.reduce(
+            combine,
+            self._broadcast(
+                FOLD_COMMAND, {"func": func, "init": init, "kwargs": kwargs}
+            ),
+        )
+
+    def flush(self):
+        """Have workers write out their frames, returning numbers written."""
+        return self._broadcast(FLUSH_COMMAND, {})
+
+    def close(self):
+        """Stop the workers."""
+        for conn in self.conns:
+            conn.send((STOP_COMMAND, {}))
+            conn.close()
+        for proc in self.procs:
+            proc.join()
+        self.conns = []
+        self.procs = []
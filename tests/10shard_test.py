@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""Tests for job-array shards run as separate processes."""
+# standard library imports
+import multiprocessing
+import time
+from pathlib import Path
+
+# third-party imports
+import pandas as pd
+import pytest
+import sh
+from sh import ErrorReturnCode
+
+# module imports
+from azulejo.shards import Shard
+from azulejo.shards import ShardResults
+
+from . import CLUSTERED_SET_PROTEOMES
+from . import print_docstring
+from . import run_azulejo
+from . import working_directory
+from . import write_clustered_set
+
+# global constants
+azulejo = sh.Command("azulejo")
+N_ITEMS = 20
+N_SHARDS = 2
+CALLS_FILE = "calls.txt"
+
+
+def _count_call(calls_path):
+    """Record a call, slowly enough for other shards to wait on it."""
+    with calls_path.open("a") as calls_fh:
+        calls_fh.write("called\n")
+    time.sleep(0.5)
+    return N_ITEMS
+
+
+def _run_shard(set_path, spec, options):
+    """Run one shard of a stage, as a job-array task would."""
+    shard = Shard.parse(spec)
+    shard_results = ShardResults(set_path, "test")
+    n_items = shard_results.run_once(
+        "count", _count_call, set_path / CALLS_FILE
+    )
+    shard_results.save(
+        shard,
+        [item * options["factor"] for item in shard.select(range(n_items))],
+        options,
+    )
+
+
+def _run_shard_processes(set_path, shard_options):
+    """Run shards at once in processes of their own, checking exits."""
+    procs = [
+        multiprocessing.Process(
+            target=_run_shard, args=(set_path, spec, options)
+        )
+        for spec, options in shard_options
+    ]
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join()
+        assert proc.exitcode == 0
+
+
+def _run_synteny_shards(setname, shard_args):
+    """Run synteny shards at once in processes of their own."""
+    shards = [
+        azulejo(
+            ["synteny", "--shard", f"{i}/{N_SHARDS}", *args, setname],
+            _bg=True,
+        )
+        for i, args in enumerate(shard_args)
+    ]
+    for shard in shards:
+        shard.wait()
+
+
+@print_docstring()
+def test_shard_results(tmp_path):
+    """Test that shard results are gathered in unsharded order."""
+    items = list(range(N_ITEMS))
+    shard_results = ShardResults(tmp_path, "test")
+    for i in (2, 0, 1):
+        shard = Shard.parse(f"{i}/3")
+        shard_results.save(shard, shard.select(items), {"factor": 3})
+    results, options, count = shard_results.load()
+    assert results == items
+    assert options == {"factor": 3}
+    assert count == 3
+    assert shard_results.run_once("once", len, items) == N_ITEMS
+    assert shard_results.run_once("once", len, []) == N_ITEMS
+    shard_results.delete()
+    assert not list(tmp_path.iterdir())
+    with pytest.raises(ValueError):
+        Shard.parse("3/3")
+
+
+@print_docstring()
+def test_shard_processes(tmp_path):
+    """Test shards run as processes share run_once and refuse mismatches."""
+    _run_shard_processes(
+        tmp_path,
+        [(f"{i}/{N_SHARDS}", {"factor": 3}) for i in range(N_SHARDS)],
+    )
+    # the shard that waited on the lock used the first shard's result
+    assert (tmp_path / CALLS_FILE).read_text().count("called") == 1
+    results, options, count = ShardResults(tmp_path, "test").load()
+    assert results == [i * 3 for i in range(N_ITEMS)]
+    assert options == {"factor": 3}
+    assert count == N_SHARDS
+    # a shard rerun with other options is not gathered with the rest
+    _run_shard_processes(tmp_path, [(f"1/{N_SHARDS}", {"factor": 2})])
+    with pytest.raises(SystemExit):
+        ShardResults(tmp_path, "test").load()
+
+
+@print_docstring()
+def test_gather_synteny_shards(tmp_path):
+    """Test that gathered synteny shards match an unsharded run."""
+    with working_directory(tmp_path):
+        for setname in ("whole", "sharded", "mismatched"):
+            write_clustered_set(Path(setname))
+        run_azulejo(["synteny", "whole"], "unsharded synteny")
+        _run_synteny_shards("sharded", [[] for unused_i in range(N_SHARDS)])
+        run_azulejo(["gather", "synteny", "sharded"], "gather")
+        for proteome_no in range(CLUSTERED_SET_PROTEOMES):
+            pd.testing.assert_frame_equal(
+                pd.read_parquet(
+                    f"sharded/p{proteome_no}/proteins.hom.syn.parq"
+                ),
+                pd.read_parquet(f"whole/p{proteome_no}/proteins.hom.syn.parq"),
+            )
+        assert (
+            Path("sharded/synteny_anchors.tsv").read_text()
+            == Path("whole/synteny_anchors.tsv").read_text()
+        )
+        assert not Path("sharded/shards").exists()
+        _run_synteny_shards("mismatched", [[], ["-k", "3"]])
+        with pytest.raises(ErrorReturnCode):
+            azulejo(["gather", "synteny", "mismatched"])
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""Tests for space-aware scratch devices."""
+# standard library imports
+import pickle
+
+# module imports
+from azulejo.mailboxes import SpaceAwareTempDevices
+
+from . import print_docstring
+
+
+@print_docstring()
+def test_scratch_devices(tmp_path):
+    """Test scratch placement by size, removal and usage reports."""
+    with SpaceAwareTempDevices(
+        scratch_dev=None, fallback_dev=tmp_path
+    ) as scratch:
+        small = scratch.allocate("small", 1)
+        huge = scratch.allocate("huge", 1 << 40)
+        (small.path / "data").write_bytes(bytes(2 << 20))
+        scratch.check()
+    assert huge.dev == f"{tmp_path}/"
+    assert not small.path.exists()
+    assert not huge.path.exists()
+    stages, devices = scratch.report()
+    assert list(stages["stage"]) == ["small", "huge"]
+    assert stages["peak_mb"].tolist() == [2, 0]
+    assert set(devices["dev"]) == set(stages["dev"])
+
+
+@print_docstring()
+def test_scratch_copies(tmp_path):
+    """Test that pickled copies of devices allocate on their own."""
+    with SpaceAwareTempDevices(
+        scratch_dev=None, fallback_dev=tmp_path, n_processes=4
+    ) as scratch:
+        copy = pickle.loads(pickle.dumps(scratch))
+        download = copy.allocate("download", 1)
+        assert download.path.exists()
+        assert copy.allocations[download.dev] == 1
+        assert not scratch.allocators
+        download.release()
+        assert copy.allocations[download.dev] == 0
+        assert copy.n_processes == 4
+    assert not download.path.exists()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""Tests for memory-mapped sequence stores."""
+# third-party imports
+import pandas as pd
+import pytest
+
+# module imports
+from azulejo.homology import info_to_fasta
+from azulejo.seqstore import SEQ_IDX_COL
+from azulejo.seqstore import SEQUENCES_FILE
+from azulejo.seqstore import SequenceStore
+
+from . import print_docstring
+
+# global constants
+SEQS = ["MKVL", "MAGTTRW"]
+
+
+def _info(prot_ids, seq_idxs):
+    """Return a protein info table pointing at stored sequences."""
+    return pd.DataFrame(
+        {SEQ_IDX_COL: seq_idxs, "prot.len": [len(SEQS[i]) for i in seq_idxs]},
+        index=pd.Index(prot_ids, name="prot.id"),
+    )
+
+
+@print_docstring()
+def test_sequence_store(tmp_path):
+    """Test writing, mapping and slicing a sequence store."""
+    store = SequenceStore.write(tmp_path, SEQS).load()
+    assert len(store) == len(SEQS)
+    assert [bytes(store[i]) for i in range(len(SEQS))] == [
+        seq.encode("ascii") for seq in SEQS
+    ]
+    assert store.lengths().tolist() == [len(seq) for seq in SEQS]
+    store.close()
+    with pytest.raises(SystemExit):
+        SequenceStore(tmp_path / "missing").load()
+
+
+@print_docstring()
+def test_empty_sequence_store(tmp_path):
+    """Test that a proteome with no sequences loads and writes nothing."""
+    store = SequenceStore.write(tmp_path, []).load()
+    assert (tmp_path / SEQUENCES_FILE).stat().st_size == 0
+    assert len(store) == 0
+    assert store.lengths().tolist() == []
+    fasta_path = tmp_path / "empty.fa"
+    with fasta_path.open("wb") as fasta_fh:
+        store.write_fasta(fasta_fh, _info([], []))
+    assert fasta_path.read_bytes() == b""
+    store.close()
+
+
+@print_docstring()
+def test_info_to_fasta_round_trip(tmp_path):
+    """Test that stored sequences make the FASTA of sequence columns."""
+    SequenceStore.write(tmp_path, SEQS)
+    info = _info(["p.b", "p.a"], [1, 0])
+    store_fasta = tmp_path / "store.fa"
+    info_to_fasta(
+        tmp_path / "proteins.parq", store_fasta, False, infoobj=info.copy()
+    )
+    legacy = info.drop(columns=[SEQ_IDX_COL])
+    legacy["prot.seq"] = [SEQS[i] for i in info[SEQ_IDX_COL]]
+    legacy_fasta = tmp_path / "legacy.fa"
+    info_to_fasta(
+        tmp_path / "proteins.parq", legacy_fasta, False, infoobj=legacy
+    )
+    assert store_fasta.read_bytes() == legacy_fasta.read_bytes()
+    records = store_fasta.read_text().splitlines()
+    assert records[0].startswith(">p.b ")
+    assert records[1::2] == [SEQS[1], SEQS[0]]
+    # appending adds records after those already written
+    info_to_fasta(
+        tmp_path / "proteins.parq",
+        store_fasta,
+        True,
+        infoobj=info.iloc[:1].copy(),
+    )
+    assert store_fasta.read_text().splitlines()[-1] == SEQS[1]
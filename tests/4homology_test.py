@@ -24,6 +24,11 @@ def test_subcommand_help():
     help_check(SUBCOMMAND)
 
 
+def test_cluster_order_help():
+    """Test cluster-order help message."""
+    help_check("cluster-order")
+
+
 @print_docstring()
 def test_homology(datadir_mgr, capsys):
     """Test homology clustering, MSA, and tree building."""
@@ -5,19 +5,27 @@ import time
 from pathlib import Path
 
 # third-party imports
+import pandas as pd
 import sh
 
 # module imports
+from azulejo.adjacency import component_overlaps
+from azulejo.adjacency import relation_anchor_counts
+
+from . import CLUSTERED_SET_PROTEOMES
 from . import HOMOLOGY_OUTPUTS
 from . import SYNTENY_OUTPUTS
 from . import find_homology_files
 from . import help_check
 from . import print_docstring
 from . import run_azulejo
+from . import working_directory
+from . import write_clustered_set
 
 # global constants
 azulejo = sh.Command("azulejo")
 SUBCOMMAND = "synteny"
+N_SHARDS = 2
 
 
 def test_subcommand_help():
@@ -25,6 +33,33 @@ def test_subcommand_help():
     help_check(SUBCOMMAND)
 
 
+@print_docstring()
+def test_synteny_without_cluster_order(tmp_path):
+    """Test synteny on a set whose fragments are grouped, not ordered."""
+    with working_directory(tmp_path):
+        write_clustered_set(Path("grouped"))
+        run_azulejo([SUBCOMMAND, "grouped"], "synteny without cluster order")
+        for proteome_no in range(CLUSTERED_SET_PROTEOMES):
+            assert Path(
+                f"grouped/p{proteome_no}/proteins.hom.syn.parq"
+            ).exists()
+        anchors = pd.read_csv("grouped/synteny_anchors.tsv", sep="\t")
+        assert len(anchors) > 0
+
+
+@print_docstring()
+def test_relation_anchor_counts():
+    """Test that anchors in many overlapping pairs are counted once."""
+    # anchor 0 of set 1 is split into three anchors of set 2
+    pair_fr = component_overlaps(
+        [0, 0, 0, 0, 1], list("abcde"), [5, 6, 7, 7, 8], list("abcde")
+    )
+    counts = relation_anchor_counts(pair_fr)
+    assert counts.loc["set2_subset"].tolist() == [3, 1, 3]
+    assert counts.loc["identity"].tolist() == [1, 1, 1]
+    assert counts.loc["incongruent"].tolist() == [0, 0, 0]
+
+
 @print_docstring()
 def test_synteny(datadir_mgr, capsys):
     """Test synteny anchor construction."""
@@ -43,3 +78,37 @@ def test_synteny(datadir_mgr, capsys):
             print("Checking that output files exist")
             for filestring in SYNTENY_OUTPUTS:
                 assert Path(filestring).exists()
+
+
+@print_docstring()
+def test_sharded_synteny(datadir_mgr, capsys):
+    """Test synteny from shards run as separate processes."""
+    with capsys.disabled():
+        inpathlist = HOMOLOGY_OUTPUTS + find_homology_files(in_tmp_dir=False)
+        with datadir_mgr.in_tmp_dir(
+            inpathlist=inpathlist,
+            save_outputs=False,
+            excludepaths=["logs/"],
+        ):
+            shards = [
+                azulejo(
+                    [
+                        "-e",
+                        SUBCOMMAND,
+                        "--shard",
+                        f"{i}/{N_SHARDS}",
+                        "glycines",
+                    ],
+                    _bg=True,
+                )
+                for i in range(N_SHARDS)
+            ]
+            for shard in shards:
+                shard.wait()
+            run_azulejo(
+                ["-e", "gather", SUBCOMMAND, "glycines"],
+                "gathering synteny shards",
+            )
+            for filestring in SYNTENY_OUTPUTS:
+                assert Path(filestring).exists()
+            assert not Path("glycines/shards").exists()
@@ -2,13 +2,24 @@
 """Tests for data ingestion."""
 # standard library imports
 import sys
+import time
 from pathlib import Path
 
 # third-party imports
+import numpy as np
+import pandas as pd
 import pytest
 import sh
 
 # module imports
+from azulejo.common import ARROW_SCHEMAS
+from azulejo.common import YES_NO
+from azulejo.common import read_tsv_or_parquet
+from azulejo.common import write_tsv_or_parquet
+from azulejo.workers import ChangedOnlyStore
+from azulejo.workers import WriteBehindQueue
+from azulejo.workers import WriteBehindStore
+
 from . import TSV_OUTPUT_FILE
 from . import TSV_TEST_FILE
 from . import help_check
@@ -17,6 +28,8 @@ from . import print_docstring
 # global constants
 azulejo = sh.Command("azulejo")
 SUBCOMMAND = "parquet-to-tsv"
+N_CLUSTER_FRAMES = 500
+CLUSTER_FRAME_SIZE = 20
 
 
 def test_subcommand_help():
@@ -46,3 +59,116 @@ def test_parquet_conversion(datadir_mgr):
             print(errors)
             pytest.fail("Parquet-to-TSV conversion failed")
         assert Path(TSV_OUTPUT_FILE).exists()
+
+
+@print_docstring()
+def test_read_columns_and_filters(tmp_path):
+    """Test column projection and filters on parquet and TSV reads."""
+    frame = pd.DataFrame(
+        {
+            "frag.idx": pd.array([0, 0, 1, 1, 2, 2], dtype=pd.UInt32Dtype()),
+            "hom.cluster": pd.array(
+                [5, None, 7, 5, 9, 5], dtype=pd.UInt32Dtype()
+            ),
+            "prot.seq": pd.array(["MA", "MB", "MC", "MD", "ME", "MF"]),
+        },
+        index=pd.Index([f"p{i}" for i in range(6)], name="prot.id"),
+    )
+    filters = [("frag.idx", ">=", 1), ("hom.cluster", "in", [5, 9])]
+    for ext in ("parq", "tsv"):
+        filepath = tmp_path / f"proteins.{ext}"
+        write_tsv_or_parquet(frame, filepath, row_group_size=2)
+        subset = read_tsv_or_parquet(
+            filepath, columns=["hom.cluster"], filters=filters
+        )
+        assert list(subset.columns) == ["hom.cluster"]
+        assert list(subset.index) == ["p3", "p4", "p5"]
+        assert subset["hom.cluster"].dtype == pd.UInt32Dtype()
+
+
+def _cluster_frame(rng, size):
+    """Return a frame like those parsed from cluster FASTA headers."""
+    return pd.DataFrame(
+        {
+            "frag.id": [f"chr{i}" for i in rng.integers(0, 20, size)],
+            "frag.is_chr": rng.choice(["y", "n"], size),
+            "frag.pos": rng.integers(0, 5000, size),
+            "path": rng.choice(["glyma.Wm82", "glyso.W05"], size),
+            "prot.len": rng.integers(50, 1000, size),
+            "prot.m_start": rng.random(size) < 0.9,
+        },
+        index=pd.Index(
+            [f"p{i}" for i in rng.integers(0, 10 ** 6, size)], name="prot.id"
+        ),
+    ).convert_dtypes()
+
+
+@print_docstring()
+def test_cached_schema_benchmark(tmp_path):
+    """Compare cluster-sized writes through cached schemas with pandas."""
+    rng = np.random.default_rng(0)
+    frames = [
+        _cluster_frame(rng, CLUSTER_FRAME_SIZE)
+        for unused_i in range(N_CLUSTER_FRAMES)
+    ]
+    start = time.perf_counter()
+    for i, frame in enumerate(frames):
+        write_tsv_or_parquet(frame.copy(), tmp_path / f"{i}.parq")
+    cached_rate = len(frames) / (time.perf_counter() - start)
+    start = time.perf_counter()
+    for frame in frames:
+        frame.to_parquet(tmp_path / "pandas.parq")
+    pandas_rate = len(frames) / (time.perf_counter() - start)
+    print(
+        f"{cached_rate:.0f} frames/s with cached schemas, canonicalized;"
+        + f" {pandas_rate:.0f} frames/s by pandas, not canonicalized"
+    )
+    assert len(ARROW_SCHEMAS) >= 1
+    written = read_tsv_or_parquet(tmp_path / "0.parq")
+    assert written["frag.is_chr"].dtype == YES_NO
+    assert written["prot.len"].dtype == pd.UInt32Dtype()
+    assert list(written.index) == list(frames[0].index)
+
+
+@print_docstring()
+def test_write_behind(tmp_path):
+    """Test that write-behind writes match direct writes, leaving no temps."""
+    rng = np.random.default_rng(0)
+    frames = [_cluster_frame(rng, CLUSTER_FRAME_SIZE) for unused_i in range(4)]
+    store = WriteBehindStore(WriteBehindQueue(max_mb=0))
+    for i, frame in enumerate(frames):
+        write_tsv_or_parquet(frame.copy(), tmp_path / f"direct.{i}.parq")
+        store.write(frame.copy(), tmp_path / f"behind.{i}.parq")
+    # a second write to a path replaces the first, in order
+    store.write(frames[0].copy(), tmp_path / "behind.1.parq")
+    store.flush()
+    assert not list(tmp_path.glob(".*.tmp"))
+    for i, direct_i in enumerate([0, 0, 2, 3]):
+        expected = read_tsv_or_parquet(tmp_path / f"direct.{direct_i}.parq")
+        written = read_tsv_or_parquet(tmp_path / f"behind.{i}.parq")
+        assert written.equals(expected)
+
+
+@print_docstring()
+def test_changed_only(tmp_path):
+    """Test that unchanged frames do not replace their files."""
+    rng = np.random.default_rng(0)
+    frames = [_cluster_frame(rng, CLUSTER_FRAME_SIZE) for unused_i in range(2)]
+    out_path = tmp_path / "out" / "0.parq"
+    out_path.parent.mkdir()
+    changed = []
+    for frame in [frames[0], frames[0], frames[1]]:
+        store = ChangedOnlyStore(tmp_path / "scratch")
+        store.write(frame.copy(), out_path)
+        # later passes read back from scratch
+        assert store.read(out_path).equals(
+            read_tsv_or_parquet(store.scratch_path(out_path))
+        )
+        store.flush()
+        changed.append(store.commit(out_path))
+    assert changed == [True, False, True]
+    assert not list((tmp_path / "scratch").rglob("*.parq"))
+    write_tsv_or_parquet(frames[1].copy(), tmp_path / "1.parq")
+    assert read_tsv_or_parquet(out_path).equals(
+        read_tsv_or_parquet(tmp_path / "1.parq")
+    )
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""Tests for synteny hash widths and filters."""
+# standard library imports
+import time
+import tracemalloc
+
+# third-party imports
+import numpy as np
+import pandas as pd
+
+# module imports
+from azulejo.hash import SyntenyBlockHasher
+from azulejo.hashtable import SharedHashTable
+from azulejo.sketch import SeenTwiceFilter
+
+from . import print_docstring
+
+# global constants
+N_PROTEINS = 100000
+N_CLUSTERS = 20000
+
+
+def _random_clusters(n_proteins, n_clusters, seed=0):
+    """Return a homology-cluster series with some tandem repeats."""
+    rng = np.random.default_rng(seed)
+    clusters = rng.integers(0, n_clusters, n_proteins)
+    repeats = rng.random(n_proteins) < 0.1
+    clusters[1:][repeats[1:]] = clusters[:-1][repeats[1:]]
+    return pd.Series(pd.array(clusters, dtype=pd.UInt32Dtype()))
+
+
+@print_docstring()
+def test_hash_bits_benchmark(tmp_path):
+    """Compare throughput and memory of 32- and 64-bit synteny hashes."""
+    clusters = _random_clusters(N_PROTEINS, N_CLUSTERS)
+    results = {}
+    for bits in (32, 64):
+        hasher = SyntenyBlockHasher(k=3, hash_bits=bits)
+        tracemalloc.start()
+        start = time.perf_counter()
+        hash_fr = hasher.calculate(clusters)
+        elapsed = time.perf_counter() - start
+        unused_current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        hashes = hash_fr[hasher.hash_name()]
+        assert hashes.dtype == hasher.hash_dtype()
+        unique_fr = pd.DataFrame(
+            {"count": hashes.value_counts().sort_index()}
+        )
+        table = SharedHashTable.publish(
+            unique_fr, tmp_path / f"table{bits}", key_dtype=hasher.key_dtype()
+        )
+        joined = table.join(hash_fr, hasher.hash_name())
+        assert (joined["count"] >= 1).all()
+        results[bits] = {
+            "hashes/s": len(hash_fr) / elapsed,
+            "peak_MB": peak / 1024.0 / 1024.0,
+            "column_MB": hashes.memory_usage(deep=True) / 1024.0 / 1024.0,
+            "table_MB": sum(
+                f.stat().st_size for f in table.table_dir.glob("*.npy")
+            )
+            / 1024.0
+            / 1024.0,
+            "distinct": len(unique_fr),
+        }
+        table.delete()
+    report = pd.DataFrame(results).T
+    report.index.name = "bits"
+    print(report.to_string(float_format="%.2f"))
+    assert results[64]["distinct"] >= results[32]["distinct"]
+    assert results[64]["column_MB"] > results[32]["column_MB"]
+
+
+@print_docstring()
+def test_merged_sketches(tmp_path):
+    """Check that filters merged across workers match a single filter."""
+    rng = np.random.default_rng(0)
+    proteomes = [
+        np.unique(rng.integers(0, 50000, 20000, dtype=np.uint64))
+        for unused_i in range(6)
+    ]
+    whole = SeenTwiceFilter.for_size(sum(len(p) for p in proteomes))
+    parts = [SeenTwiceFilter(n_bits=whole.n_bits) for unused_i in range(3)]
+    for i, hashes in enumerate(proteomes):
+        whole.add(hashes)
+        parts[i % 3].add(hashes)
+    merged = parts[0].merge(parts[1]).merge(parts[2])
+    assert (merged.once == whole.once).all()
+    assert (merged.twice == whole.twice).all()
+    shared = merged.publish(tmp_path / "sketch")
+    for hashes in proteomes:
+        mask = shared.maybe_shared(hashes)
+        assert (mask == whole.maybe_shared(hashes)).all()
+    shared.delete()
+    assert not (tmp_path / "sketch").exists()
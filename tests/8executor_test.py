@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""Tests for dask execution backends."""
+# standard library imports
+import threading
+import time
+
+# third-party imports
+import pytest
+
+# module imports
+from azulejo.executor import SCHEDULERS
+from azulejo.executor import Executor
+from azulejo.instrument import run_profiled
+from azulejo.instrument import write_profile_report
+
+from . import print_docstring
+
+# global constants
+N_ITEMS = 20
+RUNNING = []
+RUNNING_LOCK = threading.Lock()
+
+
+def _scale(item, factor=1):
+    """Return item times factor."""
+    return item * factor
+
+
+@print_docstring()
+def test_local_schedulers():
+    """Test that local schedulers map in order."""
+    expected = [i * 3 for i in range(N_ITEMS)]
+    for scheduler in SCHEDULERS[:-1]:
+        executor = Executor(scheduler=scheduler, n_workers=2, partition_size=3)
+        assert executor.map(_scale, range(N_ITEMS), factor=3) == expected
+    assert Executor.from_options({"parallel": False}).scheduler == "sync"
+    assert Executor.from_options({"parallel": True}).worker_count() >= 1
+
+
+def _count_running(item, sleep=0.01):
+    """Return item and the number of tasks running with it."""
+    with RUNNING_LOCK:
+        RUNNING.append(item)
+        n_running = len(RUNNING)
+    time.sleep(sleep)
+    with RUNNING_LOCK:
+        RUNNING.remove(item)
+    return item, n_running
+
+
+@print_docstring()
+def test_memory_admission():
+    """Test that tasks run concurrently only while estimates fit."""
+    executor = Executor(scheduler="threads", n_workers=4, max_memory=100.0)
+    task_mb = [60.0 if i % 2 else 30.0 for i in range(N_ITEMS)]
+    results = executor.map(_count_running, range(N_ITEMS), task_mb=task_mb)
+    assert [item for item, unused_n in results] == list(range(N_ITEMS))
+    assert max(n_running for unused_item, n_running in results) <= 2
+    # a task over budget runs alone
+    results = executor.map(
+        _count_running, range(4), task_mb=[200.0] * 4, stage="big"
+    )
+    assert max(n_running for unused_item, n_running in results) == 1
+
+
+@print_docstring()
+def test_distributed_scheduler():
+    """Test mapping on a LocalCluster."""
+    distributed = pytest.importorskip("distributed")
+    with distributed.LocalCluster(
+        n_workers=2, threads_per_worker=1, processes=False
+    ) as cluster, distributed.Client(cluster) as client:
+        executor = Executor(
+            scheduler="distributed", client=client, partition_size=3
+        )
+        assert executor.map(_scale, range(N_ITEMS), factor=3) == [
+            i * 3 for i in range(N_ITEMS)
+        ]
+
+
+@print_docstring()
+def test_profiled_tasks(tmp_path):
+    """Test that each profiled task writes a dump of its own."""
+    assert Executor(scheduler="threads").shares_processes()
+    assert not Executor(scheduler="processes").shares_processes()
+    profile_dir = tmp_path / "profile"
+    profile_dir.mkdir()
+    executor = Executor(scheduler="processes", n_workers=2)
+    results = executor.map(
+        run_profiled,
+        range(N_ITEMS),
+        pass_func=_scale,
+        profile_dir=profile_dir,
+        factor=3,
+    )
+    assert results == [i * 3 for i in range(N_ITEMS)]
+    assert len(list(profile_dir.glob("*.pstats"))) == N_ITEMS
+    report_path = tmp_path / "report.txt"
+    write_profile_report(profile_dir, report_path, tmp_path / "all.pstats")
+    assert report_path.read_text().startswith(
+        f"Merged profile of {N_ITEMS} blocks"
+    )
+    assert not profile_dir.exists()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""Tests for stage manifests and the tool cache."""
+# standard library imports
+import time
+
+# module imports
+from azulejo.manifest import SET_ITEM
+from azulejo.manifest import MANIFEST_FILE
+from azulejo.manifest import Manifest
+from azulejo.manifest import print_status
+from azulejo.toolcache import ToolCache
+
+from . import help_check
+from . import print_docstring
+
+# global constants
+SUBCOMMAND = "status"
+
+
+def test_subcommand_help():
+    """Test subcommand help message."""
+    help_check(SUBCOMMAND)
+
+
+@print_docstring()
+def test_manifest(tmp_path):
+    """Test that records go stale when files or parameters change."""
+    input_path = tmp_path / "p0" / "in.tsv"
+    input_path.parent.mkdir()
+    input_path.write_text("a\t1\n")
+    output_path = tmp_path / "out.tsv"
+    output_path.write_text("b\t2\n")
+    manifest = Manifest.load(tmp_path)
+    specs = {
+        SET_ITEM: manifest.spec([input_path], [output_path], params={"k": 2})
+    }
+    assert manifest.stale("test", specs) == {SET_ITEM: "not run"}
+    manifest.record("test", specs)
+    manifest = Manifest.load(tmp_path)
+    assert manifest.is_current("test", specs)
+    assert manifest.stale("test") == {}
+    input_path.write_text("a\t33\n")
+    assert manifest.stale("test") == {SET_ITEM: "p0/in.tsv changed"}
+    input_path.write_text("a\t1\n")
+    assert manifest.stale("test") == {}
+    specs[SET_ITEM]["params"]["k"] = 3
+    assert manifest.stale("test", specs) == {SET_ITEM: "params changed"}
+    output_path.unlink()
+    assert manifest.stale("test") == {SET_ITEM: "out.tsv missing"}
+
+
+@print_docstring()
+def test_status_read_only(tmp_path):
+    """Test that status checks files without rewriting the manifest."""
+    output_path = tmp_path / "out.tsv"
+    output_path.write_text("b\t2\n")
+    manifest = Manifest.load(tmp_path)
+    manifest.record(
+        "synteny", {SET_ITEM: manifest.spec([], [output_path])}
+    )
+    saved = (tmp_path / MANIFEST_FILE).read_text()
+    # a changed file would update the digest cache of a saved manifest
+    time.sleep(0.01)
+    output_path.write_text("b\t3\n")
+    print_status(tmp_path)
+    assert (tmp_path / MANIFEST_FILE).read_text() == saved
+
+
+@print_docstring()
+def test_tool_cache(tmp_path):
+    """Test that tool outputs are reused for identical inputs."""
+    start = time.time() - 1.0
+    cache = ToolCache(cache_dir=tmp_path / "cache", max_mb=1)
+    input_path = tmp_path / "in.txt"
+    input_path.write_text("abc\n")
+    outputs = {"copy": tmp_path / "out.txt"}
+    args = ["{source}", "{copy}"]
+    assert not cache.run("cp", args, {"source": input_path}, outputs)
+    assert cache.run("cp", args, {"source": input_path}, outputs)
+    assert outputs["copy"].read_text() == "abc\n"
+    assert outputs["copy"].stat().st_nlink == 2
+    assert cache.run("cp", args, {"source": input_path}, outputs, link=False)
+    assert outputs["copy"].stat().st_nlink == 1
+    input_path.write_text("abcd\n")
+    assert not cache.run("cp", args, {"source": input_path}, outputs)
+    assert outputs["copy"].read_text() == "abcd\n"
+    cache.log_report("test", start)
+    assert len(list(cache.cache_dir.glob("*/*"))) == 2
+    cache.max_mb = 0
+    cache.log_report("test", start)
+    assert not list(cache.cache_dir.glob("*/*"))
@@ -8,10 +8,15 @@ import sys
 from pathlib import Path
 
 # third-party imports
+import numpy as np
+import pandas as pd
 import pytest
 import sh
 from sh import ErrorReturnCode
 
+# module imports
+from azulejo.common import write_tsv_or_parquet
+
 # global constants
 W05_INPUTS = [
     "glyso.W05.gnm1.ann1.T47J.protein_primaryTranscript.faa",
@@ -29,7 +34,15 @@ INGEST_OUTPUTS = [
     f"{SET_DIR}/{f}"
     for f in (
         ["fragments.tsv", "proteomes.tsv"]
-        + [f"{subdir}proteins.parq" for subdir in PROT_SUBDIRS]
+        + [
+            f"{subdir}{f}"
+            for subdir in PROT_SUBDIRS
+            for f in (
+                "proteins.parq",
+                "sequences.bin",
+                "sequences.offsets.npy",
+            )
+        ]
     )
 ]
 
@@ -42,6 +55,15 @@ HOMOLOGY_OUTPUTS = [
             "homology_cluster_hist.tsv",
             "homology-stats.tsv",
         ]
+        + [
+            f"cluster_order/{f}"
+            for f in (
+                "clusters.npy",
+                "frag_offsets.npy",
+                "proteome_offsets.npy",
+                "names.json",
+            )
+        ]
         + [f"{subdir}proteins.hom.parq" for subdir in PROT_SUBDIRS]
     )
 ]
@@ -49,11 +71,20 @@ HOMOLOGY_OUTPUTS = [
 SYNTENY_OUTPUTS = [
     f"{SET_DIR}/{f}"
     for f in (
-        ["proteomes.hom.syn.parq"]  # "clusters.syn.parq",
+        [
+            "proteomes.hom.syn.parq",
+            "homology_clusters.syn.parq",
+            "synteny_anchor_props.parq",
+            "synteny_anchors.tsv",
+        ]
         + [f"{subdir}proteins.hom.syn.parq" for subdir in PROT_SUBDIRS]
     )
 ]
 
+CLUSTERED_SET_PROTEOMES = 4
+CLUSTERED_SET_FRAGMENTS = 2
+CLUSTERED_SET_FRAGMENT_LEN = 60
+CLUSTERED_SET_CLUSTERS = 40
 TSV_TEST_FILE = f"{SET_DIR}/{PROT_SUBDIRS[0]}/proteins.hom.syn.parq"
 TSV_OUTPUT_FILE = "proteins.hom.syn.tsv"
 
@@ -126,3 +157,89 @@ def run_azulejo(args, component):
     except ErrorReturnCode as errors:
         print(errors)
         pytest.fail(f"{component} failed")
+
+
+def write_clustered_set(set_path, seed=0):
+    """Write a small homology-clustered set of rearranged proteomes.
+
+    The set has no cluster order, so fragments are grouped by synteny.
+    """
+    rng = np.random.default_rng(seed)
+    n_proteins = CLUSTERED_SET_FRAGMENTS * CLUSTERED_SET_FRAGMENT_LEN
+    ancestor = rng.integers(0, CLUSTERED_SET_CLUSTERS, n_proteins)
+    frag_idx = np.repeat(
+        np.arange(CLUSTERED_SET_FRAGMENTS), CLUSTERED_SET_FRAGMENT_LEN
+    )
+    paths = []
+    for proteome_no in range(CLUSTERED_SET_PROTEOMES):
+        clusters = pd.array(ancestor, dtype=pd.UInt32Dtype())
+        clusters[rng.random(n_proteins) < 0.1] = pd.NA
+        start = rng.integers(0, n_proteins - 8)
+        clusters[start : start + 8] = clusters[start : start + 8][::-1]
+        proteins = pd.DataFrame(
+            {
+                "hom.cluster": clusters,
+                "frag.id": pd.Categorical([f"chr{i}" for i in frag_idx]),
+                "frag.pos": pd.array(
+                    np.tile(
+                        np.arange(CLUSTERED_SET_FRAGMENT_LEN),
+                        CLUSTERED_SET_FRAGMENTS,
+                    ),
+                    dtype=pd.UInt32Dtype(),
+                ),
+                "hom.cl_size": pd.array(
+                    np.full(n_proteins, CLUSTERED_SET_PROTEOMES),
+                    dtype=pd.UInt32Dtype(),
+                ),
+                "frag.direction": pd.Categorical(["+"] * n_proteins),
+                "frag.idx": pd.array(frag_idx, dtype=pd.UInt32Dtype()),
+                "frag.is_chr": pd.Categorical(
+                    ["y"] * n_proteins, categories=["y", "n"]
+                ),
+                "frag.is_plas": pd.Categorical(
+                    ["n"] * n_proteins, categories=["y", "n"]
+                ),
+                "frag.is_scaf": pd.Categorical(
+                    ["n"] * n_proteins, categories=["y", "n"]
+                ),
+                "frag.prot_count": pd.array(
+                    np.full(n_proteins, CLUSTERED_SET_FRAGMENT_LEN),
+                    dtype=pd.UInt32Dtype(),
+                ),
+                "frag.start": pd.array(
+                    np.arange(n_proteins) * 1000, dtype=pd.UInt64Dtype()
+                ),
+                "prot.len": pd.array(
+                    rng.integers(50, 500, n_proteins), dtype=pd.UInt32Dtype()
+                ),
+                "prot.m_start": pd.array(
+                    [True] * n_proteins, dtype=pd.BooleanDtype()
+                ),
+                "prot.n_ambig": pd.array(
+                    np.zeros(n_proteins), dtype=pd.UInt32Dtype()
+                ),
+                "prot.no_stop": pd.array(
+                    [False] * n_proteins, dtype=pd.BooleanDtype()
+                ),
+            },
+            index=pd.Index(
+                [f"p{proteome_no}.g{i}" for i in range(n_proteins)],
+                name="prot.id",
+            ),
+        )
+        proteome_path = set_path / f"p{proteome_no}"
+        proteome_path.mkdir(parents=True)
+        write_tsv_or_parquet(proteins, proteome_path / "proteins.hom.parq")
+        paths.append(f"{set_path.name}.p{proteome_no}")
+    proteomes = pd.DataFrame({"path": paths})
+    proteomes.index.name = "prot.idx"
+    write_tsv_or_parquet(proteomes, set_path / "proteomes.hom.parq")
+    clusters = pd.DataFrame(
+        {
+            "size": pd.array(
+                np.full(CLUSTERED_SET_CLUSTERS, 1), dtype=pd.UInt32Dtype()
+            )
+        }
+    )
+    clusters.index.name = "hom.cluster"
+    write_tsv_or_parquet(clusters, set_path / "homology_clusters.parq")